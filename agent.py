@@ -217,6 +217,15 @@ class AgentConfig:
     prompts_subdir: str = ""
     memory_subdir: str = ""
     knowledge_subdirs: list[str] = field(default_factory=lambda: ["default", "custom"])
+    knowledge_import_workers: int = 0
+    memory_index_type: str = "auto"
+    memory_index_promote_at: int = 50000
+    memory_quantization: str = "none"
+    memory_rerank_factor: int = 4
+    memory_search_mode: str = "vector"
+    embeddings_cache_size_mb: int = 512
+    summary_cache_size_mb: int = 64
+    rate_limit_estimate_tokens: bool = False
     code_exec_docker_enabled: bool = False
     code_exec_docker_name: str = "A0-dev"
     code_exec_docker_image: str = "frdel/agent-zero-run:development"
@@ -278,6 +287,8 @@ class Agent:
     DATA_NAME_SUPERIOR = "_superior"
     DATA_NAME_SUBORDINATE = "_subordinate"
     DATA_NAME_CTX_WINDOW = "ctx_window"
+    # prompt of the last context window, not saved with the chat
+    DATA_NAME_CTX_PROMPT = "_ctx_prompt"
 
     def __init__(
         self, number: int, config: AgentConfig, context: AgentContext | None = None
@@ -411,17 +422,22 @@ class Agent:
         #     extras += history.Message(False, content=extra).output()
         # for extra in loop_data.extras_temporary.values():
         #     extras += history.Message(False, content=extra).output()
-        extras = history.Message(
+        extras_msg = history.Message(
             False, 
             content=self.read_prompt("agent.context.extras.md", extras=dirty_json.stringify(
                 {**loop_data.extras_persistent, **loop_data.extras_temporary}
-                ))).output()
+                )))
+        extras = extras_msg.output()
         loop_data.extras_temporary.clear()
 
-        # convert history + extras to LLM format
-        history_langchain: list[BaseMessage] = history.output_langchain(
-            loop_data.history_output + extras
-        )
+        # convert history + extras to LLM format, history keeps converted messages
+        # between iterations unless extensions edited its output
+        if self.history.matches_output(loop_data.history_output):
+            history_langchain = self.history.output_langchain(extras)
+        else:
+            history_langchain = history.output_langchain(
+                loop_data.history_output + extras
+            )
 
         # build chain from system prompt, message history and model
         system_text = "\n\n".join(loop_data.system)
@@ -433,14 +449,14 @@ class Agent:
             ]
         )
 
-        # store as last context window content
+        # store as last context window content, text is formatted only when requested
+        self.set_data(Agent.DATA_NAME_CTX_PROMPT, prompt)
         self.set_data(
             Agent.DATA_NAME_CTX_WINDOW,
             {
-                "text": prompt.format(),
                 "tokens": self.history.get_tokens()
-                + tokens.approximate_tokens(system_text)
-                + tokens.approximate_tokens(history.output_text(extras)),
+                + tokens.approximate_tokens_cached(system_text)
+                + extras_msg.tokens,
             },
         )
 
@@ -613,7 +629,7 @@ class Agent:
             await self.handle_intervention()  # wait for intervention and handle it, if paused
 
             content = models.parse_chunk(chunk)
-            limiter.add(output=tokens.approximate_tokens(content))
+            limiter.add(output=self.rate_limit_tokens(content))
             response += content
 
             if callback:
@@ -638,7 +654,7 @@ class Agent:
             await self.handle_intervention()  # wait for intervention and handle it, if paused
 
             content = models.parse_chunk(chunk)
-            limiter.add(output=tokens.approximate_tokens(content))
+            limiter.add(output=self.rate_limit_tokens(content))
             response += content
 
             if callback:
@@ -673,11 +689,17 @@ class Agent:
             model_config.limit_input,
             model_config.limit_output,
         )
-        limiter.add(input=tokens.approximate_tokens(input))
+        limiter.add(input=self.rate_limit_tokens(input))
         limiter.add(requests=1)
         await limiter.wait(callback=wait_callback)
         return limiter
 
+    def rate_limit_tokens(self, text: str) -> int:
+        # length based estimate skips encoding long prompts, counted exactly unless enabled
+        if self.config.rate_limit_estimate_tokens:
+            return tokens.estimate_tokens(text)
+        return tokens.approximate_tokens(text)
+
     async def handle_intervention(self, progress: str = ""):
         while self.context.paused:
             await asyncio.sleep(0.1)  # wait if paused
@@ -0,0 +1,126 @@
+import os
+import resource
+import time
+import uuid
+from contextlib import contextmanager
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.embeddings import Embeddings
+
+from python.helpers.memory import Memory, MyFaiss
+from python.helpers.memory_docstore import LazyDocstore
+from python.helpers.memory_wal import MemoryWal
+from python.helpers.print_style import PrintStyle
+
+WORDS = "policy claim premium deductible coverage agent customer insurer damage vehicle health travel liability contract renewal invoice".split()
+
+
+class RandomEmbeddings(Embeddings):
+    # benchmarks log precomputed vectors, the model is only asked for queries
+    def __init__(self, dim: int):
+        self.dim = dim
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return vectors(1, self.dim, seed=hash(text) % 2**32)[0].tolist()
+
+
+def vectors(n: int, dim: int, seed: int = 0, clusters: int = 0) -> np.ndarray:
+    # unit vectors, grouped around centers like real embeddings when clusters is set
+    rng = np.random.default_rng(seed)
+    if clusters:
+        centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+        data = centers[rng.integers(0, clusters, n)]
+        data += rng.standard_normal((n, dim)).astype(np.float32)
+    else:
+        data = rng.standard_normal((n, dim)).astype(np.float32)
+    data /= np.linalg.norm(data, axis=1, keepdims=True)
+    return data
+
+
+def texts(n: int, words: int = 60, seed: int = 0) -> list[str]:
+    rng = np.random.default_rng(seed)
+    return [" ".join(rng.choice(WORDS, words)) for _ in range(n)]
+
+
+def new_db(db_dir: str, dim: int, index=None) -> MyFaiss:
+    db = MyFaiss(
+        embedding_function=RandomEmbeddings(dim),
+        index=index if index is not None else faiss.IndexFlatIP(dim),
+        docstore=LazyDocstore(),
+        index_to_docstore_id={},
+        distance_strategy=DistanceStrategy.COSINE,
+        relevance_score_fn=Memory._cosine_normalizer,
+    )
+    db.wal = MemoryWal(db_dir)
+    Memory._save_db_file(db, db_dir)
+    return db
+
+
+def insert_record(texts: list[str], vectors: np.ndarray, area: str = "main") -> dict:
+    ids = [str(uuid.uuid4()) for _ in texts]
+    return {
+        "op": "add",
+        "ids": ids,
+        "texts": texts,
+        "metadatas": [{"id": id, "area": area} for id in ids],
+        "vectors": vectors,
+    }
+
+
+def fill(db: MyFaiss, data: np.ndarray, batch: int = 1000) -> list[str]:
+    # log and apply in batches the way knowledge imports do
+    ids = []
+    for start in range(0, len(data), batch):
+        chunk = data[start : start + batch]
+        record = insert_record(texts(len(chunk), seed=start), chunk)
+        db.wal.append(record)  # type: ignore
+        Memory._apply_record(db, record)
+        ids += record["ids"]
+    return ids
+
+
+def use_plain_dirs():
+    # memory subdirs are absolute paths in the benchmarks, their output stays out of the logs folder
+    Memory._abs_db_dir = staticmethod(lambda subdir: subdir)  # type: ignore
+    PrintStyle.log_file_path = os.devnull
+
+
+def written_bytes() -> int:
+    # bytes handed to write() by this process, linux only
+    with open("/proc/self/io") as f:
+        for line in f:
+            if line.startswith("wchar:"):
+                return int(line.split()[1])
+    return 0
+
+
+def peak_rss_mb() -> float:
+    # VmHWM starts over in a new process, ru_maxrss keeps the parent's peak across exec
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def dir_size(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+    )
+
+
+@contextmanager
+def timer(result: dict, key: str):
+    start = time.perf_counter()
+    yield
+    result[key] = time.perf_counter() - start
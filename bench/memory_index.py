@@ -0,0 +1,104 @@
+"""
+Recall@k against query latency for the memory index types, on clustered
+unit vectors with exact flat search as ground truth.
+
+    python -m bench.memory_index --docs 100000 --k 10
+"""
+
+import argparse
+import time
+
+import faiss
+import numpy as np
+
+from bench import common
+from python.helpers import memory_index
+from python.helpers.memory_index import IndexConfig
+
+# search effort swept per index type: efSearch for hnsw, nprobe for ivf
+SWEEP = {
+    "flat": [None],
+    "hnsw": [16, 32, 64, 128, 256],
+    "ivf_flat": [4, 8, 16, 32, 64],
+    "ivf_pq": [8, 16, 32, 64],
+}
+
+
+def set_effort(index: faiss.Index, effort: int | None):
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = effort
+    elif isinstance(index, faiss.IndexIVF):
+        index.nprobe = effort
+
+
+def recall(found: np.ndarray, truth: np.ndarray) -> float:
+    k = truth.shape[1]
+    return float(np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)]))
+
+
+def query(
+    index: faiss.Index, queries: np.ndarray, k: int, rerank: np.ndarray | None = None
+) -> tuple[np.ndarray, float]:
+    # one query at a time like memory searches, returns ids and ms per query
+    found = np.empty((len(queries), k), dtype=np.int64)
+    fetch = k * IndexConfig().rerank_factor if rerank is not None else k
+    start = time.perf_counter()
+    for i, q in enumerate(queries):
+        _, ids = index.search(q[None], fetch)  # type: ignore
+        ids = ids[0]
+        if rerank is not None:
+            # exact scores from the full vectors, as quantized memory searches do
+            ids = ids[ids >= 0]
+            ids = ids[np.argsort(-(rerank[ids] @ q))[:k]]
+        found[i, : len(ids)] = ids
+    return found, (time.perf_counter() - start) / len(queries) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--docs", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--types", default="flat,hnsw,ivf_flat,ivf_pq")
+    # 0 for uniform vectors, the hardest case for approximate indexes
+    parser.add_argument("--clusters", type=int, default=-1, help="default docs / 100")
+    args = parser.parse_args()
+
+    clusters = args.docs // 100 if args.clusters < 0 else args.clusters
+    data = common.vectors(args.docs, args.dim, clusters=clusters)
+    # queries near stored vectors, like recalling a paraphrased memory
+    rng = np.random.default_rng(1)
+    queries = data[rng.integers(0, args.docs, args.queries)]
+    noise = rng.standard_normal(queries.shape).astype(np.float32)
+    queries = queries + 0.5 * noise / np.linalg.norm(noise, axis=1, keepdims=True)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    exact = faiss.IndexFlatIP(args.dim)
+    exact.add(data)  # type: ignore
+    _, truth = exact.search(queries, args.k)  # type: ignore
+
+    config = IndexConfig()
+    print(f"{args.docs} vectors, dim {args.dim}, {args.queries} queries, recall@{args.k}")
+    print(f"{'type':9} {'effort':>6} {'build s':>8} {'MiB':>7} {f'recall@{args.k}':>10} {'ms/query':>9}")
+    for index_type in args.types.split(","):
+        start = time.perf_counter()
+        index = memory_index.create_index(index_type, args.dim, config, data)  # type: ignore
+        index.add(data)  # type: ignore
+        build = time.perf_counter() - start
+        size = len(faiss.serialize_index(index)) / 2**20
+        # product quantized results are re-ranked with the full vectors
+        reranks = [None, data] if index_type == "ivf_pq" else [None]
+        for effort in SWEEP[index_type]:
+            set_effort(index, effort)
+            for rerank in reranks:
+                found, ms = query(index, queries, args.k, rerank)
+                name = index_type + ("+rr" if rerank is not None else "")
+                print(
+                    f"{name:9} {effort or '-':>6} {build:8.1f} {size:7.1f}"
+                    f" {recall(found, truth):10.3f} {ms:9.3f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
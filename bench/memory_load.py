@@ -0,0 +1,123 @@
+"""
+Cold start of a memory database: time to open the snapshot and answer a
+first search, and peak RSS of the loading process. Stores are built once
+per size; legacy index.pkl stores load the whole pickled docstore.
+
+    python -m bench.memory_load --sizes 10000,100000,1000000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import faiss
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.documents import Document
+
+from bench import common
+from python.helpers.memory import Memory, MyFaiss
+from python.helpers.memory_wal import MemoryWal
+
+# documents applied between compactions while building, bounds the builder's memory
+BUILD_BATCH = 100000
+
+
+def build(db_dir: str, size: int, dim: int):
+    db = common.new_db(db_dir, dim)
+    for start in range(0, size, BUILD_BATCH):
+        count = min(BUILD_BATCH, size - start)
+        data = common.vectors(count, dim, seed=start)
+        for offset in range(0, count, 1000):
+            chunk = data[offset : offset + 1000]
+            record = common.insert_record(common.texts(len(chunk), seed=offset), chunk)
+            Memory._apply_record(db, record)
+        # documents move from memory to the mapped snapshot
+        asyncio.run(Memory.compact(db, force=True))
+
+
+def build_legacy(db_dir: str, size: int, dim: int):
+    index = faiss.IndexFlatIP(dim)
+    docs = {}
+    for start in range(0, size, BUILD_BATCH):
+        count = min(BUILD_BATCH, size - start)
+        index.add(common.vectors(count, dim, seed=start))  # type: ignore
+        for i, text in enumerate(common.texts(count)):
+            id = str(start + i)
+            docs[id] = Document(text, metadata={"id": id, "area": "main"})
+    mapping = {i: str(i) for i in range(size)}
+    FAISS(common.RandomEmbeddings(dim), index, InMemoryDocstore(docs), mapping).save_local(db_dir)
+
+
+def load(db_dir: str, dim: int) -> dict:
+    # runs in a fresh process, reports to stdout
+    before = common.peak_rss_mb()
+    start = time.perf_counter()
+    db = MyFaiss.load_snapshot(
+        folder_path=db_dir,
+        embeddings=common.RandomEmbeddings(dim),
+        distance_strategy=DistanceStrategy.COSINE,
+        relevance_score_fn=Memory._cosine_normalizer,
+    )
+    db.wal = MemoryWal(db_dir)
+    Memory._replay_wal(db)
+    loaded = time.perf_counter() - start
+    db.similarity_search_with_score_by_vector(common.vectors(1, dim, seed=7)[0].tolist(), k=10)
+    searched = time.perf_counter() - start
+    return {
+        "load": loaded,
+        "first_search": searched - loaded,
+        "rss": common.peak_rss_mb(),
+        "rss_imports": before,
+    }
+
+
+def measure(db_dir: str, dim: int) -> dict:
+    out = subprocess.run(
+        [sys.executable, "-m", "bench.memory_load", "--load", db_dir, "--dim", str(dim)],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--legacy-max", type=int, default=100000, help="largest legacy store built")
+    parser.add_argument("--load", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    common.use_plain_dirs()
+    if args.load:
+        print(json.dumps(load(args.load, args.dim)))
+        return
+
+    print(f"dim {args.dim}, page cache warm, peak RSS of the loading process")
+    print(f"{'chunks':>8} {'format':7} {'disk MiB':>9} {'load s':>7} {'search ms':>9} {'peak MiB':>9} {'imports':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in map(int, args.sizes.split(",")):
+            stores = [("mmap", build)]
+            if size <= args.legacy_max:
+                stores.append(("pickle", build_legacy))
+            for name, builder in stores:
+                db_dir = os.path.join(tmp, f"{name}-{size}")
+                builder(db_dir, size, args.dim)
+                result = measure(db_dir, args.dim)
+                print(
+                    f"{size:8} {name:7} {common.dir_size(db_dir) / 2**20:9.1f}"
+                    f" {result['load']:7.2f} {result['first_search'] * 1000:9.1f}"
+                    f" {result['rss']:9.0f} {result['rss_imports']:8.0f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
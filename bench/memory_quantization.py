@@ -0,0 +1,100 @@
+"""
+RAM against recall of vector compression: the store is rebuilt with each
+quantization, then searched with several re-rank factors. Recall@k is
+measured against exact search on the full vectors.
+
+    python -m bench.memory_quantization --docs 100000 --index-type flat
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import faiss
+import numpy as np
+
+from bench import common
+from bench.memory_load import measure
+from python.helpers import memory_index
+from python.helpers.memory import Memory
+from python.helpers.memory_index import IndexConfig
+
+QUANTIZATIONS = ["none", "sq_fp16", "sq8", "pq"]
+RERANK_FACTORS = [1, 4, 10]
+
+
+def build(db_dir: str, data: np.ndarray, config: IndexConfig) -> tuple:
+    db = common.new_db(db_dir, data.shape[1])
+    ids = []
+    for start in range(0, len(data), 1000):
+        chunk = data[start : start + 1000]
+        record = common.insert_record([""] * len(chunk), chunk)
+        Memory._apply_record(db, record)
+        ids += record["ids"]
+    db.index_config = config
+    # the background rebuild that applies compression, it ends with a compaction
+    asyncio.run(Memory.rebuild_index(db, "bench"))
+    return db, ids
+
+
+def search(db, queries: np.ndarray, k: int) -> tuple[list[list[str]], float]:
+    found = []
+    start = time.perf_counter()
+    for q in queries:
+        results = db.similarity_search_with_score_by_vector(q.tolist(), k=k)
+        found.append([doc.metadata["id"] for doc, _ in results])
+    return found, (time.perf_counter() - start) / len(queries) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--docs", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--index-type", default="flat", help="flat, hnsw or ivf_flat")
+    args = parser.parse_args()
+
+    common.use_plain_dirs()
+    data = common.vectors(args.docs, args.dim, clusters=args.docs // 100)
+    rng = np.random.default_rng(1)
+    queries = data[rng.integers(0, args.docs, args.queries)]
+    noise = rng.standard_normal(queries.shape).astype(np.float32)
+    queries = queries + 0.5 * noise / np.linalg.norm(noise, axis=1, keepdims=True)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    exact = faiss.IndexFlatIP(args.dim)
+    exact.add(data)  # type: ignore
+    _, truth = exact.search(queries, args.k)  # type: ignore
+
+    print(f"{args.docs} vectors, dim {args.dim}, {args.index_type} index, recall@{args.k}")
+    print(
+        f"{'quantization':12} {'index MiB':>9} {'disk f32':>9} {'load RSS':>9}"
+        f" {'rerank':>6} {f'recall@{args.k}':>10} {'ms/query':>9}"
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        for quantization in QUANTIZATIONS:
+            db_dir = os.path.join(tmp, quantization)
+            config = IndexConfig(type=args.index_type, promote_at=0, quantization=quantization)  # type: ignore
+            db, ids = build(db_dir, data, config)
+            truth_ids = [[ids[i] for i in row] for row in truth]
+            index_size = len(memory_index.serialize_index(db.index)) / 2**20
+            vectors_size = os.path.getsize(db.full_vectors.path) / 2**20 if db.full_vectors else 0
+            # peak RSS of a fresh process opening the store and searching once
+            rss = measure(db_dir, args.dim)["rss"]
+            for factor in RERANK_FACTORS if db.full_vectors else [1]:
+                db.index_config.rerank_factor = factor
+                found, ms = search(db, queries, args.k)
+                recall = np.mean(
+                    [len(set(f) & set(t)) / args.k for f, t in zip(found, truth_ids)]
+                )
+                print(
+                    f"{quantization:12} {index_size:9.1f} {vectors_size:9.1f} {rss:9.0f}"
+                    f" {factor:6} {recall:10.3f} {ms:9.3f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Delete by query: one embedding and one range search against the old loop
+of k=100 threshold searches, each embedding the query again.
+
+    python -m bench.memory_range --docs 20000 --embed-ms 20
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import faiss
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from bench import common
+from python.helpers import memory_cache
+from python.helpers.memory import Memory
+
+AREAS = ["main", "fragments"]
+
+
+class QueryEmbeddings(Embeddings):
+    # the query vector after a simulated model latency, calls are counted
+    def __init__(self, vector: np.ndarray, delay: float):
+        self.vector = vector.tolist()
+        self.delay = delay
+        self.calls = 0
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        self.calls += 1
+        time.sleep(self.delay)
+        return self.vector
+
+    async def aembed_query(self, text: str) -> list[float]:
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return self.vector
+
+
+def fake_agent():
+    async def rate_limiter(*args, **kwargs):
+        pass
+
+    config = type("Config", (), {"embeddings_model": None, "memory_search_mode": "vector"})
+    return type("Agent", (), {"config": config, "rate_limiter": staticmethod(rate_limiter)})
+
+
+def old_delete(data, embedder, threshold: float, filter: str) -> tuple[int, float]:
+    # langchain FAISS with per document eval, as before
+    docs = {
+        str(i): Document("", metadata={"id": str(i), "area": AREAS[i % 2]})
+        for i in range(len(data))
+    }
+    index = faiss.IndexFlatIP(data.shape[1])
+    index.add(data)  # type: ignore
+    db = FAISS(
+        embedder,
+        index,
+        InMemoryDocstore(docs),
+        {i: str(i) for i in range(len(data))},
+        distance_strategy=DistanceStrategy.COSINE,
+        relevance_score_fn=Memory._cosine_normalizer,
+    )
+
+    def comparator(metadata: dict):
+        try:
+            return eval(filter, {}, metadata)
+        except Exception:
+            return False
+
+    removed = 0
+    start = time.perf_counter()
+    while True:
+        found = db.similarity_search_with_relevance_scores(  # warns when nothing matched
+            "query",
+            k=100,
+            score_threshold=threshold,
+            filter=comparator if filter else None,
+        )
+        ids = [doc.metadata["id"] for doc, _ in found]
+        if ids:
+            db.delete(ids)
+            removed += len(ids)
+        if len(ids) < 100:
+            break
+    return removed, time.perf_counter() - start
+
+
+def new_delete(db_dir, data, embedder, threshold: float, filter: str) -> tuple[int, float]:
+    db = common.new_db(db_dir, data.shape[1])
+    for area in AREAS:
+        # same documents and areas as the old store
+        chunk = data[AREAS.index(area) :: 2]
+        record = common.insert_record([""] * len(chunk), chunk, area=area)
+        db.wal.append(record)  # type: ignore
+        Memory._apply_record(db, record)
+    db.embedding_function = embedder
+    memory = Memory(fake_agent(), db, db_dir)  # type: ignore
+    memory_cache.embedding_cache.clear()
+
+    start = time.perf_counter()
+    removed = asyncio.run(memory.delete_documents_by_query("query", threshold, filter))
+    return len(removed), time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--docs", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--embed-ms", type=float, default=20, help="simulated model latency")
+    args = parser.parse_args()
+
+    common.use_plain_dirs()
+    data = common.vectors(args.docs, args.dim, clusters=args.docs // 100)
+    query = data[0] + 0.5 * common.vectors(1, args.dim, seed=1)[0]
+    query /= np.linalg.norm(query)
+    scores = np.sort(data @ query)[::-1]
+
+    print(f"{args.docs} docs, dim {args.dim}, {args.embed_ms:g} ms per embedding")
+    print(
+        f"{'target':>7} {'filter':>6} {'old ms':>9} {'embeds':>6} {'deleted':>7}"
+        f" {'new ms':>8} {'embeds':>6} {'deleted':>7}"
+    )
+    for target in (10, 100, 1000, 5000):
+        # threshold just below the target-th best score
+        threshold = Memory._cosine_normalizer(float(scores[target - 1])) - 1e-6
+        for filter in ("", "area == 'main'"):
+            old_embedder = QueryEmbeddings(query, args.embed_ms / 1000)
+            old_count, old_seconds = old_delete(data, old_embedder, threshold, filter)
+            new_embedder = QueryEmbeddings(query, args.embed_ms / 1000)
+            with tempfile.TemporaryDirectory() as tmp:
+                new_count, new_seconds = new_delete(
+                    os.path.join(tmp, "memory"), data, new_embedder, threshold, filter
+                )
+            # filtered old searches only looked at the top fetch_k=20 candidates
+            print(
+                f"{target:7} {'area' if filter else '-':>6}"
+                f" {old_seconds * 1000:9.1f} {old_embedder.calls:6} {old_count:7}"
+                f" {new_seconds * 1000:8.1f} {new_embedder.calls:6} {new_count:7}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Write amplification of memory inserts: the log with periodic compaction
+against saving the whole FAISS store after every insert.
+
+    python -m bench.memory_wal --docs 10000 --inserts 200
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import faiss
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from bench import common
+from python.helpers.memory import Memory
+from python.helpers.memory_wal import COMPACT_SIZE
+
+
+def bench_full_save(db_dir: str, base, inserts, dim: int) -> dict:
+    # every insert rewrote index.faiss and index.pkl
+    index = faiss.IndexFlatIP(dim)
+    index.add(base)  # type: ignore
+    docs = {
+        str(i): Document(text, metadata={"id": str(i), "area": "main"})
+        for i, text in enumerate(common.texts(len(base)))
+    }
+    mapping = {i: str(i) for i in range(len(base))}
+    db = FAISS(common.RandomEmbeddings(dim), index, InMemoryDocstore(docs), mapping)
+    db.save_local(db_dir)
+
+    written = common.written_bytes()
+    start = time.perf_counter()
+    for n, vector in enumerate(inserts):
+        id = f"insert {n}"
+        doc = Document(common.texts(1, seed=n)[0], metadata={"id": id, "area": "main"})
+        db.docstore.add({id: doc})  # type: ignore
+        db.index_to_docstore_id[db.index.ntotal] = id
+        db.index.add(vector[None])  # type: ignore
+        db.save_local(db_dir)
+        for name in ("index.faiss", "index.pkl"):
+            with open(os.path.join(db_dir, name), "ab") as f:
+                os.fsync(f.fileno())
+    return {"seconds": time.perf_counter() - start, "bytes": common.written_bytes() - written}
+
+
+async def bench_wal(db_dir: str, base, inserts, dim: int) -> dict:
+    db = common.new_db(db_dir, dim)
+    common.fill(db, base)
+    await Memory.compact(db, force=True)
+
+    written = common.written_bytes()
+    compactions = 0
+    start = time.perf_counter()
+    for n, vector in enumerate(inserts):
+        record = common.insert_record(common.texts(1, seed=n), vector[None])
+        db.wal.append(record)  # type: ignore
+        Memory._apply_record(db, record)
+        await asyncio.to_thread(db.wal.sync)  # type: ignore
+        if db.wal.needs_compaction():  # type: ignore
+            await Memory.compact(db)
+            compactions += 1
+    seconds = time.perf_counter() - start
+    log_bytes = common.written_bytes() - written
+
+    # one compaction, the cost paid every COMPACT_SIZE bytes of log
+    written = common.written_bytes()
+    await Memory.compact(db, force=True)
+    snapshot = common.written_bytes() - written
+    return {"seconds": seconds, "bytes": log_bytes, "compactions": compactions, "snapshot": snapshot}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--docs", type=int, default=10000)
+    parser.add_argument("--inserts", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=384)
+    args = parser.parse_args()
+
+    common.use_plain_dirs()
+    base = common.vectors(args.docs, args.dim)
+    inserts = common.vectors(args.inserts, args.dim, seed=1)
+    # what an insert has to store: text and vector
+    logical = sum(len(text) for text in common.texts(args.inserts)) / args.inserts + args.dim * 4
+
+    with tempfile.TemporaryDirectory() as tmp:
+        old = bench_full_save(os.path.join(tmp, "full"), base, inserts, args.dim)
+        new = asyncio.run(bench_wal(os.path.join(tmp, "wal"), base, inserts, args.dim))
+
+    per_insert = new["bytes"] / args.inserts
+    # a compaction runs each time the log reaches COMPACT_SIZE
+    amortized = per_insert + new["snapshot"] * per_insert / COMPACT_SIZE
+    print(f"{args.docs} docs, {args.inserts} single inserts, dim {args.dim}, ~{logical:.0f} B per insert")
+    print(f"{'':12} {'B/insert':>12} {'amplification':>14} {'ms/insert':>10}")
+    for name, bytes, seconds in (
+        ("full save", old["bytes"] / args.inserts, old["seconds"]),
+        ("log", per_insert, new["seconds"]),
+        ("log+compact", amortized, new["seconds"]),
+    ):
+        print(f"{name:12} {bytes:12.0f} {bytes / logical:13.1f}x {seconds / args.inserts * 1000:10.2f}")
+    print(f"compaction writes {new['snapshot'] / 2**20:.1f} MiB once per {COMPACT_SIZE // 2**20} MiB of log")
+
+
+if __name__ == "__main__":
+    main()
@@ -58,6 +58,15 @@ def initialize():
         prompts_subdir=current_settings["agent_prompts_subdir"],
         memory_subdir=current_settings["agent_memory_subdir"],
         knowledge_subdirs=["default", current_settings["agent_knowledge_subdir"]],
+        knowledge_import_workers=current_settings["knowledge_import_workers"],
+        memory_index_type=current_settings["memory_index_type"],
+        memory_index_promote_at=current_settings["memory_index_promote_at"],
+        memory_quantization=current_settings["memory_quantization"],
+        memory_rerank_factor=current_settings["memory_rerank_factor"],
+        memory_search_mode=current_settings["memory_search_mode"],
+        embeddings_cache_size_mb=current_settings["embed_model_cache_size_mb"],
+        summary_cache_size_mb=current_settings["util_model_summary_cache_mb"],
+        rate_limit_estimate_tokens=current_settings["rate_limit_estimate_tokens"],
         mcp_servers=current_settings["mcp_servers"],
         code_exec_docker_enabled=False,
         # code_exec_docker_name = "A0-dev",
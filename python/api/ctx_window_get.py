@@ -12,7 +12,9 @@ class GetCtxWindow(ApiHandler):
         if not window or not isinstance(window, dict):
             return {"content": "", "tokens": 0}
 
-        text = window["text"]
+        # prompt is kept only in memory, chats saved before keep their text
+        prompt = agent.get_data(agent.DATA_NAME_CTX_PROMPT)
+        text = prompt.format() if prompt else window.get("text", "")
         tokens = window["tokens"]
 
         return {"content": text, "tokens": tokens}
@@ -0,0 +1,10 @@
+from python.helpers.api import ApiHandler
+from flask import Request, Response
+
+from python.helpers import memory_reindex
+
+
+class MemoryReindexStatus(ApiHandler):
+
+    async def process(self, input: dict, request: Request) -> dict | Response:
+        return {"jobs": memory_reindex.status()}
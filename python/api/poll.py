@@ -40,27 +40,27 @@ class Poll(ApiHandler):
         tasks = []
         processed_contexts = set()  # Track processed context IDs
 
-        all_ctxs = list(AgentContext._contexts.values())
+        # loaded contexts and saved chats not loaded yet
+        all_ctxs = [ctx.serialize() for ctx in AgentContext._contexts.values()]
+        all_ctxs += persist_chat.list_tmp_chats()
         # First, identify all tasks
-        for ctx in all_ctxs:
+        for context_data in all_ctxs:
+            ctx_id = context_data["id"]
             # Skip if already processed
-            if ctx.id in processed_contexts:
+            if ctx_id in processed_contexts:
                 continue
 
-            # Create the base context data that will be returned
-            context_data = ctx.serialize()
-
-            context_task = scheduler.get_task_by_uuid(ctx.id)
+            context_task = scheduler.get_task_by_uuid(ctx_id)
             # Determine if this is a task-dedicated context by checking if a task with this UUID exists
             is_task_context = (
-                context_task is not None and context_task.context_id == ctx.id
+                context_task is not None and context_task.context_id == ctx_id
             )
 
             if not is_task_context:
                 ctxs.append(context_data)
             else:
                 # If this is a task, get task details from the scheduler
-                task_details = scheduler.serialize_task(ctx.id)
+                task_details = scheduler.serialize_task(ctx_id)
                 if task_details:
                     # Add task details to context_data with the same field names
                     # as used in scheduler endpoints to maintain UI compatibility
@@ -88,7 +88,7 @@ class Poll(ApiHandler):
                 tasks.append(context_data)
 
             # Mark as processed
-            processed_contexts.add(ctx.id)
+            processed_contexts.add(ctx_id)
 
         # Sort tasks and chats by their creation date, descending
         ctxs.sort(key=lambda x: x["created_at"], reverse=True)
@@ -42,9 +42,10 @@ class SchedulerTaskDelete(ApiHandler):
             await scheduler.save()
 
         # This is a dedicated context for the task, so we remove it
-        if context and context.id == task.uuid:
-            AgentContext.remove(context.id)
-            persist_chat.remove_chat(context.id)
+        # it may not be loaded, its chat is removed either way
+        if task.context_id == task.uuid:
+            AgentContext.remove(task.context_id)
+            persist_chat.remove_chat(task.context_id)
 
         # Remove the task
         await scheduler.remove_task_by_uuid(task_id)
@@ -1,6 +1,7 @@
 import asyncio
 from python.helpers.extension import Extension
 from python.helpers.memory import Memory
+from python.helpers import memory_cache
 from agent import LoopData
 
 DATA_NAME_TASK = "_recall_memories_task"
@@ -73,6 +74,9 @@ class RecallMemories(Extension):
             filter=f"area == '{Memory.Area.MAIN.value}' or area == '{Memory.Area.FRAGMENTS.value}'",  # exclude solutions
         )
 
+        # cache hit rates, recall repeats similar queries every few iterations
+        log_item.update(cache=memory_cache.stats_text())
+
         # log the short result
         if not isinstance(memories, list) or len(memories) == 0:
             log_item.update(
@@ -1,6 +1,7 @@
 import asyncio
 from python.helpers.extension import Extension
 from python.helpers.memory import Memory
+from python.helpers import memory_cache
 from agent import LoopData
 
 DATA_NAME_TASK = "_recall_solutions_task"
@@ -81,6 +82,7 @@ class RecallSolutions(Extension):
 
         log_item.update(
             heading=f"{len(instruments)} instruments, {len(solutions)} solutions found",
+            cache=memory_cache.stats_text(),
         )
 
         if instruments:
@@ -85,27 +85,19 @@ class MemorizeMemories(Extension):
         # save chat history
         db = await Memory.get(self.agent)
 
-        memories_txt = ""
-        rem = []
-        for memory in memories:
-            # solution to plain text:
-            txt = f"{memory}"
-            memories_txt += "\n\n" + txt
-            log_item.update(memories=memories_txt.strip())
-
-            # remove previous fragments too similiar to this one
-            if self.REPLACE_THRESHOLD > 0:
-                rem += await db.delete_documents_by_query(
-                    query=txt,
-                    threshold=self.REPLACE_THRESHOLD,
-                    filter=f"area=='{Memory.Area.FRAGMENTS.value}'",
-                )
-                if rem:
-                    rem_txt = "\n\n".join(Memory.format_docs_plain(rem))
-                    log_item.update(replaced=rem_txt)
-
-            # insert new solution
-            await db.insert_text(text=txt, metadata={"area": Memory.Area.FRAGMENTS.value})
+        # memories to plain text
+        texts = [f"{memory}" for memory in memories]
+        log_item.update(memories="\n\n".join(texts))
+
+        # insert all fragments at once, removing previous ones too similiar
+        ids, rem = await db.upsert_batch(
+            texts=texts,
+            area=Memory.Area.FRAGMENTS.value,
+            replace_threshold=self.REPLACE_THRESHOLD,
+        )
+        if rem:
+            rem_txt = "\n\n".join(Memory.format_docs_plain(rem))
+            log_item.update(replaced=rem_txt)
 
         log_item.update(
             result=f"{len(memories)} entries memorized.",
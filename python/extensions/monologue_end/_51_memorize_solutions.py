@@ -86,8 +86,7 @@ class MemorizeSolutions(Extension):
         # save chat history
         db = await Memory.get(self.agent)
 
-        solutions_txt = ""
-        rem = []
+        texts = []
         for solution in solutions:
             # solution to plain text:
             if isinstance(solution, dict):
@@ -97,23 +96,19 @@ class MemorizeSolutions(Extension):
             else:
                 # If solution is not a dict, convert it to string
                 txt = f"# Solution\n {str(solution)}"
-            solutions_txt += txt + "\n\n"
-
-            # remove previous solutions too similiar to this one
-            if self.REPLACE_THRESHOLD > 0:
-                rem += await db.delete_documents_by_query(
-                    query=txt,
-                    threshold=self.REPLACE_THRESHOLD,
-                    filter=f"area=='{Memory.Area.SOLUTIONS.value}'",
-                )
-                if rem:
-                    rem_txt = "\n\n".join(Memory.format_docs_plain(rem))
-                    log_item.update(replaced=rem_txt)
-
-            # insert new solution
-            await db.insert_text(text=txt, metadata={"area": Memory.Area.SOLUTIONS.value})
-
-        solutions_txt = solutions_txt.strip()
+            texts.append(txt)
+
+        # insert all solutions at once, removing previous ones too similiar
+        ids, rem = await db.upsert_batch(
+            texts=texts,
+            area=Memory.Area.SOLUTIONS.value,
+            replace_threshold=self.REPLACE_THRESHOLD,
+        )
+        if rem:
+            rem_txt = "\n\n".join(Memory.format_docs_plain(rem))
+            log_item.update(replaced=rem_txt)
+
+        solutions_txt = "\n\n".join(texts)
         log_item.update(solutions=solutions_txt)
         log_item.update(
             result=f"{len(solutions)} solutions memorized.",
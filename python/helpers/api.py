@@ -6,6 +6,7 @@ from attr import dataclass
 from flask import Request, Response, jsonify, Flask
 from agent import AgentContext
 from initialize import initialize
+from python.helpers import persist_chat
 from python.helpers.print_style import PrintStyle
 from python.helpers.errors import format_error
 from werkzeug.serving import make_server
@@ -77,8 +78,13 @@ class ApiHandler:
                 first = AgentContext.first()
                 if first:
                     return first
-                return AgentContext(config=initialize())
-            got = AgentContext.get(ctxid)
+                # nothing loaded yet, continue the most recent saved chat
+                latest = persist_chat.latest_tmp_chat()
+                if latest:
+                    ctxid = latest
+                else:
+                    return AgentContext(config=initialize())
+            got = persist_chat.load_tmp_chat(ctxid)
             if got:
                 return got
             return AgentContext(config=initialize(), id=ctxid)
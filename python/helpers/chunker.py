@@ -0,0 +1,86 @@
+import re
+import zlib
+from typing import Iterable, Iterator
+
+from langchain_core.documents import Document
+
+MIN_CHUNK_SIZE = 1000
+MAX_CHUNK_SIZE = 4000
+# past the minimum size, a paragraph or sentence ends a chunk with probability 1 / BOUNDARY_DIVISOR
+BOUNDARY_DIVISOR = 4
+# paragraphs longer than this are cut into sentences
+MAX_UNIT_SIZE = 1000
+
+_PARAGRAPHS = re.compile(r"\n\s*\n")
+_SENTENCES = re.compile(r"(?<=[.!?;:])\s+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def iter_documents(documents: Iterable[Document]) -> Iterator[Document]:
+    # lazy, pages or rows streamed by a loader are never all in memory
+    for doc in documents:
+        for chunk in chunk_text(doc.page_content):
+            yield Document(page_content=chunk, metadata=dict(doc.metadata))
+
+
+def chunk_text(text: str) -> list[str]:
+    """
+    Content defined chunking: chunk boundaries depend only on the text of
+    the paragraph or sentence before them, not on their position. An edit
+    changes the chunk it is in, later chunks keep their boundaries once a
+    boundary unit follows.
+    """
+    chunks: list[str] = []
+    current: list[str] = []
+    size = 0
+    for unit in split_units(text):
+        if current and size + len(unit) > MAX_CHUNK_SIZE:
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+        current.append(unit)
+        size += len(unit) + 2
+        if size >= MIN_CHUNK_SIZE and is_boundary(unit):
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def split_units(text: str) -> list[str]:
+    # paragraphs, long ones as sentences, overlong sentences cut at whitespace
+    units = []
+    for paragraph in _PARAGRAPHS.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= MAX_UNIT_SIZE:
+            units.append(paragraph)
+            continue
+        for sentence in _SENTENCES.split(paragraph):
+            if len(sentence) <= MAX_CHUNK_SIZE:
+                units.append(sentence)
+            else:
+                units.extend(_cut(sentence))
+    return units
+
+
+def is_boundary(unit: str) -> bool:
+    # stable across processes and runs, unlike hash()
+    return zlib.crc32(unit.encode("utf-8", errors="replace")) % BOUNDARY_DIVISOR == 0
+
+
+def _cut(text: str) -> list[str]:
+    pieces = []
+    start = 0
+    while len(text) - start > MAX_CHUNK_SIZE:
+        end = start + MAX_CHUNK_SIZE
+        match = None
+        for match in _WHITESPACE.finditer(text, start + MAX_CHUNK_SIZE // 2, end):
+            pass
+        if match:
+            end = match.start()
+        pieces.append(text[start:end].strip())
+        start = end
+    pieces.append(text[start:].strip())
+    return [piece for piece in pieces if piece]
@@ -0,0 +1,49 @@
+import os
+import shutil
+
+from python.helpers.print_style import PrintStyle
+from python.helpers.sqlite_lru import SqliteLruStore
+
+DEFAULT_MAX_SIZE_MB = 512
+
+
+class EmbeddingCache(SqliteLruStore):
+    """
+    Embedding cache in a single SQLite file with LRU eviction.
+    Keys are produced by CacheBackedEmbeddings from the model namespace and
+    a hash of the text, values are the serialized vectors.
+    """
+
+    def __init__(self, path: str, max_size_mb: int = DEFAULT_MAX_SIZE_MB):
+        super().__init__(path, max_size_mb)
+
+    @classmethod
+    def get(cls, path: str, max_size_mb: int = DEFAULT_MAX_SIZE_MB) -> "EmbeddingCache":
+        return super().get(path, max_size_mb)  # type: ignore
+
+    def migrate_dir(self, dir_path: str) -> int:
+        # one-shot import of the old LocalFileStore layout, one file per key
+        if not os.path.isdir(dir_path):
+            return 0
+        PrintStyle.standard(f"Migrating embedding cache from {dir_path}...")
+        count = 0
+        batch: list[tuple[str, bytes]] = []
+        for root, _, names in os.walk(dir_path):
+            for name in names:
+                file_path = os.path.join(root, name)
+                key = os.path.relpath(file_path, dir_path).replace(os.sep, "/")
+                try:
+                    with open(file_path, "rb") as f:
+                        batch.append((key, f.read()))
+                except OSError:
+                    continue
+                if len(batch) >= 1000:
+                    self.mset(batch)
+                    count += len(batch)
+                    batch = []
+        if batch:
+            self.mset(batch)
+            count += len(batch)
+        shutil.rmtree(dir_path, ignore_errors=True)
+        PrintStyle.standard(f"Migrated {count} cached embeddings.")
+        return count
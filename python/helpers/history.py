@@ -4,8 +4,9 @@ from collections import OrderedDict
 from collections.abc import Mapping
 import json
 import math
-from typing import Coroutine, Literal, TypedDict, cast, Union, Dict, List, Any
-from python.helpers import messages, tokens, settings, call_llm
+from functools import partial
+from typing import Awaitable, Callable, Coroutine, Literal, TypedDict, cast, Union, Dict, List, Any
+from python.helpers import messages, tokens, settings, call_llm, summary_cache
 from enum import Enum
 from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage, AIMessage
 
@@ -17,6 +18,10 @@ HISTORY_BULK_RATIO = 0.2
 TOPIC_COMPRESS_RATIO = 0.65
 LARGE_MESSAGE_TO_TOPIC_RATIO = 0.25
 RAW_MESSAGE_OUTPUT_TEXT_TRIM = 100
+# utility model calls running at once when compressing
+COMPRESS_CONCURRENCY = 4
+# expected length of a summary when planning, the prompt asks for about 100 words
+SUMMARY_TOKENS_ESTIMATE = 200
 
 
 class RawMessage(TypedDict):
@@ -39,6 +44,10 @@ class OutputMessage(TypedDict):
     content: MessageContent
 
 
+# a planned compression, the utility model call if any and how to apply its summary
+CompressionStep = tuple[Callable[[], Awaitable[str]] | None, Callable[[str], None]]
+
+
 class Record:
     def __init__(self):
         pass
@@ -74,12 +83,19 @@ class Record:
     def output_text(self, human_label="user", ai_label="ai"):
         return output_text(self.output(), ai_label, human_label)
 
+    def langchain_messages(self) -> list[BaseMessage]:
+        # converted but not grouped yet
+        return convert_langchain(self.output())
+
 
 class Message(Record):
     def __init__(self, ai: bool, content: MessageContent, tokens: int = 0):
         self.ai = ai
         self.content = content
         self.summary: str = ""
+        # output and converted messages, valid for the summary they were made with
+        self._output: tuple[str, list[OutputMessage]] | None = None
+        self._langchain: tuple[str, list[BaseMessage]] | None = None
         self.tokens: int = tokens or self.calculate_tokens()
 
     def get_tokens(self) -> int:
@@ -99,7 +115,17 @@ class Message(Record):
         return False
 
     def output(self):
-        return [OutputMessage(ai=self.ai, content=self.summary or self.content)]
+        if self._output is None or self._output[0] is not self.summary:
+            self._output = (
+                self.summary,
+                [OutputMessage(ai=self.ai, content=self.summary or self.content)],
+            )
+        return self._output[1]
+
+    def langchain_messages(self) -> list[BaseMessage]:
+        if self._langchain is None or self._langchain[0] is not self.summary:
+            self._langchain = (self.summary, convert_langchain(self.output()))
+        return self._langchain[1]
 
     def output_langchain(self):
         return output_langchain(self.output())
@@ -119,9 +145,8 @@ class Message(Record):
     @staticmethod
     def from_dict(data: dict, history: "History"):
         content = data.get("content", "Content lost")
-        msg = Message(ai=data["ai"], content=content)
+        msg = Message(ai=data["ai"], content=content, tokens=data.get("tokens", 0))
         msg.summary = data.get("summary", "")
-        msg.tokens = data.get("tokens", 0)
         return msg
 
 
@@ -130,18 +155,31 @@ class Topic(Record):
         self.history = history
         self.summary: str = ""
         self.messages: list[Message] = []
+        # of the summary if summarized, else of all messages, kept up to date on changes
+        self.tokens: int = 0
 
     def get_tokens(self):
+        return self.tokens
+
+    def update_tokens(self) -> int:
+        # recount from the messages' stored counts, after changes made from outside
         if self.summary:
-            return tokens.approximate_tokens(self.summary)
+            self.tokens = tokens.approximate_tokens(self.summary)
         else:
-            return sum(msg.get_tokens() for msg in self.messages)
+            self.tokens = sum(msg.get_tokens() for msg in self.messages)
+        return self.tokens
+
+    def set_summary(self, summary: str):
+        self.summary = summary
+        self.update_tokens()
 
     def add_message(
         self, ai: bool, content: MessageContent, tokens: int = 0
     ) -> Message:
         msg = Message(ai=ai, content=content, tokens=tokens)
         self.messages.append(msg)
+        if not self.summary:
+            self.tokens += msg.tokens
         return msg
 
     def output(self) -> list[OutputMessage]:
@@ -151,8 +189,13 @@ class Topic(Record):
             msgs = [m for r in self.messages for m in r.output()]
             return msgs
 
+    def langchain_messages(self) -> list[BaseMessage]:
+        if self.summary:
+            return convert_langchain(self.output())
+        return [m for r in self.messages for m in r.langchain_messages()]
+
     async def summarize(self):
-        self.summary = await self.summarize_messages(self.messages)
+        self.set_summary(await self.summarize_messages(self.messages))
         return self.summary
 
     async def compress_large_messages(self) -> bool:
@@ -165,12 +208,11 @@ class Topic(Record):
         )
         large_msgs = []
         for m in (m for m in self.messages if not m.summary):
-            # TODO refactor this
-            out = m.output()
-            text = output_text(out)
+            # only large messages are rendered to measure their length
             tok = m.get_tokens()
-            leng = len(text)
             if tok > msg_max_size:
+                out = m.output()
+                leng = len(output_text(out))
                 large_msgs.append((m, tok, leng, out))
         large_msgs.sort(key=lambda x: x[1], reverse=True)
         for msg, tok, leng, out in large_msgs:
@@ -191,6 +233,7 @@ class Topic(Record):
                 )
                 msg.set_summary(_json_dumps(trunc))
 
+            self.tokens += msg.tokens - tok
             return True
         return False
 
@@ -201,23 +244,38 @@ class Topic(Record):
         return compress
 
     async def compress_attention(self) -> bool:
+        step = self.plan_attention()
+        if not step:
+            return False
+        summarize, apply = step
+        apply(await summarize())  # type: ignore
+        return True
 
-        if len(self.messages) > 2:
-            cnt_to_sum = math.ceil((len(self.messages) - 2) * TOPIC_COMPRESS_RATIO)
-            msg_to_sum = self.messages[1 : cnt_to_sum + 1]
-            summary = await self.summarize_messages(msg_to_sum)
+    def plan_attention(self) -> "CompressionStep | None":
+        if len(self.messages) <= 2:
+            return None
+        cnt_to_sum = math.ceil((len(self.messages) - 2) * TOPIC_COMPRESS_RATIO)
+        msg_to_sum = self.messages[1 : cnt_to_sum + 1]
+
+        def apply(summary: str):
+            # messages may be added while summarizing, but only at the end
+            current = self.messages[1 : cnt_to_sum + 1]
+            if any(a is not b for a, b in zip(current, msg_to_sum)):
+                return
             sum_msg_content = self.history.agent.parse_prompt(
                 "fw.msg_summary.md", summary=summary
             )
             sum_msg = Message(False, sum_msg_content)
+            self.tokens += sum_msg.tokens - sum(m.tokens for m in msg_to_sum)
             self.messages[1 : cnt_to_sum + 1] = [sum_msg]
-            return True
-        return False
+
+        return partial(self.summarize_messages, msg_to_sum), apply
 
     async def summarize_messages(self, messages: list[Message]):
         # FIXME: vision bytes are sent to utility LLM, send summary instead
         msg_txt = [m.output_text() for m in messages]
-        summary = await self.history.agent.call_utility_model(
+        summary = await summary_cache.summarize(
+            self.history.agent,
             system=self.history.agent.read_prompt("fw.topic_summary.sys.md"),
             message=self.history.agent.read_prompt(
                 "fw.topic_summary.msg.md", content=msg_txt
@@ -230,6 +288,7 @@ class Topic(Record):
             "_cls": "Topic",
             "summary": self.summary,
             "messages": [m.to_dict() for m in self.messages],
+            "tokens": self.tokens,
         }
 
     @staticmethod
@@ -239,6 +298,10 @@ class Topic(Record):
         topic.messages = [
             Message.from_dict(m, history=history) for m in data.get("messages", [])
         ]
+        if "tokens" in data:
+            topic.tokens = data["tokens"]
+        else:
+            topic.update_tokens()
         return topic
 
 
@@ -247,12 +310,22 @@ class Bulk(Record):
         self.history = history
         self.summary: str = ""
         self.records: list[Record] = []
+        # of the summary if summarized, else of all records, kept up to date on changes
+        self.tokens: int = 0
 
     def get_tokens(self):
+        return self.tokens
+
+    def update_tokens(self) -> int:
         if self.summary:
-            return tokens.approximate_tokens(self.summary)
+            self.tokens = tokens.approximate_tokens(self.summary)
         else:
-            return sum([r.get_tokens() for r in self.records])
+            self.tokens = sum(r.get_tokens() for r in self.records)
+        return self.tokens
+
+    def set_summary(self, summary: str):
+        self.summary = summary
+        self.update_tokens()
 
     def output(
         self, human_label: str = "user", ai_label: str = "ai"
@@ -263,23 +336,33 @@ class Bulk(Record):
             msgs = [m for r in self.records for m in r.output()]
             return msgs
 
+    def langchain_messages(self) -> list[BaseMessage]:
+        if self.summary:
+            return convert_langchain(self.output())
+        return [m for r in self.records for m in r.langchain_messages()]
+
     async def compress(self):
         return False
 
     async def summarize(self):
-        self.summary = await self.history.agent.call_utility_model(
+        self.set_summary(await self.summarize_records())
+        return self.summary
+
+    async def summarize_records(self) -> str:
+        return await summary_cache.summarize(
+            self.history.agent,
             system=self.history.agent.read_prompt("fw.topic_summary.sys.md"),
             message=self.history.agent.read_prompt(
                 "fw.topic_summary.msg.md", content=self.output_text()
             ),
         )
-        return self.summary
 
     def to_dict(self):
         return {
             "_cls": "Bulk",
             "summary": self.summary,
             "records": [r.to_dict() for r in self.records],
+            "tokens": self.tokens,
         }
 
     @staticmethod
@@ -288,6 +371,10 @@ class Bulk(Record):
         bulk.summary = data["summary"]
         cls = data["_cls"]
         bulk.records = [Record.from_dict(r, history=history) for r in data["records"]]
+        if "tokens" in data:
+            bulk.tokens = data["tokens"]
+        else:
+            bulk.update_tokens()
         return bulk
 
 
@@ -299,6 +386,23 @@ class History(Record):
         self.topics: list[Topic] = []
         self.current = Topic(history=self)
         self.agent: Agent = agent
+        # bumped on every change, the prefix version only when bulks or topics change,
+        # the rewrite version on every change but adding messages to the current topic
+        self.version = 0
+        self.prefix_version = 0
+        self.rewrite_version = 0
+        self._output: tuple[int, list[OutputMessage]] | None = None
+        self._prefix_langchain: tuple[int, list[BaseMessage]] | None = None
+        self._langchain: tuple[int, list[BaseMessage]] | None = None
+
+    def changed(self, prefix: bool = False, append: bool = False):
+        # current topic changes only rebuild its own part of the cached outputs,
+        # appended messages are all a journaled save has to write
+        self.version += 1
+        if prefix:
+            self.prefix_version += 1
+        if not append:
+            self.rewrite_version = self.version
 
     def get_tokens(self) -> int:
         return (
@@ -321,28 +425,68 @@ class History(Record):
     def get_current_topic_tokens(self) -> int:
         return self.current.get_tokens()
 
+    def update_tokens(self) -> int:
+        # recount topics after their messages were changed from outside
+        for topic in [*self.topics, self.current]:
+            topic.update_tokens()
+        self.changed(prefix=True)
+        return self.get_tokens()
+
     def add_message(
         self, ai: bool, content: MessageContent, tokens: int = 0
     ) -> Message:
+        self.changed(append=True)
         return self.current.add_message(ai, content=content, tokens=tokens)
 
     def new_topic(self):
         if self.current.messages:
             self.topics.append(self.current)
             self.current = Topic(history=self)
+            self.changed(prefix=True)
 
     def output(self) -> list[OutputMessage]:
-        result: list[OutputMessage] = []
-        result += [m for b in self.bulks for m in b.output()]
-        result += [m for t in self.topics for m in t.output()]
-        result += self.current.output()
-        return result
+        # a new list each time, callers may edit it
+        if self._output is None or self._output[0] != self.version:
+            result: list[OutputMessage] = []
+            result += [m for b in self.bulks for m in b.output()]
+            result += [m for t in self.topics for m in t.output()]
+            result += self.current.output()
+            self._output = (self.version, result)
+        return list(self._output[1])
+
+    def matches_output(self, outputs: list[OutputMessage]) -> bool:
+        # true if outputs are what output() returned for this version, unedited
+        return (
+            self._output is not None
+            and self._output[0] == self.version
+            and len(outputs) == len(self._output[1])
+            and all(a is b for a, b in zip(outputs, self._output[1]))
+        )
+
+    def output_langchain(self, extras: list[OutputMessage] = []) -> list[BaseMessage]:
+        # grouped langchain messages, bulks and topics are converted and grouped once per
+        # prefix version, the current topic and extras continue the grouping from there
+        if self._langchain is None or self._langchain[0] != self.version:
+            if (
+                self._prefix_langchain is None
+                or self._prefix_langchain[0] != self.prefix_version
+            ):
+                prefix = group_messages_abab(
+                    [m for r in [*self.bulks, *self.topics] for m in r.langchain_messages()]
+                )
+                self._prefix_langchain = (self.prefix_version, prefix)
+            result = group_messages_abab(
+                self.current.langchain_messages(), list(self._prefix_langchain[1])
+            )
+            self._langchain = (self.version, result)
+        return group_messages_abab(convert_langchain(extras), list(self._langchain[1]))
 
     @staticmethod
     def from_dict(data: dict, history: "History"):
         history.bulks = [Bulk.from_dict(b, history=history) for b in data["bulks"]]
         history.topics = [Topic.from_dict(t, history=history) for t in data["topics"]]
         history.current = Topic.from_dict(data["current"], history=history)
+        history.changed(prefix=True)
         return history
 
     def to_dict(self):
@@ -358,87 +502,102 @@ class History(Record):
         return _json_dumps(data)
 
     async def compress(self):
+        # each round plans every summary needed to fit the budgets and runs them concurrently,
+        # further rounds only when summaries came out longer than estimated
         compressed = False
         while True:
-            curr, hist, bulk = (
-                self.get_current_topic_tokens(),
-                self.get_topics_tokens(),
-                self.get_bulks_tokens(),
-            )
             total = _get_ctx_size_for_history()
-            ratios = [
-                (curr, CURRENT_TOPIC_RATIO, "current_topic"),
-                (hist, HISTORY_TOPIC_RATIO, "history_topic"),
-                (bulk, HISTORY_BULK_RATIO, "history_bulk"),
-            ]
-            ratios = sorted(ratios, key=lambda x: (x[0] / total) / x[1], reverse=True)
-            compressed_part = False
-            for ratio in ratios:
-                if ratio[0] > ratio[1] * total:
-                    over_part = ratio[2]
-                    if over_part == "current_topic":
-                        compressed_part = await self.current.compress()
-                    elif over_part == "history_topic":
-                        compressed_part = await self.compress_topics()
-                    else:
-                        compressed_part = await self.compress_bulks()
-                    if compressed_part:
-                        break
-
-            if compressed_part:
+            # large messages are truncated locally, no need to plan them
+            while (
+                self.get_current_topic_tokens() > CURRENT_TOPIC_RATIO * total
+                and await self.current.compress_large_messages()
+            ):
+                self.changed()
                 compressed = True
-                continue
-            else:
-                return compressed
 
-    async def compress_topics(self) -> bool:
-        # summarize topics one by one
+            steps = self.plan_compression(total)
+            if not steps:
+                return compressed
+            await self.run_compression(steps)
+            compressed = True
+
+    def plan_compression(self, total: int) -> list["CompressionStep"]:
+        steps: list[CompressionStep] = []
+        if self.get_current_topic_tokens() > CURRENT_TOPIC_RATIO * total:
+            step = self.current.plan_attention()
+            if step:
+                steps.append(step)
+        excess = self.get_topics_tokens() - HISTORY_TOPIC_RATIO * total
+        if excess > 0:
+            steps += self.plan_topics(excess)
+        if self.get_bulks_tokens() > HISTORY_BULK_RATIO * total:
+            steps += self.plan_bulks()
+        return steps
+
+    async def run_compression(self, steps: list["CompressionStep"]):
+        # summaries are applied together once all are done, the prompt never sees a half compressed history
+        semaphore = asyncio.Semaphore(COMPRESS_CONCURRENCY)
+
+        async def run(summarize: Callable[[], Awaitable[str]] | None) -> str:
+            if not summarize:
+                return ""
+            async with semaphore:
+                return await summarize()
+
+        summaries = await asyncio.gather(*[run(summarize) for summarize, _ in steps])
+        for (_, apply), summary in zip(steps, summaries):
+            apply(summary)
+        self.changed(prefix=True)
+
+    def plan_topics(self, excess: float) -> list["CompressionStep"]:
+        # summarize oldest topics until they would fit
+        steps: list[CompressionStep] = []
         for topic in self.topics:
+            if excess <= 0:
+                break
             if not topic.summary:
-                await topic.summarize()
-                return True
+                summarize = partial(topic.summarize_messages, topic.messages)
+                steps.append((summarize, topic.set_summary))
+                excess -= topic.tokens - min(topic.tokens, SUMMARY_TOKENS_ESTIMATE)
+        if steps:
+            return steps
 
-        # move oldest topic to bulks and summarize
+        # all summarized, move oldest topics to bulks
         for topic in self.topics:
-            bulk = Bulk(history=self)
-            bulk.records.append(topic)
-            if topic.summary:
-                bulk.summary = topic.summary
-            else:
-                await bulk.summarize()
-            self.bulks.append(bulk)
-            self.topics.remove(topic)
-            return True
-        return False
+            if excess <= 0:
+                break
+            steps.append((None, partial(self.move_to_bulk, topic)))
+            excess -= topic.tokens
+        return steps
 
-    async def compress_bulks(self):
-        # merge bulks if possible
-        compressed = await self.merge_bulks_by(BULK_MERGE_COUNT)
-        # remove oldest bulk if necessary
-        if not compressed:
-            self.bulks.pop(0)
-            return True
-        return compressed
+    def move_to_bulk(self, topic: Topic, summary: str = ""):
+        bulk = Bulk(history=self)
+        bulk.records.append(topic)
+        bulk.summary, bulk.tokens = topic.summary, topic.tokens
+        self.bulks.append(bulk)
+        self.topics.remove(topic)
+
+    def plan_bulks(self) -> list["CompressionStep"]:
+        # remove oldest bulk if it is the last one
+        if len(self.bulks) < 2:
+            return [(None, lambda summary: self.bulks.pop(0))] if self.bulks else []
 
-    async def merge_bulks_by(self, count: int):
-        # if bulks is empty, return False
-        if len(self.bulks) == 0:
-            return False
         # merge bulks in groups of count, even if there are fewer than count
-        bulks = await asyncio.gather(
-            *[
-                self.merge_bulks(self.bulks[i : i + count])
-                for i in range(0, len(self.bulks), count)
-            ]
-        )
-        self.bulks = bulks
-        return True
+        steps: list[CompressionStep] = []
+        merged: list[Bulk] = []
+        count = len(self.bulks)
+        for i in range(0, count, BULK_MERGE_COUNT):
+            bulk = Bulk(history=self)
+            bulk.records = cast(list[Record], self.bulks[i : i + BULK_MERGE_COUNT])
+            merged.append(bulk)
+            steps.append((bulk.summarize_records, bulk.set_summary))
 
-    async def merge_bulks(self, bulks: list[Bulk]) -> Bulk:
-        bulk = Bulk(history=self)
-        bulk.records = cast(list[Record], bulks)
-        await bulk.summarize()
-        return bulk
+        def replace(summary: str):
+            # topics moved in the same round are appended after the merged bulks
+            self.bulks[:count] = merged
+
+        steps.append((None, replace))
+        return steps
 
 
 def deserialize_history(json_data: str, agent) -> History:
@@ -501,8 +660,11 @@ def group_outputs_abab(outputs: list[OutputMessage]) -> list[OutputMessage]:
     return result
 
 
-def group_messages_abab(messages: list[BaseMessage]) -> list[BaseMessage]:
-    result = []
+def group_messages_abab(
+    messages: list[BaseMessage], result: list[BaseMessage] | None = None
+) -> list[BaseMessage]:
+    # appends to result if given, grouping continues from its last message
+    result = result if result is not None else []
     for msg in messages:
         if result and isinstance(result[-1], type(msg)):
             # create new instance of the same type with merged content
@@ -513,6 +675,11 @@ def group_messages_abab(messages: list[BaseMessage]) -> list[BaseMessage]:
 
 
 def output_langchain(messages: list[OutputMessage]):
+    # ensure message type alternation
+    return group_messages_abab(convert_langchain(messages))
+
+
+def convert_langchain(messages: list[OutputMessage]) -> list[BaseMessage]:
     result = []
     for m in messages:
         if m["ai"]:
@@ -521,8 +688,6 @@ def output_langchain(messages: list[OutputMessage]):
         else:
             # result.append(HumanMessage(content=serialize_content(m["content"])))
             result.append(HumanMessage(_output_content_langchain(content=m["content"])))  # type: ignore
-    # ensure message type alternation
-    result = group_messages_abab(result)
     return result
 
 
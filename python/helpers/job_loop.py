@@ -5,6 +5,7 @@ from python.helpers.task_scheduler import TaskScheduler
 from python.helpers.print_style import PrintStyle
 from python.helpers import errors
 from python.helpers import runtime
+from python.helpers import memory_retention
 
 
 SLEEP_TIME = 60
@@ -39,6 +40,8 @@ async def scheduler_tick():
     scheduler = TaskScheduler.get()
     # Run the scheduler tick
     await scheduler.tick()
+    # prune memory areas of loaded databases when due
+    await memory_retention.tick()
 
 
 def pause_loop():
@@ -1,8 +1,24 @@
+import asyncio
 import glob
+import itertools
+import multiprocessing
 import os
 import hashlib
 import json
-from typing import Any, Dict, Literal, TypedDict
+import queue
+import stat
+from concurrent.futures import ProcessPoolExecutor
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Container,
+    Dict,
+    Iterable,
+    Iterator,
+    Literal,
+    TypedDict,
+)
 from langchain_community.document_loaders import (
     CSVLoader,
     JSONLoader,
@@ -11,64 +27,205 @@ from langchain_community.document_loaders import (
     UnstructuredHTMLLoader,
     UnstructuredMarkdownLoader,
 )
-from python.helpers import files
+from langchain_core.documents import Document
+from python.helpers import files, errors, chunker
 from python.helpers.log import LogItem
 from python.helpers.print_style import PrintStyle
 
 text_loader_kwargs = {"autodetect_encoding": True}
 
+CHECKSUM_CHUNK_SIZE = 1024 * 1024
+# chunks per batch sent from a parsing worker and embedded together
+BATCH_SIZE = 64
+# batches buffered between the workers and the embedder, workers wait while it is full
+QUEUE_BATCHES = 8
+# seconds between checks for dead workers or cancellation while waiting on the queue
+QUEUE_POLL = 1.0
+# top level folders knowledge files are imported from, index keys start with one of them
+KNOWLEDGE_ROOTS = ("knowledge", "instruments")
+# import metadata part of a chunk's identity, everything else the loaders add is not
+HASHED_METADATA = ("area", "knowledge_source")
+
+# Mapping file extensions to corresponding loader classes
+file_types_loaders = {
+    "txt": TextLoader,
+    "pdf": PyPDFLoader,
+    "csv": CSVLoader,
+    "html": UnstructuredHTMLLoader,
+    # "json": JSONLoader,
+    "json": TextLoader,
+    # "md": UnstructuredMarkdownLoader,
+    "md": TextLoader,
+}
+
 
 class KnowledgeImport(TypedDict):
     file: str
     checksum: str
+    # stat of the imported version, unchanged stat means unchanged content
+    size: int
+    mtime_ns: int
+    inode: int
     ids: list[str]
+    # ids by chunk content hash, unchanged chunks keep their vectors
+    chunks: dict[str, list[str]]
     state: Literal["changed", "original", "removed"]
-    documents: list[Any]
+
+
+class ParseJob(TypedDict):
+    file_key: str
+    path: str
+    ext: str
+    checksum: str
+    stat: dict[str, int]
+    metadata: dict[str, Any]
 
 
 def calculate_checksum(file_path: str) -> str:
     hasher = hashlib.md5()
     with open(file_path, "rb") as f:
-        buf = f.read()
-        hasher.update(buf)
+        while chunk := f.read(CHECKSUM_CHUNK_SIZE):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def chunk_hash(doc: Document) -> str:
+    # loader metadata like the absolute source or a csv row changes without the content changing
+    hasher = hashlib.md5(doc.page_content.encode("utf-8", errors="replace"))
+    stable = {key: doc.metadata[key] for key in HASHED_METADATA if key in doc.metadata}
+    hasher.update(json.dumps(stable, sort_keys=True, default=str).encode())
     return hasher.hexdigest()
 
 
-def load_knowledge(
+def knowledge_key(file_path: str) -> str:
+    # relative to the install dir, so the index survives moving it
+    path = os.path.abspath(file_path)
+    base = files.get_base_dir() + os.sep
+    if path.startswith(base):
+        return path[len(base) :].replace(os.sep, "/")
+    # absolute key of an older index, the install dir may have moved since
+    parts = path.replace(os.sep, "/").split("/")
+    for i in range(len(parts) - 1, -1, -1):
+        if parts[i] in KNOWLEDGE_ROOTS:
+            return "/".join(parts[i:])
+    return path
+
+
+def migrate_keys(index: Dict[str, KnowledgeImport]) -> Dict[str, KnowledgeImport]:
+    # older indexes are keyed by absolute path
+    return {
+        (knowledge_key(key) if os.path.isabs(key) else key): value
+        for key, value in index.items()
+    }
+
+
+def stat_fields(st: os.stat_result) -> dict[str, int]:
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "inode": st.st_ino}
+
+
+def _same_stat(file_data: dict[str, Any], st: os.stat_result) -> bool:
+    return all(file_data.get(k) == v for k, v in stat_fields(st).items())
+
+
+class ChunkIds:
+    """
+    Ids of one file's chunks while its batches are stored, chunks with
+    unchanged content keep the ids of the previous version.
+    """
+
+    def __init__(self, file_data: KnowledgeImport, existing: Container[str]):
+        self.file_data = file_data
+        self.available = {
+            hash: [id for id in ids if id in existing]
+            for hash, ids in file_data.get("chunks", {}).items()
+        }
+        self.ids: list[str] = []
+        self.hashes: list[str] = []
+        # ids of new chunks, removed again if the file fails halfway
+        self.inserted: list[str] = []
+
+    def reuse(self, hash: str) -> str | None:
+        ids = self.available.get(hash)
+        return ids.pop(0) if ids else None
+
+    def add(self, hashes: list[str], ids: list[str]):
+        self.hashes += hashes
+        self.ids += ids
+
+    def finish(self) -> list[str]:
+        # store the new version in the index entry, returns ids no longer used
+        kept = set(self.ids)
+        removed = [id for id in self.file_data.get("ids", []) if id not in kept]
+        self.file_data["ids"] = self.ids
+        self.file_data["chunks"] = {}
+        for hash, id in zip(self.hashes, self.ids):
+            self.file_data["chunks"].setdefault(hash, []).append(id)
+        return removed
+
+
+def iter_file(file_path: str, ext: str) -> Iterator[Document]:
+    loader_cls = file_types_loaders[ext]
+    loader = loader_cls(
+        file_path,
+        **(text_loader_kwargs if ext in ["txt", "csv", "html", "md"] else {}),
+    )
+    # chunk boundaries follow the content, an edit doesn't shift the chunks after it
+    return chunker.iter_documents(loader.lazy_load())
+
+
+# set in worker processes
+_queue: Any = None
+_cancel: Any = None
+
+
+def _init_worker(results: Any, cancel: Any):
+    global _queue, _cancel
+    _queue, _cancel = results, cancel
+
+
+def _put(item: tuple) -> bool:
+    # blocks while the embedder is behind, gives up once the import is cancelled
+    while not _cancel.is_set():
+        try:
+            _queue.put(item, timeout=QUEUE_POLL)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def stream_file(job_id: int, file_path: str, ext: str):
+    # runs in a worker process, loaders are CPU bound
+    # chunks are sent in batches as the loader yields pages or rows, never the whole file
+    error = ""
+    try:
+        documents = iter_file(file_path, ext)
+        while batch := list(itertools.islice(documents, BATCH_SIZE)):
+            if not _put((job_id, batch, "")):
+                return
+    except Exception as e:
+        error = errors.error_text(e)
+    _put((job_id, None, error))
+
+
+def scan_knowledge(
     log_item: LogItem | None,
     knowledge_dir: str,
     index: Dict[str, KnowledgeImport],
     metadata: dict[str, Any] = {},
     filename_pattern: str = "**/*",
-) -> Dict[str, KnowledgeImport]:
-
-    # from python.helpers.memory import Memory
-
-    # Mapping file extensions to corresponding loader classes
-    file_types_loaders = {
-        "txt": TextLoader,
-        "pdf": PyPDFLoader,
-        "csv": CSVLoader,
-        "html": UnstructuredHTMLLoader,
-        # "json": JSONLoader,
-        "json": TextLoader,
-        # "md": UnstructuredMarkdownLoader,
-        "md": TextLoader,
-    }
-
-    cnt_files = 0
-    cnt_docs = 0
-
-    # for area in Memory.Area:
-    #     subdir = files.get_abs_path(knowledge_dir, area.value)
-
-    # if not os.path.exists(knowledge_dir):
-    #     os.makedirs(knowledge_dir)
-    #     continue
+) -> list[ParseJob]:
+    # mark the state of each file in the index, changed files are returned for parsing
 
     # Fetch all files in the directory with specified extensions
-    kn_files = glob.glob(knowledge_dir + "/" + filename_pattern, recursive=True)
-    kn_files = [f for f in kn_files if os.path.isfile(f)]
+    kn_files: list[tuple[str, os.stat_result]] = []
+    for f in glob.glob(knowledge_dir + "/" + filename_pattern, recursive=True):
+        try:
+            st = os.stat(f)
+        except OSError:
+            continue
+        if stat.S_ISREG(st.st_mode):
+            kn_files.append((f, st))
 
     if kn_files:
         PrintStyle.standard(
@@ -79,49 +236,146 @@ def load_knowledge(
                 progress=f"\nFound {len(kn_files)} knowledge files in {knowledge_dir}, processing...",
             )
 
-    for file_path in kn_files:
-        ext = file_path.split(".")[-1].lower()
-        if ext in file_types_loaders:
-            checksum = calculate_checksum(file_path)
-            file_key = file_path  # os.path.relpath(file_path, knowledge_dir)
-
-            # Load existing data from the index or create a new entry
-            file_data = index.get(file_key, {})
-
-            if file_data.get("checksum") == checksum:
-                file_data["state"] = "original"
-            else:
-                file_data["state"] = "changed"
-
-            if file_data["state"] == "changed":
-                file_data["checksum"] = checksum
-                loader_cls = file_types_loaders[ext]
-                loader = loader_cls(
-                    file_path,
-                    **(
-                        text_loader_kwargs
-                        if ext in ["txt", "csv", "html", "md"]
-                        else {}
-                    ),
-                )
-                file_data["documents"] = loader.load_and_split()
-                for doc in file_data["documents"]:
-                    doc.metadata = {**doc.metadata, **metadata}
-                cnt_files += 1
-                cnt_docs += len(file_data["documents"])
-                # PrintStyle.standard(f"Imported {len(file_data['documents'])} documents from {file_path}")
+    jobs: list[ParseJob] = []
+    for file_path, st in kn_files:
+        job = _scan_file(file_path, st, index, metadata)
+        if job:
+            jobs.append(job)
 
-            # Update the index
-            index[file_key] = file_data  # type: ignore
+    return jobs
+
+
+def scan_paths(
+    paths: Iterable[str],
+    index: Dict[str, KnowledgeImport],
+    metadata_for: Callable[[str], dict[str, Any] | None],
+) -> list[ParseJob]:
+    # like scan_knowledge for single changed paths, metadata_for returns None for paths not imported
+    files: dict[str, os.stat_result] = {}
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            # deleted or moved away, a directory takes its files along
+            key = knowledge_key(path)
+            for file_key, file_data in index.items():
+                if file_key == key or file_key.startswith(key + "/"):
+                    file_data["state"] = "removed"
+            continue
+        if stat.S_ISDIR(st.st_mode):
+            for f in glob.glob(path + "/**/*", recursive=True):
+                try:
+                    f_st = os.stat(f)
+                except OSError:
+                    continue
+                if stat.S_ISREG(f_st.st_mode):
+                    files[f] = f_st
+        elif stat.S_ISREG(st.st_mode):
+            files[path] = st
 
+    jobs: list[ParseJob] = []
+    for file_path, st in files.items():
+        metadata = metadata_for(file_path)
+        if metadata is None:
+            continue
+        job = _scan_file(file_path, st, index, metadata)
+        if job:
+            jobs.append(job)
+    return jobs
+
+
+def _scan_file(
+    file_path: str,
+    st: os.stat_result,
+    index: Dict[str, KnowledgeImport],
+    metadata: dict[str, Any],
+) -> ParseJob | None:
+    ext = file_path.split(".")[-1].lower()
+    if ext not in file_types_loaders:
+        return None
+    file_key = knowledge_key(file_path)
+
+    # Load existing data from the index or create a new entry
+    file_data = index.get(file_key, {})
+    index[file_key] = file_data  # type: ignore
+
+    # content is only hashed when the stat differs from the imported version
+    if _same_stat(file_data, st):
+        file_data["state"] = "original"
+        return None
+    checksum = calculate_checksum(file_path)
+    if file_data.get("checksum") == checksum:
+        file_data["state"] = "original"
+        file_data.update(stat_fields(st))  # type: ignore # touched or copied, same content
+        return None
+    # checksum and stat are stored once the new version is imported
+    file_data["state"] = "changed"
+    return {
+        "file_key": file_key,
+        "path": file_path,
+        "ext": ext,
+        "checksum": checksum,
+        "stat": stat_fields(st),
+        "metadata": metadata,
+    }
+
+
+def mark_removed(index: Dict[str, KnowledgeImport]):
     # loop index where state is not set and mark it as removed
     for file_key, file_data in index.items():
         if not file_data.get("state", ""):
             index[file_key]["state"] = "removed"
 
-    PrintStyle.standard(f"Processed {cnt_docs} documents from {cnt_files} files.")
-    if log_item:
-        log_item.stream(
-            progress=f"\nProcessed {cnt_docs} documents from {cnt_files} files."
-        )
-    return index
+
+async def parse_files(
+    jobs: list[ParseJob], workers: int = 0
+) -> AsyncIterator[tuple[ParseJob, list[Document], bool, str]]:
+    # parse in worker processes, yields (job, documents, last, error) per batch as batches arrive
+    # batches of one file come in order, the last one of each file is empty
+    if not jobs:
+        return
+    loop = asyncio.get_running_loop()
+    # spawned workers don't inherit locks held by threads of the server process
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue(QUEUE_BATCHES)
+    cancel = context.Event()
+    executor = ProcessPoolExecutor(
+        max_workers=min(workers or os.cpu_count() or 1, len(jobs)),
+        mp_context=context,
+        initializer=_init_worker,
+        initargs=(results, cancel),
+    )
+    futures = {
+        executor.submit(stream_file, i, job["path"], job["ext"]): i
+        for i, job in enumerate(jobs)
+    }
+    running = set(range(len(jobs)))
+
+    try:
+        while running:
+            try:
+                job_id, batch, error = await loop.run_in_executor(
+                    None, results.get, True, QUEUE_POLL
+                )
+            except queue.Empty:
+                # a worker that died can't send the end of its file
+                for future, job_id in futures.items():
+                    if job_id in running and future.done() and future.exception():
+                        running.discard(job_id)
+                        yield jobs[job_id], [], True, errors.error_text(
+                            future.exception()  # type: ignore
+                        )
+                continue
+            job = jobs[job_id]
+            if batch is None:
+                running.discard(job_id)
+                yield job, [], True, error
+                continue
+            for doc in batch:
+                doc.metadata = {**doc.metadata, **job["metadata"]}
+            yield job, batch, False, ""
+        # workers still starting up need the queue they were created with
+        await asyncio.to_thread(executor.shutdown)
+    finally:
+        cancel.set()
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,185 @@
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import struct
+import sys
+import time
+from typing import Awaitable, Callable
+
+from python.helpers.defer import DeferredTask
+from python.helpers.print_style import PrintStyle
+from python.helpers import errors
+
+# changes are imported once the folders were quiet for DEBOUNCE seconds, at the latest after MAX_DELAY
+DEBOUNCE = 1.0
+MAX_DELAY = 10.0
+# seconds between reads of inotify events, between scans when polling
+TICK = 0.25
+POLL_INTERVAL = 3.0
+
+# inotify constants from <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (
+    IN_CLOSE_WRITE
+    | IN_ATTRIB
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+)
+_EVENT = struct.Struct("iIII")
+
+
+class Inotify:
+    """Minimal inotify binding through libc, watches directory trees recursively."""
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.dirs: dict[int, str] = {}
+
+    def add_tree(self, root: str):
+        for dir, _, _ in os.walk(root):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dir), WATCH_MASK)
+            if wd >= 0:
+                self.dirs[wd] = dir
+
+    def read(self) -> set[str]:
+        # changed paths since the last read, new directories are watched too
+        changed: set[str] = set()
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return changed
+            pos = 0
+            while pos < len(data):
+                wd, mask, _, length = _EVENT.unpack_from(data, pos)
+                name = data[pos + _EVENT.size : pos + _EVENT.size + length].rstrip(b"\0")
+                pos += _EVENT.size + length
+                dir = self.dirs.get(wd)
+                if dir is None:
+                    continue
+                if mask & IN_IGNORED:
+                    del self.dirs[wd]
+                    continue
+                path = os.path.join(dir, os.fsdecode(name)) if name else dir
+                changed.add(path)
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    self.add_tree(path)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class KnowledgeWatcher:
+    """
+    Watches knowledge folders for changed files and passes them on in
+    debounced batches. Uses inotify on Linux and falls back to comparing
+    file stats periodically elsewhere.
+    """
+
+    def __init__(
+        self, roots: list[str], on_change: Callable[[set[str]], Awaitable[None]]
+    ):
+        self.roots = roots
+        self.on_change = on_change
+        self.pending: set[str] = set()
+        self.first_change = 0.0
+        self.last_change = 0.0
+        self.task: DeferredTask | None = None
+
+    def start(self):
+        self.task = DeferredTask(thread_name="KnowledgeWatcher")
+        self.task.start_task(self.run)
+
+    def stop(self):
+        if self.task:
+            self.task.kill()
+            self.task = None
+
+    async def run(self):
+        roots = [root for root in self.roots if os.path.isdir(root)]
+        inotify = None
+        if sys.platform.startswith("linux"):
+            try:
+                inotify = Inotify()
+                for root in roots:
+                    inotify.add_tree(root)
+            except Exception as e:
+                PrintStyle.error(f"inotify unavailable, polling knowledge folders: {e}")
+                inotify = None
+        try:
+            if inotify:
+                while True:
+                    self._add(inotify.read())
+                    await self._flush()
+                    await asyncio.sleep(TICK)
+            else:
+                files = _stat_tree(roots)
+                while True:
+                    await asyncio.sleep(POLL_INTERVAL)
+                    current = _stat_tree(roots)
+                    self._add(
+                        {
+                            path
+                            for path in files.keys() | current.keys()
+                            if files.get(path) != current.get(path)
+                        }
+                    )
+                    files = current
+                    await self._flush()
+        finally:
+            if inotify:
+                inotify.close()
+
+    def _add(self, paths: set[str]):
+        if not paths:
+            return
+        now = time.time()
+        if not self.pending:
+            self.first_change = now
+        self.last_change = now
+        self.pending |= paths
+
+    async def _flush(self):
+        if not self.pending:
+            return
+        now = time.time()
+        if now - self.last_change < DEBOUNCE and now - self.first_change < MAX_DELAY:
+            return
+        paths, self.pending = self.pending, set()
+        try:
+            await self.on_change(paths)
+        except Exception as e:
+            PrintStyle.error(f"Knowledge sync failed: {errors.format_error(e)}")
+
+
+def _stat_tree(roots: list[str]) -> dict[str, tuple[int, int]]:
+    files: dict[str, tuple[int, int]] = {}
+    for root in roots:
+        for dir, _, names in os.walk(root):
+            for name in names:
+                path = os.path.join(dir, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files[path] = (st.st_size, st.st_mtime_ns)
+    return files
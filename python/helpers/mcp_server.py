@@ -37,7 +37,7 @@ except ImportError:
     FASTMCP_AVAILABLE = False
 
 from agent import AgentContext, AgentContextType, UserMessage
-from python.helpers.persist_chat import save_tmp_chat, remove_chat
+from python.helpers.persist_chat import save_tmp_chat, remove_chat, load_tmp_chat
 from initialize import initialize
 from python.helpers.print_style import PrintStyle
 from python.helpers import settings
@@ -159,7 +159,7 @@ async def send_message(
 ]:
     context: Union[AgentContext, None] = None
     if chat_id:
-        context = AgentContext.get(chat_id)
+        context = load_tmp_chat(chat_id)
         if not context:
             return ToolError(error="Chat not found", chat_id=chat_id)
         else:
@@ -238,7 +238,7 @@ async def finish_chat(
     if not chat_id:
         return ToolError(error="Chat ID is required", chat_id="")
 
-    context = AgentContext.get(chat_id)
+    context = load_tmp_chat(chat_id)
     if not context:
         return ToolError(error="Chat not found", chat_id=chat_id)
     else:
@@ -1,18 +1,18 @@
 from datetime import datetime
-from typing import Any, List, Sequence
-from langchain.storage import InMemoryByteStore, LocalFileStore
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, List, Sequence
+from langchain.storage import InMemoryByteStore
 from langchain.embeddings import CacheBackedEmbeddings
 
 # from langchain_chroma import Chroma
 from langchain_community.vectorstores import FAISS
 import faiss
-from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores.utils import (
     DistanceStrategy,
 )
 from langchain_core.embeddings import Embeddings
 
-import os, json
+import os, json, pickle, asyncio, time
 
 import numpy as np
 
@@ -21,13 +21,145 @@ from . import files
 from langchain_core.documents import Document
 import uuid
 from python.helpers import knowledge_import
+from python.helpers.knowledge_watcher import KnowledgeWatcher
+from python.helpers.memory_wal import MemoryWal
+from python.helpers.embedding_cache import EmbeddingCache, DEFAULT_MAX_SIZE_MB
+from python.helpers import memory_index
+from python.helpers.memory_index import IndexConfig
+from python.helpers.memory_filter import MetadataFilter, MetadataIndex, compile_filter
+from python.helpers import memory_reindex
+from python.helpers import memory_docstore
+from python.helpers.memory_docstore import LazyDocstore
+from python.helpers import memory_vectors
+from python.helpers.memory_vectors import FullVectors
+from python.helpers import memory_bm25
+from python.helpers.memory_bm25 import Bm25Index
+from python.helpers import memory_cache
+from python.helpers.memory_concurrency import AsyncRWLock, SearchBatcher, run_in_pool
 from python.helpers.log import Log, LogItem
+from python.helpers.defer import DeferredTask
 from enum import Enum
 from agent import Agent, ModelConfig
 import models
 
 
+@dataclass
+class SearchRequest:
+    embedding: List[float]
+    k: int
+    filter: Any = None
+    fetch_k: int = 20
+
+
 class MyFaiss(FAISS):
+    wal: MemoryWal | None = None
+    index_config: IndexConfig = IndexConfig()
+    rebuilding: bool = False
+    reindex: "memory_reindex.ReindexJob | None" = None
+    # full precision vectors on disk when the index is quantized
+    full_vectors: FullVectors | None = None
+    # changes on every write, cached search results of older generations are stale
+    generation: int = 0
+
+    def __init__(
+        self,
+        *args: Any,
+        meta_index: MetadataIndex | None = None,
+        lexical: Bm25Index | None = None,
+        **kwargs: Any,
+    ):
+        super().__init__(*args, **kwargs)
+        # inverted metadata index and reverse position lookup for filtered search
+        if meta_index is None:
+            meta_index = MetadataIndex()
+            for id, doc in self.get_all_docs().items():
+                meta_index.add(id, doc.metadata)
+        self.meta_index = meta_index
+        # keyword index, built from the documents on first use when not stored
+        self.lexical = lexical or Bm25Index(
+            source=lambda: (
+                (id, doc.page_content) for id, doc in self.get_all_docs().items()
+            )
+        )
+        self._update_positions()
+        self.generation = memory_cache.next_generation()
+        # recall count and last recall time by id, for retention
+        self.access: dict[str, tuple[int, float]] = {}
+        # searches share the index, mutations need it exclusively
+        self.lock = AsyncRWLock()
+        self.batcher = SearchBatcher(self.search_batch)
+
+    @classmethod
+    def load_snapshot(cls, folder_path: str, embeddings: Embeddings, **kwargs: Any):
+        snapshot = memory_docstore.snapshot_dir(folder_path) or folder_path
+        # older snapshots have the whole docstore pickled, they are converted on next compaction
+        if not memory_docstore.is_lazy_snapshot(snapshot):
+            return cls.load_local(
+                folder_path=snapshot,
+                embeddings=embeddings,
+                allow_dangerous_deserialization=True,
+                **kwargs,
+            )
+        # vectors are mapped and documents read on demand, nothing is loaded up front
+        index = memory_index.read_index(
+            os.path.join(snapshot, memory_docstore.INDEX_FILE)
+        )
+        meta = memory_docstore.read_docs_index(snapshot)
+        docstore = LazyDocstore(
+            os.path.join(snapshot, memory_docstore.DOCS_FILE), meta["offsets"]
+        )
+        db = cls(
+            embeddings,
+            index,
+            docstore,
+            meta["index_to_docstore_id"],
+            meta_index=meta["meta_index"],
+            # snapshots written before keyword search have no stored index
+            lexical=(
+                Bm25Index(snapshot)
+                if memory_bm25.has_index(snapshot)
+                else None
+            ),
+            **kwargs,
+        )
+        if meta.get("vectors_file"):
+            # full vectors are shared by snapshots and stay in the database folder
+            db.full_vectors = FullVectors(
+                os.path.join(folder_path, meta["vectors_file"]), index.d
+            )
+            # rows past the snapshot come back with the log replay
+            db.full_vectors.truncate(index.ntotal)
+        db.access = meta.get("access", {})
+        return db
+
+    def record_access(self, ids: Iterable[str]):
+        now = time.time()
+        for id in ids:
+            hits, _ = self.access.get(id, (0, 0.0))
+            self.access[id] = (hits + 1, now)
+
+    def _update_positions(self):
+        self.positions = {id: pos for pos, id in self.index_to_docstore_id.items()}
+
+    def set_index(self, index: Any, index_to_docstore_id: dict[int, str]):
+        self.index = index
+        self.index_to_docstore_id = index_to_docstore_id
+        self._update_positions()
+        self.generation = memory_cache.next_generation()
+
+    def replace_with(self, other: "MyFaiss"):
+        # take over another database in place, references held by callers stay valid
+        self.index = other.index
+        self.docstore = other.docstore
+        self.index_to_docstore_id = other.index_to_docstore_id
+        self.meta_index = other.meta_index
+        self.lexical = other.lexical
+        self.positions = other.positions
+        self.wal = other.wal
+        self.full_vectors = other.full_vectors
+        self.embedding_function = other.embedding_function
+        self.generation = memory_cache.next_generation()
+
     # override aget_by_ids
     def get_by_ids(self, ids: Sequence[str], /) -> List[Document]:
         # return all self.docstore._dict[id] in ids
@@ -39,6 +171,349 @@ class MyFaiss(FAISS):
     def get_all_docs(self):
         return self.docstore._dict  # type: ignore
 
+    # all inserts go through add_embeddings so index positions stay consistent
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: List[dict] | None = None,
+        ids: List[str] | None = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        embeddings = self.embedding_function.embed_documents(texts)  # type: ignore
+        return self.add_embeddings(zip(texts, embeddings), metadatas, ids)
+
+    async def aadd_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: List[dict] | None = None,
+        ids: List[str] | None = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        embeddings = await self.embedding_function.aembed_documents(texts)  # type: ignore
+        return self.add_embeddings(zip(texts, embeddings), metadatas, ids)
+
+    def add_embeddings(
+        self,
+        text_embeddings: Iterable[tuple[str, List[float]]],
+        metadatas: Iterable[dict] | None = None,
+        ids: List[str] | None = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts, embeddings = zip(*text_embeddings)
+        metadatas = list(metadatas) if metadatas else [{} for _ in texts]
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if self._normalize_L2:
+            faiss.normalize_L2(vectors)
+
+        # new vectors are appended after all existing slots, including tombstones
+        start = self.index.ntotal
+        self.index.add(vectors)
+        if self.full_vectors:
+            self.full_vectors.append(vectors, start)
+        self.docstore.add(
+            {
+                id: Document(page_content=text, metadata=metadata)
+                for id, text, metadata in zip(ids, texts, metadatas)
+            }
+        )
+        self.index_to_docstore_id.update({start + j: id for j, id in enumerate(ids)})
+        for j, (id, metadata) in enumerate(zip(ids, metadatas)):
+            self.positions[id] = start + j
+            self.meta_index.add(id, metadata)
+        self.lexical.add(zip(ids, texts))
+        self.generation = memory_cache.next_generation()
+        return list(ids)
+
+    def delete(self, ids: List[str] | None = None, **kwargs: Any) -> bool | None:
+        if ids is None:
+            raise ValueError("No ids provided to delete.")
+        remove = set(ids)
+        positions = {
+            pos for pos, id in self.index_to_docstore_id.items() if id in remove
+        }
+        if memory_index.supports_remove(self.index):
+            self.index.remove_ids(np.fromiter(positions, dtype=np.int64))
+            remaining = [
+                id
+                for pos, id in sorted(self.index_to_docstore_id.items())
+                if pos not in positions
+            ]
+            self.set_index(self.index, dict(enumerate(remaining)))
+        else:
+            # approximate indexes can't compact, deleted slots become tombstones
+            for pos in positions:
+                self.positions.pop(self.index_to_docstore_id.pop(pos), None)
+
+        docs = self.get_all_docs()
+        existing = [id for id in remove if id in docs]
+        for id in existing:
+            self.meta_index.remove(id, docs[id].metadata)
+        self.docstore.delete(existing)
+        self.lexical.delete(existing)
+        for id in existing:
+            self.access.pop(id, None)
+        self.generation = memory_cache.next_generation()
+        return True
+
+    def similarity_search_with_score_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter: Any = None,
+        fetch_k: int = 20,
+        **kwargs: Any,
+    ) -> List[tuple[Document, float]]:
+        return self.search_batch([SearchRequest(embedding, k, filter, fetch_k)])[0]
+
+    def search_batch(
+        self, requests: list["SearchRequest"]
+    ) -> list[list[tuple[Document, float]]]:
+        vectors = np.array([r.embedding for r in requests], dtype=np.float32)
+        if self._normalize_L2:
+            faiss.normalize_L2(vectors)
+
+        results: list[list[tuple[Document, float]]] = [[] for _ in requests]
+        filter_funcs = []
+        shared = []
+        for i, request in enumerate(requests):
+            filter = request.filter
+            filter_funcs.append(
+                None
+                if filter is None
+                else filter if callable(filter) else self._create_filter_func(filter)
+            )
+
+            # narrow the search down to ids matching indexed metadata
+            candidates = None
+            if isinstance(filter, MetadataFilter):
+                candidates = filter.candidates(self.meta_index)
+
+            if candidates is not None:
+                positions = [self.positions[id] for id in candidates if id in self.positions]
+                scores, indices = self._search_positions(
+                    vectors[i : i + 1], positions, max(request.k, request.fetch_k)
+                )
+                results[i] = self._collect(scores[0], indices[0], filter_funcs[i], request.k)
+            else:
+                shared.append(i)
+
+        if shared:
+            # queries without index candidates share one index pass
+            tombstones = self.index.ntotal - len(self.index_to_docstore_id)
+            fetch = max(
+                r.k if r.filter is None else max(r.k, r.fetch_k)
+                for r in (requests[i] for i in shared)
+            )
+            fetch = min(fetch * self._rerank_factor() + tombstones, self.index.ntotal)
+            if fetch > 0:
+                all_scores, all_indices = self.index.search(vectors[shared], fetch)
+                for row, i in enumerate(shared):
+                    scores, indices = self._rerank(
+                        vectors[i : i + 1],
+                        all_scores[row : row + 1],
+                        all_indices[row : row + 1],
+                    )
+                    results[i] = self._collect(
+                        scores[0], indices[0], filter_funcs[i], requests[i].k
+                    )
+        return results
+
+    def _collect(
+        self,
+        scores: np.ndarray,
+        indices: np.ndarray,
+        filter_func: Callable[[dict], bool] | None,
+        k: int,
+    ) -> list[tuple[Document, float]]:
+        docs = []
+        for score, i in zip(scores, indices):
+            id = self.index_to_docstore_id.get(int(i))
+            if id is None:
+                continue  # not enough results or deleted slot
+            doc = self.docstore.search(id)
+            if not isinstance(doc, Document):
+                continue
+            if filter_func and not filter_func(doc.metadata):
+                continue
+            docs.append((doc, float(score)))
+            if len(docs) >= k:
+                break
+        return docs
+
+    def keyword_search(
+        self, query: str, k: int, filter: Any = None
+    ) -> List[tuple[Document, float]]:
+        # best BM25 matches, independent of the embedding model
+        filter_func = None
+        if filter is not None:
+            filter_func = filter if callable(filter) else self._create_filter_func(filter)
+
+        def accept(id: str) -> bool:
+            doc = self.docstore.search(id)
+            return isinstance(doc, Document) and (
+                not filter_func or filter_func(doc.metadata)
+            )
+
+        return [
+            (self.docstore.search(id), score)  # type: ignore
+            for id, score in self.lexical.search(query, k, accept)
+        ]
+
+    def score_by_ids(self, embedding: List[float], ids: list[str]) -> list[float]:
+        # exact scores of given documents, for results not found by vector search
+        vector = np.array([embedding], dtype=np.float32)
+        if self._normalize_L2:
+            faiss.normalize_L2(vector)
+        positions = np.asarray([self.positions[id] for id in ids], dtype=np.int64)
+        if not len(positions):
+            return []
+        return (self._vectors(positions) @ vector[0]).tolist()
+
+    def range_search_by_vector(
+        self, embedding: List[float], min_score: float, filter: Any = None
+    ) -> List[tuple[Document, float]]:
+        # all documents scoring at least min_score, best first
+        return self.range_search_batch([embedding], min_score, filter)[0]
+
+    def range_search_batch(
+        self, embeddings: Any, min_score: float, filter: Any = None
+    ) -> List[List[tuple[Document, float]]]:
+        vectors = np.array(embeddings, dtype=np.float32).reshape(len(embeddings), -1)
+        if self._normalize_L2:
+            faiss.normalize_L2(vectors)
+
+        filter_func = None
+        if filter is not None:
+            filter_func = filter if callable(filter) else self._create_filter_func(filter)
+
+        candidates = None
+        if isinstance(filter, MetadataFilter):
+            candidates = filter.candidates(self.meta_index)
+
+        # per query arrays of scores and positions
+        hits: list[tuple[np.ndarray, np.ndarray]] = []
+        if candidates is not None:
+            positions = [self.positions[id] for id in candidates if id in self.positions]
+            ids = np.asarray(positions, dtype=np.int64)
+            if not positions:
+                hits = [(np.empty(0), np.empty(0, dtype=np.int64)) for _ in vectors]
+            elif self._score_exactly(positions):
+                # one matrix pass over all candidates
+                scores = vectors @ self._vectors(ids).T
+                for row in scores:
+                    mask = row >= min_score
+                    hits.append((row[mask], ids[mask]))
+            else:
+                selector = faiss.IDSelectorBatch(ids)
+                hits = self._range_search(
+                    vectors,
+                    min_score,
+                    params=memory_index.search_params(self.index, selector),
+                )
+        elif self.index.ntotal:
+            hits = self._range_search(vectors, min_score)
+        else:
+            hits = [(np.empty(0), np.empty(0, dtype=np.int64)) for _ in vectors]
+
+        results = []
+        for scores, indices in hits:
+            docs = []
+            for score, i in zip(scores, indices):
+                id = self.index_to_docstore_id.get(int(i))
+                if id is None:
+                    continue
+                doc = self.docstore.search(id)
+                if not isinstance(doc, Document):
+                    continue
+                if filter_func and not filter_func(doc.metadata):
+                    continue
+                docs.append((doc, float(score)))
+            docs.sort(key=lambda d: d[1], reverse=True)
+            results.append(docs)
+        return results
+
+    def _search_positions(
+        self, vector: np.ndarray, positions: list[int], k: int
+    ) -> tuple[np.ndarray, np.ndarray]:
+        if not positions:
+            return np.empty((1, 0), dtype=np.float32), np.empty((1, 0), dtype=np.int64)
+        ids = np.asarray(positions, dtype=np.int64)
+        if self._score_exactly(positions):
+            # few candidates, score them directly
+            scores = self._vectors(ids) @ vector[0]
+            order = np.argsort(-scores)[:k]
+            return scores[order][None, :], ids[order][None, :]
+        selector = faiss.IDSelectorBatch(ids)
+        return self._rerank(
+            vector,
+            *self.index.search(
+                vector,
+                min(k * self._rerank_factor(), len(positions)),
+                params=memory_index.search_params(self.index, selector),
+            ),
+        )
+
+    def _score_exactly(self, positions: list[int]) -> bool:
+        return len(
+            positions
+        ) <= memory_index.EXACT_SEARCH_LIMIT or not memory_index.supports_selector(
+            self.index
+        )
+
+    def _vectors(self, positions: np.ndarray) -> np.ndarray:
+        # exact vectors, quantized indexes can only reconstruct approximations
+        if self.full_vectors:
+            return self.full_vectors.read(positions)
+        return memory_index.reconstruct_batch(self.index, positions)
+
+    def _rerank_factor(self) -> int:
+        return max(1, self.index_config.rerank_factor) if self.full_vectors else 1
+
+    def _rerank(
+        self, vector: np.ndarray, scores: np.ndarray, indices: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        # replace approximate scores of a quantized index with exact ones
+        if not self.full_vectors:
+            return scores, indices
+        ids = indices[0][indices[0] >= 0]
+        exact = self._vectors(ids) @ vector[0]
+        order = np.argsort(-exact)
+        return exact[order][None, :], ids[order][None, :]
+
+    def _range_search(
+        self, vectors: np.ndarray, min_score: float, **kwargs: Any
+    ) -> list[tuple[np.ndarray, np.ndarray]]:
+        if not self.full_vectors:
+            return _split_range(*self.index.range_search(vectors, min_score, **kwargs))
+        # search below the threshold with approximate scores, then keep exact matches
+        hits = _split_range(
+            *self.index.range_search(
+                vectors,
+                min_score
+                - memory_index.RANGE_MARGIN.get(memory_index.get_quantization(self.index), 0),
+                **kwargs,
+            )
+        )
+        results = []
+        for vector, (_, ids) in zip(vectors, hits):
+            exact = self._vectors(ids) @ vector
+            mask = exact >= min_score
+            results.append((exact[mask], ids[mask]))
+        return results
+
+
+def _split_range(
+    lims: np.ndarray, scores: np.ndarray, indices: np.ndarray
+) -> list[tuple[np.ndarray, np.ndarray]]:
+    # faiss range search results are flat arrays with per query offsets
+    return [
+        (scores[lims[i] : lims[i + 1]], indices[lims[i] : lims[i + 1]])
+        for i in range(len(lims) - 1)
+    ]
+
 
 class Memory:
 
@@ -49,10 +524,19 @@ class Memory:
         INSTRUMENTS = "instruments"
 
     index: dict[str, "MyFaiss"] = {}
+    watchers: dict[str, KnowledgeWatcher] = {}
+    knowledge_locks: dict[str, AsyncRWLock] = {}
+    # knowledge imports waiting for a re-index, and unloaded databases still closing
+    preloads: dict[str, DeferredTask] = {}
+    closing: dict[str, DeferredTask] = {}
 
     @staticmethod
     async def get(agent: Agent):
         memory_subdir = agent.config.memory_subdir or "default"
+        # an unloaded instance finishes its writes before the files are read again
+        if memory_subdir in Memory.closing:
+            await Memory.closing[memory_subdir].result()
+            Memory.closing.pop(memory_subdir, None)
         if Memory.index.get(memory_subdir) is None:
             log_item = agent.context.log.log(
                 type="util",
@@ -63,13 +547,22 @@ class Memory:
                 agent.config.embeddings_model,
                 memory_subdir,
                 False,
+                index_config=Memory._get_index_config(agent, memory_subdir),
+                cache_size_mb=agent.config.embeddings_cache_size_mb,
             )
             Memory.index[memory_subdir] = db
+            if db.reindex:
+                db.reindex.start(agent, log_item)
             wrap = Memory(agent, db, memory_subdir=memory_subdir)
             if agent.config.knowledge_subdirs:
-                await wrap.preload_knowledge(
-                    log_item, agent.config.knowledge_subdirs, memory_subdir
-                )
+                if db.reindex and db.reindex.keyword_only:
+                    # inserts wait for the new index, startup doesn't
+                    Memory._preload_after_reindex(wrap, db.reindex, log_item)
+                else:
+                    await wrap.preload_knowledge(
+                        log_item, agent.config.knowledge_subdirs, memory_subdir
+                    )
+                Memory._watch_knowledge(agent, memory_subdir)
             return wrap
         else:
             return Memory(
@@ -78,19 +571,77 @@ class Memory:
                 memory_subdir=memory_subdir,
             )
 
+    @staticmethod
+    def _watch_knowledge(agent: Agent, memory_subdir: str):
+        # files added or changed while running are imported within seconds
+        async def on_change(paths: set[str]):
+            db = Memory.index.get(memory_subdir)
+            if db is not None:
+                await Memory(agent, db, memory_subdir).sync_knowledge(paths)
+
+        if memory_subdir in Memory.watchers:
+            Memory.watchers.pop(memory_subdir).stop()
+        roots = [files.get_abs_path("knowledge", d) for d in agent.config.knowledge_subdirs]
+        roots.append(files.get_abs_path("instruments"))
+        watcher = KnowledgeWatcher(roots, on_change)
+        watcher.start()
+        Memory.watchers[memory_subdir] = watcher
+
+    @staticmethod
+    def _preload_after_reindex(
+        memory: "Memory", job: memory_reindex.ReindexJob, log_item: LogItem | None
+    ):
+        async def preload():
+            await asyncio.to_thread(job.finished.wait)
+            # failed jobs are reported by the job, a reload starts over
+            if job.state != "done" or Memory.index.get(memory.memory_subdir) is not memory.db:
+                return
+            await memory.preload_knowledge(
+                log_item, memory.agent.config.knowledge_subdirs, memory.memory_subdir
+            )
+
+        if log_item:
+            log_item.stream(progress="\nKnowledge is imported after re-indexing")
+        task = DeferredTask(thread_name="KnowledgePreload")
+        task.start_task(preload)
+        Memory.preloads[memory.memory_subdir] = task
+
     @staticmethod
     async def reload(agent: Agent):
-        memory_subdir = agent.config.memory_subdir or "default"
-        if Memory.index.get(memory_subdir):
-            del Memory.index[memory_subdir]
+        Memory.unload(agent.config.memory_subdir or "default")
         return await Memory.get(agent)
 
+    @staticmethod
+    def unload(memory_subdir: str):
+        db = Memory.index.pop(memory_subdir, None)
+        if db is None:
+            return
+        # background work of the old instance stops, a re-index resumes from its checkpoint
+        memory_reindex.cancel(memory_subdir)
+        preload = Memory.preloads.pop(memory_subdir, None)
+        if preload:
+            preload.kill()
+        task = DeferredTask(thread_name="MemoryClose")
+        task.start_task(Memory._close, db)
+        Memory.closing[memory_subdir] = task
+
+    @staticmethod
+    async def _close(db: "MyFaiss"):
+        # running maintenance and writes finish, then the log is made durable
+        while db.rebuilding or (db.wal and db.wal.compacting):
+            await asyncio.sleep(0.1)
+        async with db.lock.write():
+            if db.wal:
+                await asyncio.to_thread(db.wal.sync)
+
     @staticmethod
     def initialize(
         log_item: LogItem | None,
         model_config: ModelConfig,
         memory_subdir: str,
         in_memory=False,
+        index_config: IndexConfig | None = None,
+        cache_size_mb: int = DEFAULT_MAX_SIZE_MB,
     ) -> tuple[MyFaiss, bool]:
 
         PrintStyle.standard("Initializing VectorDB...")
@@ -98,68 +649,80 @@ class Memory:
         if log_item:
             log_item.stream(progress="\nInitializing VectorDB")
 
-        em_dir = files.get_abs_path(
-            "memory/embeddings"
+        em_file = files.get_abs_path(
+            "memory/embeddings.db"
         )  # just caching, no need to parameterize
         db_dir = Memory._abs_db_dir(memory_subdir)
 
-        # make sure embeddings and database directories exist
+        # make sure database directory exists
         os.makedirs(db_dir, exist_ok=True)
 
         if in_memory:
             store = InMemoryByteStore()
         else:
-            os.makedirs(em_dir, exist_ok=True)
-            store = LocalFileStore(em_dir)
-
-        embeddings_model = models.get_model(
-            models.ModelType.EMBEDDING,
-            model_config.provider,
-            model_config.name,
-            **model_config.kwargs,
-        )
-        embeddings_model_id = files.safe_file_name(
-            model_config.provider.name + "_" + model_config.name
-        )
+            store = EmbeddingCache.get(em_file, cache_size_mb)
+            # import cache files from the old one-file-per-text layout
+            store.migrate_dir(files.get_abs_path("memory/embeddings"))
+            stats = store.stats()
+            if log_item:
+                log_item.stream(
+                    progress=f"\nEmbedding cache: {stats['size_mb']} MB, {stats['hits']} hits, {stats['misses']} misses"
+                )
 
-        # here we setup the embeddings model with the chosen cache storage
-        embedder = CacheBackedEmbeddings.from_bytes_store(
-            embeddings_model, store, namespace=embeddings_model_id
+        embedder = Memory._get_embedder(
+            model_config.provider, model_config.name, model_config.kwargs, store
         )
 
-        # initial DB and docs variables
+        # initial DB variable
         db: MyFaiss | None = None
-        docs: dict[str, Document] | None = None
 
         created = False
 
+        # a re-index interrupted right before swapping in only needs the files moved
+        memory_reindex.cancel(memory_subdir)
+        if memory_reindex.finish_swap(db_dir):
+            PrintStyle.standard("Finished swapping in re-indexed memory.")
+
         # if db folder exists and is not empty:
-        if os.path.exists(db_dir) and files.exists(db_dir, "index.faiss"):
-            db = MyFaiss.load_local(
+        if memory_docstore.has_snapshot(db_dir):
+            # if there is a mismatch in embeddings used, the old model keeps serving
+            embedding_set = memory_reindex.read_embedding_set(db_dir)
+            emb_ok = bool(
+                embedding_set
+                and embedding_set["model_provider"] == model_config.provider.name
+                and embedding_set["model_name"] == model_config.name
+            )
+            old_embedder = embedder if emb_ok else Memory._get_old_embedder(embedding_set, store)
+
+            db = MyFaiss.load_snapshot(
                 folder_path=db_dir,
-                embeddings=embedder,
-                allow_dangerous_deserialization=True,
+                embeddings=old_embedder or embedder,
                 distance_strategy=DistanceStrategy.COSINE,
                 # normalize_L2=True,
                 relevance_score_fn=Memory._cosine_normalizer,
             )  # type: ignore
 
-            # if there is a mismatch in embeddings used, re-index the whole DB
-            emb_ok = False
-            emb_set_file = files.get_abs_path(db_dir, "embedding.json")
-            if files.exists(emb_set_file):
-                embedding_set = json.loads(files.read_file(emb_set_file))
-                if (
-                    embedding_set["model_provider"] == model_config.provider.name
-                    and embedding_set["model_name"] == model_config.name
-                ):
-                    # model matches
-                    emb_ok = True
-
-            # re-index -  create new DB and insert existing docs
-            if db and not emb_ok:
-                docs = db.get_all_docs()
-                db = None
+            # apply changes written after the last snapshot
+            db.wal = MemoryWal(db_dir)
+            replayed = Memory._replay_wal(db)
+            if replayed:
+                PrintStyle.standard(f"Replayed {replayed} memory log records.")
+
+            if emb_ok:
+                memory_reindex.discard_staging(db_dir)
+            else:
+                # re-embed all documents in the background, resuming from the last checkpoint
+                PrintStyle.standard("Embedding model changed, re-indexing memories in background...")
+                if log_item:
+                    log_item.stream(progress="\nEmbedding model changed, re-indexing in background")
+                db.reindex = memory_reindex.ReindexJob(
+                    db,
+                    memory_subdir,
+                    db_dir,
+                    model_config,
+                    embedder,
+                    keyword_only=old_embedder is None,
+                )
 
         # DB not loaded, create one
         if not db:
@@ -168,36 +731,24 @@ class Memory:
             db = MyFaiss(
                 embedding_function=embedder,
                 index=index,
-                docstore=InMemoryDocstore(),
+                docstore=LazyDocstore(),
                 index_to_docstore_id={},
                 distance_strategy=DistanceStrategy.COSINE,
                 # normalize_L2=True,
                 relevance_score_fn=Memory._cosine_normalizer,
             )
 
-            # insert docs if reindexing
-            if docs:
-                PrintStyle.standard("Indexing memories...")
-                if log_item:
-                    log_item.stream(progress="\nIndexing memories")
-                db.add_documents(documents=list(docs.values()), ids=list(docs.keys()))
-
-            # save DB
+            # save DB, old log records are contained in the new snapshot
+            db.wal = MemoryWal(db_dir)
             Memory._save_db_file(db, memory_subdir)
+            db.wal.clear()
+
             # save meta file
-            meta_file_path = files.get_abs_path(db_dir, "embedding.json")
-            files.write_file(
-                meta_file_path,
-                json.dumps(
-                    {
-                        "model_provider": model_config.provider.name,
-                        "model_name": model_config.name,
-                    }
-                ),
-            )
+            memory_reindex.write_embedding_set(db_dir, model_config)
 
             created = True
 
+        db.index_config = index_config or IndexConfig()
         return db, created
 
     def __init__(
@@ -216,38 +767,127 @@ class Memory:
         if log_item:
             log_item.update(heading="Preloading knowledge...")
 
-        # db abs path
-        db_dir = Memory._abs_db_dir(memory_subdir)
-
-        # Load the index file if it exists
-        index_path = files.get_abs_path(db_dir, "knowledge_import.json")
+        async with Memory._knowledge_lock(memory_subdir).write():
+            index = Memory._load_knowledge_index(memory_subdir)
+
+            # preload knowledge folders
+            jobs = self._preload_knowledge_folders(log_item, kn_dirs, index)
+            await self._import_knowledge(log_item, index, jobs)
+            Memory._save_knowledge_index(memory_subdir, index)
+
+    async def sync_knowledge(self, paths: Iterable[str]):
+        # import only the given changed paths, reported by the knowledge watcher
+        async with Memory._knowledge_lock(self.memory_subdir).write():
+            index = Memory._load_knowledge_index(self.memory_subdir)
+            jobs = knowledge_import.scan_paths(paths, index, self._knowledge_metadata)
+            if not jobs and all(v.get("state") != "removed" for v in index.values()):
+                return
+            await self._import_knowledge(None, index, jobs)
+            Memory._save_knowledge_index(self.memory_subdir, index)
+
+    def _knowledge_metadata(self, path: str) -> dict[str, Any] | None:
+        # knowledge/<subdir>/<area>/** and instruments/**/*.md, None for anything else
+        parts = knowledge_import.knowledge_key(path).split("/")
+        areas = [area.value for area in Memory.Area]
+        if (
+            len(parts) > 3
+            and parts[0] == "knowledge"
+            and parts[1] in self.agent.config.knowledge_subdirs
+            and parts[2] in areas
+        ):
+            return {"area": parts[2]}
+        if len(parts) > 1 and parts[0] == "instruments" and path.endswith(".md"):
+            return {"area": Memory.Area.INSTRUMENTS.value}
+        return None
+
+    async def _import_knowledge(
+        self,
+        log_item: LogItem | None,
+        index: dict[str, knowledge_import.KnowledgeImport],
+        jobs: list[knowledge_import.ParseJob],
+    ):
+        # remove original versions of removed files
+        for file in index:
+            if index[file].get("state") == "removed" and index[file].get("ids", []):
+                await self.delete_documents_by_ids(index[file]["ids"])
+
+        # files are parsed in worker processes and stored batch by batch as chunks arrive,
+        # workers wait while embedding is behind so memory stays bounded for any file size
+        cnt_files = cnt_docs = cnt_failed = 0
+        updates: dict[str, knowledge_import.ChunkIds] = {}
+        async for job, documents, last, error in knowledge_import.parse_files(
+            jobs, self.agent.config.knowledge_import_workers
+        ):
+            file_data = index[job["file_key"]]
+            update = updates.get(job["file_key"])
+            if update is None:
+                update = knowledge_import.ChunkIds(file_data, self.db.get_all_docs())
+                updates[job["file_key"]] = update
+            if documents:
+                cnt_docs += await self._store_knowledge_batch(update, documents)
+            if not last:
+                continue
+            del updates[job["file_key"]]
+
+            if error:
+                # previous version stays, the file is tried again on next load
+                PrintStyle.error(f"Failed to import knowledge file {job['path']}: {error}")
+                cnt_failed += 1
+                if update.inserted:
+                    await self.delete_documents_by_ids(update.inserted)
+                    cnt_docs -= len(update.inserted)
+                if file_data.get("checksum"):
+                    file_data["state"] = "original"
+                else:
+                    file_data["state"] = "removed"
+                continue
+            removed = update.finish()
+            if removed:
+                await self.delete_documents_by_ids(removed)
+            file_data["checksum"] = job["checksum"]
+            file_data.update(job["stat"])  # type: ignore
+            cnt_files += 1
+            if log_item:
+                log_item.update(knowledge=f"Imported {cnt_files}/{len(jobs)} changed files")
+
+        msg = f"Embedded {cnt_docs} new or changed documents from {cnt_files} files."
+        if cnt_failed:
+            msg += f" {cnt_failed} files failed."
+        PrintStyle.standard(msg)
+        if log_item:
+            log_item.stream(progress=f"\n{msg}")
 
-        # make sure directory exists
-        if not os.path.exists(db_dir):
-            os.makedirs(db_dir)
+    @staticmethod
+    def _knowledge_lock(memory_subdir: str) -> AsyncRWLock:
+        # preload and watcher syncs of one database read and write the same import index
+        if memory_subdir not in Memory.knowledge_locks:
+            Memory.knowledge_locks[memory_subdir] = AsyncRWLock()
+        return Memory.knowledge_locks[memory_subdir]
 
-        index: dict[str, knowledge_import.KnowledgeImport] = {}
+    @staticmethod
+    def _load_knowledge_index(
+        memory_subdir: str,
+    ) -> dict[str, knowledge_import.KnowledgeImport]:
+        index_path = files.get_abs_path(
+            Memory._abs_db_dir(memory_subdir), "knowledge_import.json"
+        )
         if os.path.exists(index_path):
             with open(index_path, "r") as f:
-                index = json.load(f)
+                return knowledge_import.migrate_keys(json.load(f))
+        return {}
 
-        # preload knowledge folders
-        index = self._preload_knowledge_folders(log_item, kn_dirs, index)
+    @staticmethod
+    def _save_knowledge_index(
+        memory_subdir: str, index: dict[str, knowledge_import.KnowledgeImport]
+    ):
+        db_dir = Memory._abs_db_dir(memory_subdir)
 
-        for file in index:
-            if index[file]["state"] in ["changed", "removed"] and index[file].get(
-                "ids", []
-            ):  # for knowledge files that have been changed or removed and have IDs
-                await self.delete_documents_by_ids(
-                    index[file]["ids"]
-                )  # remove original version
-            if index[file]["state"] == "changed":
-                index[file]["ids"] = await self.insert_documents(
-                    index[file]["documents"]
-                )  # insert new version
+        # make sure directory exists
+        if not os.path.exists(db_dir):
+            os.makedirs(db_dir)
 
         # remove index where state="removed"
-        index = {k: v for k, v in index.items() if v["state"] != "removed"}
+        index = {k: v for k, v in index.items() if v.get("state") != "removed"}
 
         # strip state and documents from index and save it
         for file in index:
@@ -255,27 +895,41 @@ class Memory:
                 del index[file]["documents"]  # type: ignore
             if "state" in index[file]:
                 del index[file]["state"]  # type: ignore
-        with open(index_path, "w") as f:
+        with open(files.get_abs_path(db_dir, "knowledge_import.json"), "w") as f:
             json.dump(index, f)
 
+    async def _store_knowledge_batch(
+        self, update: knowledge_import.ChunkIds, documents: list[Document]
+    ) -> int:
+        # only chunks with new content are embedded, unchanged ones keep their ids
+        hashes = [knowledge_import.chunk_hash(doc) for doc in documents]
+        ids = [update.reuse(hash) for hash in hashes]
+        new_docs = [doc for doc, id in zip(documents, ids) if id is None]
+        new_ids = await self.insert_documents(new_docs) if new_docs else []
+        update.inserted += new_ids
+        new_iter = iter(new_ids)
+        update.add(hashes, [id or next(new_iter) for id in ids])
+        return len(new_docs)
+
     def _preload_knowledge_folders(
         self,
         log_item: LogItem | None,
         kn_dirs: list[str],
         index: dict[str, knowledge_import.KnowledgeImport],
-    ):
-        # load knowledge folders, subfolders by area
+    ) -> list[knowledge_import.ParseJob]:
+        # scan knowledge folders, subfolders by area
+        jobs = []
         for kn_dir in kn_dirs:
             for area in Memory.Area:
-                index = knowledge_import.load_knowledge(
+                jobs += knowledge_import.scan_knowledge(
                     log_item,
                     files.get_abs_path("knowledge", kn_dir, area.value),
                     index,
                     {"area": area.value},
                 )
 
-        # load instruments descriptions
-        index = knowledge_import.load_knowledge(
+        # scan instruments descriptions
+        jobs += knowledge_import.scan_knowledge(
             log_item,
             files.get_abs_path("instruments"),
             index,
@@ -283,115 +937,520 @@ class Memory:
             filename_pattern="**/*.md",
         )
 
-        return index
+        knowledge_import.mark_removed(index)
+        return jobs
 
     async def search_similarity_threshold(
         self, query: str, limit: int, threshold: float, filter: str = ""
     ):
+        # repeated recall queries are answered from cache until the database changes
+        key = (
+            self.memory_subdir,
+            self.db.generation,
+            memory_cache.normalize_query(query),
+            filter,
+            limit,
+            threshold,
+            self.agent.config.memory_search_mode,
+        )
+        docs = memory_cache.query_cache.get(key)
+        if docs is None:
+            docs = await self._search_threshold(query, limit, threshold, filter)
+            # a write during the search changed the generation, the result is not cached then
+            if key[1] == self.db.generation:
+                memory_cache.query_cache.put(key, docs)
+        # recalled memories are kept longer by retention
+        self.db.record_access(doc.metadata["id"] for doc in docs)
+        return list(docs)
+
+    async def _search_threshold(
+        self, query: str, limit: int, threshold: float, filter: str
+    ) -> list[Document]:
         comparator = Memory._get_comparator(filter) if filter else None
 
-        # rate limiter
-        await self.agent.rate_limiter(
-            model_config=self.agent.config.embeddings_model, input=query
-        )
+        # old index can't be queried without its model, match keywords until re-indexed
+        if self.db.reindex and self.db.reindex.keyword_only:
+            async with self.db.lock.read():
+                results = await run_in_pool(
+                    self.db.keyword_search, query, limit, comparator
+                )
+            return [doc for doc, _ in results]
 
-        return await self.db.asearch(
-            query,
-            search_type="similarity_score_threshold",
-            k=limit,
-            score_threshold=threshold,
-            filter=comparator,
+        embedding = await self._embed_query(query)
+        hybrid = self.agent.config.memory_search_mode == "hybrid"
+
+        # searches from the same tick run as one batch off the event loop
+        async with self.db.lock.read():
+            vector_search = self.db.batcher.submit(
+                SearchRequest(embedding, limit, comparator)
+            )
+            if hybrid:
+                results, keyword_results = await asyncio.gather(
+                    vector_search,
+                    run_in_pool(
+                        self.db.keyword_search,
+                        query,
+                        limit * memory_bm25.HYBRID_FETCH,
+                        comparator,
+                    ),
+                )
+                # keyword hits must be as similar as vector hits to pass the threshold
+                keyword_results = [
+                    (doc, score)
+                    for (doc, _), score in zip(
+                        keyword_results,
+                        await run_in_pool(
+                            self.db.score_by_ids,
+                            embedding,
+                            [doc.metadata["id"] for doc, _ in keyword_results],
+                        ),
+                    )
+                    if Memory._cosine_normalizer(score) >= threshold
+                ]
+            else:
+                results = await vector_search
+        docs = [
+            doc
+            for doc, score in results
+            if Memory._cosine_normalizer(score) >= threshold
+        ]
+        if not hybrid:
+            return docs
+
+        # exact term matches (product names, policy numbers) rank next to similar meaning
+        by_id = {doc.metadata["id"]: doc for doc in docs}
+        by_id.update((doc.metadata["id"], doc) for doc, _ in keyword_results)
+        fused = memory_bm25.reciprocal_rank_fusion(
+            [
+                [doc.metadata["id"] for doc in docs],
+                [doc.metadata["id"] for doc, _ in keyword_results],
+            ]
         )
+        return [by_id[id] for id in fused[:limit]]
+
+    async def search_similarity_range(
+        self, query: str, threshold: float, filter: str = ""
+    ) -> list[Document]:
+        # all documents over the threshold, query is embedded only once
+        comparator = Memory._get_comparator(filter) if filter else None
+        await self._wait_reindex()
+        embedding = await self._embed_query(query)
+        async with self.db.lock.read():
+            return await run_in_pool(
+                self._search_range, embedding, threshold, comparator
+            )
 
     async def delete_documents_by_query(
         self, query: str, threshold: float, filter: str = ""
     ):
-        k = 100
-        tot = 0
-        removed = []
-
-        while True:
-            # Perform similarity search with score
-            docs = await self.search_similarity_threshold(
-                query, limit=k, threshold=threshold, filter=filter
-            )
-            removed += docs
-
-            # Extract document IDs and filter based on score
-            # document_ids = [result[0].metadata["id"] for result in docs if result[1] < score_limit]
-            document_ids = [result.metadata["id"] for result in docs]
-
-            # Delete documents with IDs over the threshold score
-            if document_ids:
-                # fnd = self.db.get(where={"id": {"$in": document_ids}})
-                # if fnd["ids"]: self.db.delete(ids=fnd["ids"])
-                # tot += len(fnd["ids"])
-                await self.db.adelete(ids=document_ids)
-                tot += len(document_ids)
-
-            # If fewer than K document IDs, break the loop
-            if len(document_ids) < k:
-                break
+        comparator = Memory._get_comparator(filter) if filter else None
+        await self._wait_reindex()
+        embedding = await self._embed_query(query)
 
-        if tot:
-            self._save_db()  # persist
+        # delete all matches in one batch, nothing can change between search and delete
+        async with self.db.lock.write():
+            removed = await run_in_pool(
+                self._search_range, embedding, threshold, comparator
+            )
+            if removed:
+                document_ids = [doc.metadata["id"] for doc in removed]
+                await self._mutate({"op": "delete", "ids": document_ids})
         return removed
 
     async def delete_documents_by_ids(self, ids: list[str]):
-        # aget_by_ids is not yet implemented in faiss, need to do a workaround
-        rem_docs = await self.db.aget_by_ids(ids)  # existing docs to remove (prevents error)
-        if rem_docs:
-            rem_ids = [doc.metadata["id"] for doc in rem_docs]  # ids to remove
-            await self.db.adelete(ids=rem_ids)
-
-        if rem_docs:
-            self._save_db()  # persist
+        async with self.db.lock.write():
+            # aget_by_ids is not yet implemented in faiss, need to do a workaround
+            rem_docs = await self.db.aget_by_ids(ids)  # existing docs to remove (prevents error)
+            if rem_docs:
+                rem_ids = [doc.metadata["id"] for doc in rem_docs]  # ids to remove
+                await self._mutate({"op": "delete", "ids": rem_ids})
         return rem_docs
 
+    async def _embed_query(self, query: str) -> List[float]:
+        # vectors are cached per model, the query cache misses whenever the database changed
+        embedder = self.db.embedding_function
+        key = (embedder, memory_cache.normalize_query(query))
+        embedding = memory_cache.embedding_cache.get(key)
+        if embedding is not None:
+            return embedding
+
+        # rate limiter
+        await self.agent.rate_limiter(
+            model_config=self.agent.config.embeddings_model, input=query
+        )
+        embedding = await embedder.aembed_query(key[1])  # type: ignore
+        memory_cache.embedding_cache.put(key, embedding)
+        return embedding
+
+    def _search_range(
+        self, embedding: List[float], threshold: float, filter: MetadataFilter | None
+    ) -> list[Document]:
+        results = self.db.range_search_by_vector(
+            embedding, Memory._cosine_threshold_to_score(threshold), filter=filter
+        )
+        return [
+            doc
+            for doc, score in results
+            if Memory._cosine_normalizer(score) >= threshold
+        ]
+
     async def insert_text(self, text, metadata: dict = {}):
         doc = Document(text, metadata=metadata)
         ids = await self.insert_documents([doc])
         return ids[0]
 
     async def insert_documents(self, docs: list[Document]):
+        ids = self._prepare_docs(docs)
+
+        if ids:
+            # embed first so the vectors can be logged and replayed without the model
+            vectors = await self._embed_docs(docs)
+            async with self.db.lock.write():
+                await self._mutate(Memory._insert_record(ids, docs, vectors))
+        return ids
+
+    async def upsert_batch(
+        self, texts: list[str], area: str, replace_threshold: float
+    ) -> tuple[list[str], list[Document]]:
+        # insert texts replacing near-duplicates, with one embedding call and one log write
+        docs = [Document(text, metadata={"area": area}) for text in texts]
+        if not docs:
+            return [], []
+        ids = self._prepare_docs(docs)
+        vectors = np.asarray(await self._embed_docs(docs), dtype=np.float32)
+
+        min_score = Memory._cosine_threshold_to_score(replace_threshold)
+        if replace_threshold > 0:
+            # within the batch, later texts replace earlier similar ones
+            sims = vectors @ vectors.T
+            keep = [
+                i
+                for i in range(len(docs))
+                if not np.any(sims[i, i + 1 :] >= min_score)
+            ]
+            docs = [docs[i] for i in keep]
+            ids = [ids[i] for i in keep]
+            vectors = vectors[keep]
+
+        async with self.db.lock.write():
+            removed: list[Document] = []
+            if replace_threshold > 0:
+                # against the store, one batched similarity pass over the area
+                matches = await run_in_pool(
+                    self.db.range_search_batch,
+                    vectors,
+                    min_score,
+                    Memory._get_comparator(f"area == '{area}'"),
+                )
+                seen = set()
+                for results in matches:
+                    for doc, _ in results:
+                        if doc.metadata["id"] not in seen:
+                            seen.add(doc.metadata["id"])
+                            removed.append(doc)
+
+            # apply deletes and inserts as a single mutation
+            records = []
+            if removed:
+                records.append({"op": "delete", "ids": [doc.metadata["id"] for doc in removed]})
+            records.append(Memory._insert_record(ids, docs, vectors))
+            await self._mutate({"op": "batch", "records": records})
+        return ids, removed
+
+    def _prepare_docs(self, docs: list[Document]) -> list[str]:
         ids = [str(uuid.uuid4()) for _ in range(len(docs))]
         timestamp = self.get_timestamp()
+        for doc, id in zip(docs, ids):
+            doc.metadata["id"] = id  # add ids to documents metadata
+            doc.metadata["timestamp"] = timestamp  # add timestamp
+            if not doc.metadata.get("area", ""):
+                doc.metadata["area"] = Memory.Area.MAIN.value
+        return ids
 
-        if ids:
-            for doc, id in zip(docs, ids):
-                doc.metadata["id"] = id  # add ids to documents metadata
-                doc.metadata["timestamp"] = timestamp  # add timestamp
-                if not doc.metadata.get("area", ""):
-                    doc.metadata["area"] = Memory.Area.MAIN.value
-
-            # rate limiter
-            docs_txt = "".join(self.format_docs_plain(docs))
-            await self.agent.rate_limiter(
-                model_config=self.agent.config.embeddings_model, input=docs_txt
+    async def _embed_docs(self, docs: list[Document]) -> list[list[float]]:
+        await self._wait_reindex()
+
+        # rate limiter
+        docs_txt = "".join(self.format_docs_plain(docs))
+        await self.agent.rate_limiter(
+            model_config=self.agent.config.embeddings_model, input=docs_txt
+        )
+        texts = [doc.page_content for doc in docs]
+        return await self.db.embedding_function.aembed_documents(texts)  # type: ignore
+
+    @staticmethod
+    def _insert_record(ids: list[str], docs: list[Document], vectors: Any) -> dict:
+        return {
+            "op": "add",
+            "ids": ids,
+            "texts": [doc.page_content for doc in docs],
+            "metadatas": [doc.metadata for doc in docs],
+            "vectors": np.asarray(vectors, dtype=np.float32),
+        }
+
+    async def _mutate(self, record: dict):
+        # log and apply a change, mirrored into a running re-index until it swaps in
+        # callers hold the write lock of the database
+        job = self.db.reindex
+        if job and job.state != "failed":
+            mirrored = await job.mirror(record)
+            with job.lock:
+                if self.db.reindex is job:
+                    job.apply_staging(mirrored)
+                else:
+                    record = mirrored  # swapped while embedding, live uses the new model
+                self._log(record)
+                Memory._apply_record(self.db, record)
+        else:
+            self._log(record)
+            Memory._apply_record(self.db, record)
+        # fsync off the event loop, including the mirrored re-index log
+        for wal in (self.db.wal, job.staging.wal if job and job.staging else None):
+            if wal:
+                await asyncio.to_thread(wal.sync)
+        self._changed()
+
+    async def _wait_reindex(self):
+        # without the old model, vector operations have to wait for the new index
+        job = self.db.reindex
+        if job and job.keyword_only:
+            await asyncio.to_thread(job.finished.wait)
+            if job.state != "done":
+                raise Exception(f"Memory re-index failed: {job.error}")
+
+    def _log(self, record: dict):
+        # persist the change to the log, snapshot is rewritten only on compaction
+        if not self.db.wal:
+            self.db.wal = MemoryWal(Memory._abs_db_dir(self.memory_subdir))
+        self.db.wal.append(record)
+
+    def _changed(self):
+        # schedule background maintenance after a mutation has been applied
+        if memory_index.needs_rebuild(
+            self.db.index, self.db.index_config, len(self.db.get_all_docs())
+        ):
+            if not self.db.rebuilding:
+                asyncio.create_task(Memory.rebuild_index(self.db, self.memory_subdir))
+        elif self.db.wal and self.db.wal.needs_compaction():
+            asyncio.create_task(Memory.compact(self.db))
+
+    @staticmethod
+    def _replay_wal(db: MyFaiss) -> int:
+        if not db.wal:
+            return 0
+        records = db.wal.read()
+        for record in records:
+            Memory._apply_record(db, record)
+        return len(records)
+
+    @staticmethod
+    def _apply_record(db: MyFaiss, record: dict):
+        existing = db.get_all_docs()
+        if record["op"] == "add":
+            # skip records already contained in the snapshot
+            new = [i for i, id in enumerate(record["ids"]) if id not in existing]
+            if new:
+                db.add_embeddings(
+                    text_embeddings=[
+                        (record["texts"][i], record["vectors"][i]) for i in new
+                    ],
+                    metadatas=[record["metadatas"][i] for i in new],
+                    ids=[record["ids"][i] for i in new],
+                )
+        elif record["op"] == "delete":
+            ids = [id for id in record["ids"] if id in existing]
+            if ids:
+                db.delete(ids=ids)
+        elif record["op"] == "batch":
+            for sub in record["records"]:
+                Memory._apply_record(db, sub)
+
+    @staticmethod
+    async def compact(db: MyFaiss, force: bool = False):
+        # fold the log into a fresh snapshot in the background
+        if not db.wal or db.wal.compacting:
+            return
+        if not force and not db.wal.needs_compaction():
+            return
+        db.wal.compacting = True
+        try:
+            wal = db.wal
+
+            def serialize():
+                # in memory, with the log sealed at the same point
+                with wal.lock:
+                    parts, offsets = Memory._serialize_db(db)
+                    return parts, offsets, wal.rotate()
+
+            # writers wait on the read lock, the event loop keeps serving meanwhile
+            async with db.lock.read():
+                parts, offsets, sealed = await asyncio.to_thread(serialize)
+            abs_dir = wal.db_dir
+            # until the new snapshot is current, the old one and the sealed log stay valid
+            await asyncio.to_thread(memory_docstore.write_snapshot, abs_dir, parts)
+            wal.drop_sealed(sealed)
+            # documents added meanwhile move over to the new snapshot without racing writers
+            async with db.lock.write():
+                Memory._rebase_docstore(db, abs_dir, offsets)
+        except Exception as e:
+            PrintStyle.error(f"Memory compaction failed: {e}")
+        finally:
+            db.wal.compacting = False
+
+    @staticmethod
+    async def rebuild_index(db: MyFaiss, memory_subdir: str):
+        # build the target index type in the background, old index keeps serving
+        if db.rebuilding:
+            return
+        db.rebuilding = True
+        try:
+            count = len(db.get_all_docs())
+            index_type = memory_index.target_index_type(db.index_config, count)
+            quantization = memory_index.target_quantization(db.index_config, count)
+            db_dir = db.wal.db_dir if db.wal else None
+            PrintStyle.standard(
+                f"Rebuilding memory index '{memory_subdir}' as {index_type}, quantization {quantization} ({count} vectors)..."
             )
 
-            await self.db.aadd_documents(documents=docs, ids=ids)
-            self._save_db()  # persist
-        return ids
+            # take live vectors and their ids at this point, full precision if kept on disk
+            async with db.lock.read():
+                old_index = db.index
+                snapshot = sorted(db.index_to_docstore_id.items())
+                ids = [id for _, id in snapshot]
+                vectors = db._vectors(
+                    np.asarray([pos for pos, _ in snapshot], dtype=np.int64)
+                )
 
-    def _save_db(self):
-        Memory._save_db_file(self.db, self.memory_subdir)
+            def build():
+                index = memory_index.create_index(
+                    index_type, old_index.d, db.index_config, vectors, quantization
+                )
+                index.add(vectors)
+                # compressed indexes keep full vectors on disk for re-ranking
+                full_vectors = None
+                if quantization != "none" and db_dir:
+                    full_vectors = FullVectors.create(db_dir, vectors)
+                return index, full_vectors
+
+            new_index, full_vectors = await asyncio.to_thread(build)
+
+            # apply changes made while building, then swap
+            async with db.lock.write():
+                positions = {id: pos for pos, id in db.index_to_docstore_id.items()}
+                snapshot_ids = set(ids)
+                added = [id for id in positions if id not in snapshot_ids]
+                deleted = [id for id in ids if id not in positions]
+
+                mapping = dict(enumerate(ids))
+                if added:
+                    added_vectors = db._vectors(
+                        np.asarray([positions[id] for id in added], dtype=np.int64)
+                    )
+                    new_index.add(added_vectors)
+                    if full_vectors:
+                        full_vectors.append(added_vectors, len(ids))
+                    mapping.update({len(ids) + j: id for j, id in enumerate(added)})
+                db.full_vectors = full_vectors
+                db.set_index(new_index, mapping)
+                if deleted:
+                    db.delete(ids=deleted)
+        except Exception as e:
+            PrintStyle.error(f"Memory index rebuild failed: {e}")
+            return
+        finally:
+            db.rebuilding = False
+
+        # persist the new index type
+        await Memory.compact(db, force=True)
+
+    @staticmethod
+    def _get_embedder(
+        provider: models.ModelProvider, name: str, kwargs: dict, store: Any
+    ) -> Embeddings:
+        embeddings_model = models.get_model(
+            models.ModelType.EMBEDDING, provider, name, **kwargs
+        )
+        embeddings_model_id = files.safe_file_name(provider.name + "_" + name)
+
+        # here we setup the embeddings model with the chosen cache storage
+        return CacheBackedEmbeddings.from_bytes_store(
+            embeddings_model, store, namespace=embeddings_model_id
+        )
+
+    @staticmethod
+    def _get_old_embedder(
+        embedding_set: dict[str, str] | None, store: Any
+    ) -> Embeddings | None:
+        # model the existing index was built with, None if it can't be used anymore
+        if not embedding_set:
+            return None
+        try:
+            provider = models.ModelProvider[embedding_set["model_provider"]]
+            return Memory._get_embedder(provider, embedding_set["model_name"], {}, store)
+        except Exception as e:
+            PrintStyle.error(f"Previous embedding model unavailable: {e}")
+            return None
+
+    @staticmethod
+    def _get_index_config(agent: Agent, memory_subdir: str) -> IndexConfig:
+        config = IndexConfig(
+            type=agent.config.memory_index_type,  # type: ignore
+            promote_at=agent.config.memory_index_promote_at,
+            quantization=agent.config.memory_quantization,  # type: ignore
+            rerank_factor=agent.config.memory_rerank_factor,
+        )
+        # settings apply to all subdirs unless one has its own index config file
+        try:
+            return memory_index.read_config(Memory._abs_db_dir(memory_subdir), config)
+        except Exception as e:
+            PrintStyle.error(f"Memory index config ignored: {e}")
+            return config
 
     @staticmethod
     def _save_db_file(db: MyFaiss, memory_subdir: str):
         abs_dir = Memory._abs_db_dir(memory_subdir)
-        db.save_local(folder_path=abs_dir)
+        parts, offsets = Memory._serialize_db(db)
+        memory_docstore.write_snapshot(abs_dir, parts)
+        Memory._rebase_docstore(db, abs_dir, offsets)
+
+    @staticmethod
+    def _serialize_db(
+        db: MyFaiss,
+    ) -> tuple[dict[str, bytes | bytearray], dict[str, tuple[int, int]]]:
+        # documents in one file addressed by offsets, ids and metadata index next to it
+        docs_bytes, offsets = memory_docstore.serialize_docs(db.docstore)
+        docs_index = {
+            "offsets": offsets,
+            "index_to_docstore_id": db.index_to_docstore_id,
+            "meta_index": db.meta_index,
+            "vectors_file": db.full_vectors.name if db.full_vectors else None,
+            "access": dict(db.access),
+        }
+        lexical = db.lexical.serialize()
+        parts = {
+            memory_docstore.DOCS_FILE: docs_bytes,
+            memory_docstore.DOCS_INDEX_FILE: pickle.dumps(
+                docs_index, protocol=pickle.HIGHEST_PROTOCOL
+            ),
+            **lexical,
+            memory_docstore.INDEX_FILE: memory_index.serialize_index(db.index),
+        }
+        return parts, offsets
 
     @staticmethod
-    def _get_comparator(condition: str):
-        def comparator(data: dict[str, Any]):
-            try:
-                return eval(condition, {}, data)
-            except Exception as e:
-                # PrintStyle.error(f"Error evaluating condition: {e}")
-                return False
+    def _rebase_docstore(db: MyFaiss, abs_dir: str, offsets: dict[str, tuple[int, int]]):
+        # documents in the written snapshot no longer need to stay in memory
+        snapshot = memory_docstore.snapshot_dir(abs_dir)
+        if isinstance(db.docstore, LazyDocstore) and snapshot:
+            db.docstore.rebase(os.path.join(snapshot, memory_docstore.DOCS_FILE), offsets)
+        memory_docstore.remove_old_snapshots(abs_dir)
+        memory_vectors.remove_unused(
+            abs_dir, db.full_vectors.name if db.full_vectors else None
+        )
 
-        return comparator
+    @staticmethod
+    def _get_comparator(condition: str) -> MetadataFilter:
+        return compile_filter(condition)
 
     @staticmethod
     def _score_normalizer(val: float) -> float:
@@ -406,6 +1465,11 @@ class Memory:
         )  # float precision can cause values like 1.0000000596046448
         return res
 
+    @staticmethod
+    def _cosine_threshold_to_score(threshold: float) -> float:
+        # inverse of _cosine_normalizer, raw inner product for a relevance threshold
+        return 2 * threshold - 1
+
     @staticmethod
     def _abs_db_dir(memory_subdir: str) -> str:
         return files.get_abs_path("memory", memory_subdir)
@@ -438,5 +1502,6 @@ def get_custom_knowledge_subdir_abs(agent: Agent) -> str:
 
 
 def reload():
-    # clear the memory index, this will force all DBs to reload
-    Memory.index = {}
+    # unload all DBs, they are opened again on next use
+    for memory_subdir in list(Memory.index):
+        Memory.unload(memory_subdir)
@@ -0,0 +1,404 @@
+import math
+import os
+import pickle
+import re
+import threading
+import unicodedata
+from array import array
+from collections import Counter
+from typing import Callable, Iterable
+
+import numpy as np
+
+LEXICAL_FILE = "lexical.dat"
+LEXICAL_INDEX_FILE = "lexical.idx"
+
+K1 = 1.2
+B = 0.75
+# rank constant of reciprocal rank fusion
+RRF_K = 60
+# lexical candidates fetched per requested result before fusion
+HYBRID_FETCH = 4
+# share of the query term weight a document has to match to count as a lexical hit
+MIN_COVERAGE = 0.3
+
+# compounds shorter than this are not split, parts taken from the index vocabulary need this length
+MIN_COMPOUND = 8
+MIN_PART = 5
+# linking elements between german compound parts (Fugen-s etc.)
+LINKS = ("s", "es", "n", "en")
+SPLIT_CACHE_SIZE = 100_000
+
+# one posting per document and term, stored back to back grouped by term
+POSTING = np.dtype([("doc", "<u4"), ("tf", "<u2")])
+
+_TOKEN = re.compile(r"[^\W_]+(?:[-./][^\W_]+)*")
+_SEPARATORS = re.compile(r"[-./]")
+_COMBINING = re.compile(r"[\u0300-\u036f]")
+
+STOPWORDS = frozenset(
+    # german
+    """aber alle als also am an auch auf aus bei bin bis bist da damit dann das dass dem den
+    der des die dies diese dieser dieses doch dort du durch ein eine einem einen einer eines er
+    es fur hat hatte ich ihr im in ist ja jede jeder kann kein keine mit muss nach nicht noch nur
+    ob oder ohne sich sie sind so uber um und uns unter vom von vor war wie wir wird wo zu zum zur"""
+    # french
+    """ au aux avec ce ces dans de des du elle en est et eux il ils je la le les leur lui ma mais
+    me meme mes moi mon ne nos notre nous ou par pas pour qu que qui sa se ses son sur ta te tes
+    toi ton tu un une vos votre vous"""
+    # italian
+    """ agli ai al alla alle allo che chi col con da dai dal dalla dalle degli dei del della
+    delle dello di e gli ha ho il io la le lei li lo loro lui ma mi ne nei nel nella nelle noi
+    non o per piu quella quelle quello questa queste questo si sono su sua sue sui sul sulla suo
+    tra tu un una uno voi"""
+    # english
+    """ a an and are as at be by for from has have is it of on or that the this to was were
+    will with""".split()
+)
+
+# frequent german compound parts of the insurance domain, folded like tokens
+LEXICON = frozenset(
+    """abschluss alter anspruch antrag arbeit arzt auto bau bedingung beitrag betrag betrieb
+    deckung diebstahl eigen einkommen elementar fahrzeug fall familie feuer franchise frist
+    gebaude gesundheit glas grund haft haftpflicht hausrat heil hinterlassenen invaliditat jahr
+    kapital kasko kasse kosten kranken krankheit kunde lebens leistung mindest monat motor
+    pflicht pflege police pramie privat rechts reise rente risiko rucktritt sach schaden
+    schutz selbst behalt spital summe taggeld teil tod unfall vertrag versicherung versicherungs
+    voll vorsorge wasser wert zahlung zusatz""".split()
+)
+
+
+def fold(text: str) -> str:
+    # lowercase without accents, umlauts and accented letters match their plain forms
+    text = text.lower()
+    if text.isascii():
+        return text
+    return _COMBINING.sub("", unicodedata.normalize("NFKD", text))
+
+
+def tokenize(
+    text: str, split: Callable[[str], list[str]] | None = None
+) -> list[str]:
+    # terms of a german, french or italian text, compounds also yield their parts
+    tokens = []
+    for match in _TOKEN.finditer(fold(text)):
+        word = match.group()
+        parts = [word]
+        if not word.isalnum():
+            parts = _SEPARATORS.split(word)
+            tokens.append("".join(parts))  # policy numbers, hyphenated compounds
+        for part in parts:
+            if part in STOPWORDS or (len(part) < 2 and not part.isdigit()):
+                continue
+            tokens.append(part)
+            if len(part) >= MIN_COMPOUND and part.isalpha():
+                tokens.extend(split(part) if split else split_compound(part))
+    return tokens
+
+
+def split_compound(word: str, known: Callable[[str], bool] | None = None) -> list[str]:
+    # fewest known parts covering the word, parts of parts included
+    def is_part(part: str) -> bool:
+        return part in LEXICON or (len(part) >= MIN_PART and bool(known and known(part)))
+
+    memo: dict[int, list[str] | None] = {}
+
+    def parts_from(i: int) -> list[str] | None:
+        if i == len(word):
+            return []
+        if i in memo:
+            return memo[i]
+        best = None
+        for j in range(len(word), i + 2, -1):
+            if i == 0 and j == len(word):
+                continue  # the word itself
+            part = word[i:j]
+            if not is_part(part):
+                continue
+            for link in ("", *LINKS):
+                k = j + len(link)
+                if link and (k >= len(word) or not word.startswith(link, j)):
+                    continue
+                rest = parts_from(k)
+                if rest is not None and (best is None or len(rest) + 1 < len(best)):
+                    best = [part, *rest]
+        memo[i] = best
+        return best
+
+    parts = parts_from(0)
+    if not parts:
+        return []
+    result = list(parts)
+    for part in parts:
+        if len(part) >= MIN_COMPOUND:
+            result.extend(split_compound(part, known))
+    return result
+
+
+class Bm25Index:
+    """
+    Inverted index for BM25 keyword search over memory documents.
+    Postings of a snapshot are memory mapped from disk and its term table is
+    read on first use, documents changed since are kept in memory until the
+    next snapshot. Without a stored index it is built from the documents
+    when first needed.
+    """
+
+    def __init__(
+        self,
+        db_dir: str | None = None,
+        source: Callable[[], Iterable[tuple[str, str]]] | None = None,
+    ):
+        self.db_dir = db_dir
+        self.source = source
+        self.loaded = False
+        # changes made before the index is loaded, as (id, text), text None for deletes
+        self.pending: list[tuple[str, str | None]] = []
+        self.terms: dict[str, tuple[int, int]] = {}
+        self.postings: np.ndarray = np.empty(0, dtype=POSTING)
+        # postings added since the snapshot as flat (doc, tf) pairs per term
+        self.added: dict[str, array] = {}
+        # per document number, documents are never renumbered until the next snapshot
+        self.ids: list[str | None] = []
+        self.lengths = np.zeros(0, dtype=np.uint32)
+        self.alive = np.zeros(0, dtype=bool)
+        self.numbers: dict[str, int] = {}
+        self.live = 0
+        self.total_length = 0
+        # a word is always split the same way, even after the vocabulary grew
+        self.splits: dict[str, list[str]] = {}
+        self._lock = threading.RLock()
+
+    def add(self, docs: Iterable[tuple[str, str]]):
+        with self._lock:
+            if not self.loaded:
+                self.pending.extend(docs)
+                return
+            for id, text in docs:
+                self._add(id, text)
+
+    def delete(self, ids: Iterable[str]):
+        with self._lock:
+            if not self.loaded:
+                self.pending.extend((id, None) for id in ids)
+                return
+            for id in ids:
+                self._delete(id)
+
+    def search(
+        self, query: str, k: int, accept: Callable[[str], bool] | None = None
+    ) -> list[tuple[str, float]]:
+        # best k documents as (id, score), accept filters candidates in rank order
+        self.ensure_loaded()
+        with self._lock:
+            if not self.live:
+                return []
+            avgdl = self.total_length / self.live
+            docs_parts, tfs_parts, idf_parts = [], [], []
+            query_weight = 0.0
+            for term in set(tokenize(query, self._split)):
+                docs, tfs = self._postings(term)
+                if not len(docs):
+                    continue
+                # deleted documents still count until the next snapshot
+                df = len(docs)
+                idf = math.log(1 + (self.live - df + 0.5) / (df + 0.5))
+                query_weight += idf
+                docs_parts.append(docs)
+                tfs_parts.append(tfs)
+                idf_parts.append(np.full(len(docs), idf))
+            if not docs_parts:
+                return []
+
+            docs = np.concatenate(docs_parts)
+            tfs = np.concatenate(tfs_parts).astype(np.float64)
+            idfs = np.concatenate(idf_parts)
+            norm = K1 * (1 - B + B * self.lengths[docs] / avgdl)
+            term_scores = idfs * tfs * (K1 + 1) / (tfs + norm)
+
+            unique, inverse = np.unique(docs, return_inverse=True)
+            scores = np.bincount(inverse, weights=term_scores)
+            coverage = np.bincount(inverse, weights=idfs) / query_weight
+            eligible = self.alive[unique] & (coverage >= MIN_COVERAGE)
+            unique, scores = unique[eligible], scores[eligible]
+
+            results = []
+            for i in np.argsort(-scores, kind="stable"):
+                id = self.ids[unique[i]]
+                if id is None or (accept and not accept(id)):
+                    continue
+                results.append((id, float(scores[i])))
+                if len(results) >= k:
+                    break
+            return results
+
+    def serialize(self) -> dict[str, bytes]:
+        # merge stored and added postings into a new snapshot, dropping deleted documents
+        self.ensure_loaded()
+        with self._lock:
+            count = len(self.ids)
+            live_docs = np.flatnonzero(self.alive[:count])
+            remap = np.full(count, -1, dtype=np.int64)
+            remap[live_docs] = np.arange(len(live_docs))
+
+            vocab = sorted(self.terms.keys() | self.added.keys())
+            term_ids = {term: i for i, term in enumerate(vocab)}
+
+            # stored postings are grouped by term in offset order
+            stored = sorted(self.terms.items(), key=lambda t: t[1][0])
+            flat_terms = [
+                np.repeat(
+                    np.asarray([term_ids[t] for t, _ in stored], dtype=np.int64),
+                    np.asarray([c for _, (_, c) in stored], dtype=np.int64),
+                )
+            ]
+            flat_docs = [np.asarray(self.postings["doc"], dtype=np.int64)]
+            flat_tfs = [np.asarray(self.postings["tf"])]
+            for term, entries in self.added.items():
+                arr = _pairs(entries)
+                flat_terms.append(np.full(len(arr), term_ids[term], dtype=np.int64))
+                flat_docs.append(arr[:, 0])
+                flat_tfs.append(arr[:, 1].astype(np.uint16))
+            terms_arr = np.concatenate(flat_terms)
+            docs_arr = remap[np.concatenate(flat_docs)]
+            tfs_arr = np.concatenate(flat_tfs)
+
+            keep = docs_arr >= 0
+            terms_arr, docs_arr, tfs_arr = terms_arr[keep], docs_arr[keep], tfs_arr[keep]
+            order = np.argsort(terms_arr, kind="stable")
+            postings = np.empty(len(order), dtype=POSTING)
+            postings["doc"] = docs_arr[order]
+            postings["tf"] = tfs_arr[order]
+
+            counts = np.bincount(terms_arr, minlength=len(vocab))
+            offsets = np.concatenate(([0], np.cumsum(counts)[:-1])) if len(vocab) else counts
+            terms = {
+                term: (int(offsets[i]), int(counts[i]))
+                for i, term in enumerate(vocab)
+                if counts[i]
+            }
+            index = {
+                "terms": terms,
+                "ids": [self.ids[i] for i in live_docs],
+                "lengths": self.lengths[live_docs],
+            }
+        return {
+            LEXICAL_FILE: postings.tobytes(),
+            LEXICAL_INDEX_FILE: pickle.dumps(index, protocol=pickle.HIGHEST_PROTOCOL),
+        }
+
+    def ensure_loaded(self):
+        if self.loaded:
+            return
+        with self._lock:
+            if self.loaded:
+                return
+            if self.db_dir and has_index(self.db_dir):
+                self._open(self.db_dir)
+                pending = self.pending
+            else:
+                # documents of the source already include the pending changes
+                for id, text in self.source() if self.source else ():
+                    self._add(id, text)
+                pending = []
+            self.pending = []
+            self.loaded = True
+            for id, text in pending:
+                if text is None:
+                    self._delete(id)
+                else:
+                    self._add(id, text)
+
+    def _open(self, db_dir: str):
+        with open(os.path.join(db_dir, LEXICAL_INDEX_FILE), "rb") as f:
+            index = pickle.load(f)
+        path = os.path.join(db_dir, LEXICAL_FILE)
+        # a replaced snapshot file stays readable through the open mapping
+        if os.path.getsize(path):
+            self.postings = np.memmap(path, dtype=POSTING, mode="r")
+        self.terms = index["terms"]
+        self.ids = list(index["ids"])
+        self.lengths = np.asarray(index["lengths"], dtype=np.uint32)
+        self.alive = np.ones(len(self.ids), dtype=bool)
+        self.numbers = {id: i for i, id in enumerate(self.ids)}
+        self.live = len(self.ids)
+        self.total_length = int(self.lengths.sum())
+
+    def _add(self, id: str, text: str):
+        if id in self.numbers:
+            self._delete(id)
+        tokens = tokenize(text, self._split)
+        doc = len(self.ids)
+        if doc >= len(self.lengths):
+            size = max(1024, doc * 2)
+            self.lengths = np.concatenate(
+                (self.lengths, np.zeros(size - len(self.lengths), dtype=np.uint32))
+            )
+            self.alive = np.concatenate(
+                (self.alive, np.zeros(size - len(self.alive), dtype=bool))
+            )
+        self.ids.append(id)
+        self.numbers[id] = doc
+        self.lengths[doc] = len(tokens)
+        self.alive[doc] = True
+        for term, tf in Counter(tokens).items():
+            entries = self.added.get(term)
+            if entries is None:
+                entries = self.added[term] = array("I")
+            entries.extend((doc, min(tf, 65535)))
+        self.live += 1
+        self.total_length += len(tokens)
+
+    def _delete(self, id: str):
+        doc = self.numbers.pop(id, None)
+        if doc is None:
+            return
+        self.ids[doc] = None
+        self.alive[doc] = False
+        self.live -= 1
+        self.total_length -= int(self.lengths[doc])
+
+    def _postings(self, term: str) -> tuple[np.ndarray, np.ndarray]:
+        docs, tfs = [], []
+        stored = self.terms.get(term)
+        if stored:
+            start, count = stored
+            segment = self.postings[start : start + count]
+            docs.append(np.asarray(segment["doc"], dtype=np.int64))
+            tfs.append(np.asarray(segment["tf"]))
+        entries = self.added.get(term)
+        if entries:
+            arr = _pairs(entries)
+            docs.append(arr[:, 0])
+            tfs.append(arr[:, 1])
+        if not docs:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        return np.concatenate(docs), np.concatenate(tfs)
+
+    def _split(self, word: str) -> list[str]:
+        parts = self.splits.get(word)
+        if parts is None:
+            if len(self.splits) >= SPLIT_CACHE_SIZE:
+                self.splits.clear()
+            parts = self.splits[word] = split_compound(word, self._known)
+        return parts
+
+    def _known(self, part: str) -> bool:
+        return part in self.terms or part in self.added
+
+
+def _pairs(entries: array) -> np.ndarray:
+    return np.frombuffer(entries, dtype=np.uint32).reshape(-1, 2).astype(np.int64)
+
+
+def reciprocal_rank_fusion(rankings: Iterable[list[str]], k: int = RRF_K) -> list[str]:
+    # ids ordered by summed 1 / (k + rank) over all rankings
+    scores: dict[str, float] = {}
+    for ranking in rankings:
+        for rank, id in enumerate(ranking, start=1):
+            scores[id] = scores.get(id, 0.0) + 1 / (k + rank)
+    return sorted(scores, key=lambda id: scores[id], reverse=True)
+
+
+def has_index(db_dir: str) -> bool:
+    return os.path.exists(os.path.join(db_dir, LEXICAL_INDEX_FILE))
@@ -0,0 +1,74 @@
+import itertools
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable
+
+QUERY_CACHE_SIZE = 512
+EMBEDDING_CACHE_SIZE = 1024
+
+# write generations are unique across databases, a reloaded database never matches old entries
+_generations = itertools.count(1)
+
+
+def next_generation() -> int:
+    return next(_generations)
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.split())
+
+
+class LruCache:
+    """Thread-safe LRU map counting hits and misses."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._items: OrderedDict[Hashable, Any] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any | None:
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self) -> dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._items),
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+# search results by subdir, generation, query and parameters
+query_cache = LruCache(QUERY_CACHE_SIZE)
+# query vectors by embedding model and query
+embedding_cache = LruCache(EMBEDDING_CACHE_SIZE)
+
+
+def stats_text() -> str:
+    # hits skip the FAISS scan (results) or the embedding call (vectors)
+    results, vectors = query_cache.stats(), embedding_cache.stats()
+    return (
+        f"results {results['hits']}/{results['hits'] + results['misses']} cached ({results['hit_rate']:.0%}), "
+        f"embeddings {vectors['hits']}/{vectors['hits'] + vectors['misses']} cached ({vectors['hit_rate']:.0%})"
+    )
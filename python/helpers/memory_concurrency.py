@@ -0,0 +1,148 @@
+import asyncio
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, Callable, TypeVar
+
+T = TypeVar("T")
+
+# faiss releases the GIL while searching, so searches from parallel chats can use all cores
+_pool = ThreadPoolExecutor(
+    max_workers=os.cpu_count() or 4, thread_name_prefix="MemorySearch"
+)
+
+
+async def run_in_pool(func: Callable[..., T], *args: Any) -> T:
+    return await asyncio.get_running_loop().run_in_executor(_pool, func, *args)
+
+
+class AsyncRWLock:
+    """
+    Reader/writer lock for coroutines. Agents, API handlers and background jobs
+    run on different event loops, so waiters are woken thread-safely on their
+    own loop. Waiting writers block new readers to avoid writer starvation.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._readers = 0
+        self._writer = False
+        # queued waiters as (is_writer, loop, future)
+        self._waiting: deque[tuple[bool, asyncio.AbstractEventLoop, asyncio.Future]] = deque()
+
+    @asynccontextmanager
+    async def read(self):
+        await self._acquire(False)
+        try:
+            yield
+        finally:
+            self._release(False)
+
+    @asynccontextmanager
+    async def write(self):
+        await self._acquire(True)
+        try:
+            yield
+        finally:
+            self._release(True)
+
+    async def _acquire(self, writer: bool):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if not self._waiting and self._can_enter(writer):
+                self._enter(writer)
+                return
+            future = loop.create_future()
+            entry = (writer, loop, future)
+            self._waiting.append(entry)
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                queued = entry in self._waiting
+                if queued:
+                    self._waiting.remove(entry)
+                    self._wake()
+            # granted but cancelled before resuming, a cancelled future is released by _grant
+            if not queued and future.done() and not future.cancelled():
+                self._release(writer)
+            raise
+
+    def _release(self, writer: bool):
+        with self._lock:
+            if writer:
+                self._writer = False
+            else:
+                self._readers -= 1
+            self._wake()
+
+    def _can_enter(self, writer: bool) -> bool:
+        if writer:
+            return not self._writer and self._readers == 0
+        return not self._writer
+
+    def _enter(self, writer: bool):
+        if writer:
+            self._writer = True
+        else:
+            self._readers += 1
+
+    def _wake(self):
+        # grant waiters in order, consecutive readers enter together
+        while self._waiting:
+            writer, loop, future = self._waiting[0]
+            if not self._can_enter(writer):
+                break
+            self._waiting.popleft()
+            self._enter(writer)
+            loop.call_soon_threadsafe(self._grant, writer, future)
+            if writer:
+                break
+
+    def _grant(self, writer: bool, future: asyncio.Future):
+        if future.done():
+            self._release(writer)  # waiter was cancelled meanwhile
+        else:
+            future.set_result(None)
+
+
+class SearchBatcher:
+    """
+    Collects searches issued in the same event loop tick and runs them as a
+    single batch in the search pool.
+    """
+
+    def __init__(self, run_batch: Callable[[list[Any]], list[Any]]):
+        self.run_batch = run_batch
+        self.pending: dict[asyncio.AbstractEventLoop, list[tuple[Any, asyncio.Future]]] = {}
+        self._lock = threading.Lock()
+
+    async def submit(self, request: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            batch = self.pending.setdefault(loop, [])
+            batch.append((request, future))
+            if len(batch) == 1:
+                loop.call_soon(self._flush, loop)
+        return await future
+
+    def _flush(self, loop: asyncio.AbstractEventLoop):
+        with self._lock:
+            batch = self.pending.pop(loop, [])
+        if batch:
+            loop.create_task(self._run(batch))
+
+    async def _run(self, batch: list[tuple[Any, asyncio.Future]]):
+        try:
+            results = await run_in_pool(self.run_batch, [request for request, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
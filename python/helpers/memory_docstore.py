@@ -0,0 +1,262 @@
+import json
+import mmap
+import os
+import pickle
+import re
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Any, Iterator, Mapping
+
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_core.documents import Document
+
+from python.helpers.memory_bm25 import LEXICAL_FILE, LEXICAL_INDEX_FILE
+from python.helpers.memory_wal import write_atomic
+
+DOCS_FILE = "docs.dat"
+DOCS_INDEX_FILE = "docs.idx"
+# legacy snapshot with the whole docstore pickled in one file
+LEGACY_DOCSTORE_FILE = "index.pkl"
+INDEX_FILE = "index.faiss"
+SNAPSHOT_FILES = (DOCS_FILE, DOCS_INDEX_FILE, LEXICAL_FILE, LEXICAL_INDEX_FILE, INDEX_FILE)
+# names the directory of the current snapshot, swapping it switches all files at once
+MANIFEST_FILE = "snapshot.json"
+_SNAPSHOT_DIR_PATTERN = re.compile(r"^snapshot\.[0-9a-f]+$")
+
+# documents kept deserialized after being read
+CACHE_SIZE = 1024
+
+
+class LazyDocstore(Docstore, AddableMixin):
+    """
+    Docstore backed by a snapshot file of pickled documents and a table of
+    their offsets. Documents are read only when looked up, documents added
+    after the snapshot are kept in memory until the next snapshot.
+    """
+
+    def __init__(
+        self,
+        path: str | None = None,
+        offsets: dict[str, tuple[int, int]] | None = None,
+    ):
+        self.path = path
+        self.offsets = offsets or {}
+        self.added: dict[str, Document] = {}
+        self.deleted: set[str] = set()
+        self.cache: OrderedDict[str, Document] = OrderedDict()
+        self._map: mmap.mmap | None = None
+        self._lock = threading.Lock()
+        self._dict = DocumentMap(self)
+
+    def add(self, texts: dict[str, Document]) -> None:
+        overlapping = [id for id in texts if id in self._dict]
+        if overlapping:
+            raise ValueError(f"Tried to add ids that already exist: {overlapping}")
+        # the lock keeps changes out of a running rebase or serialize
+        with self._lock:
+            for id, doc in texts.items():
+                self.deleted.discard(id)
+                self.added[id] = doc
+
+    def delete(self, ids: list) -> None:
+        with self._lock:
+            for id in ids:
+                self.added.pop(id, None)
+                self.cache.pop(id, None)
+                self.deleted.add(id)
+
+    def search(self, search: str) -> str | Document:
+        doc = self.get(search)
+        if doc is None:
+            return f"ID {search} not found."
+        return doc
+
+    def get(self, id: str) -> Document | None:
+        doc = self.added.get(id)
+        if doc is not None:
+            return doc
+        with self._lock:
+            if id in self.deleted or id not in self.offsets:
+                return None
+            doc = self.cache.get(id)
+            if doc is not None:
+                self.cache.move_to_end(id)
+                return doc
+            doc = pickle.loads(self._read_raw(id))
+            self.cache[id] = doc
+            if len(self.cache) > CACHE_SIZE:
+                self.cache.popitem(last=False)
+            return doc
+
+    def ids(self) -> Iterator[str]:
+        for id in self.offsets:
+            if id not in self.deleted:
+                yield id
+        yield from self.added
+
+    def count(self) -> int:
+        removed = sum(1 for id in self.deleted if id in self.offsets)
+        return len(self.offsets) - removed + len(self.added)
+
+    def rebase(self, path: str, offsets: dict[str, tuple[int, int]]):
+        # switch to a newly written snapshot, changes made since it was serialized are kept
+        with self._lock:
+            self.added = {id: doc for id, doc in self.added.items() if id not in offsets}
+            self.deleted = {id for id in self.deleted if id in offsets}
+            self.path = path
+            self.offsets = offsets
+            self._map = None
+
+    def serialize(self) -> tuple[bytes, dict[str, tuple[int, int]]]:
+        # snapshot documents are copied as stored, without unpickling them
+        parts = []
+        offsets = {}
+        pos = 0
+        with self._lock:
+            for id in self.ids():
+                doc = self.added.get(id)
+                raw = (
+                    pickle.dumps(doc, protocol=pickle.HIGHEST_PROTOCOL)
+                    if doc is not None
+                    else self._read_raw(id)
+                )
+                parts.append(raw)
+                offsets[id] = (pos, len(raw))
+                pos += len(raw)
+        return b"".join(parts), offsets
+
+    def _read_raw(self, id: str) -> bytes:
+        if self._map is None:
+            if not self.path:
+                raise KeyError(id)
+            # a replaced snapshot file stays readable through the open mapping
+            with open(self.path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        start, length = self.offsets[id]
+        return self._map[start : start + length]
+
+    def __getstate__(self):
+        # pickled as a plain dict of documents, e.g. when saved with FAISS.save_local
+        return {"docs": {id: self._dict[id] for id in self.ids()}}
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.added = state["docs"]
+
+
+class DocumentMap(Mapping[str, Document]):
+    """Read-only dict view over a LazyDocstore, loads documents on access."""
+
+    def __init__(self, store: LazyDocstore):
+        self.store = store
+
+    def __getitem__(self, id: str) -> Document:
+        doc = self.store.get(id)
+        if doc is None:
+            raise KeyError(id)
+        return doc
+
+    def __contains__(self, id: Any) -> bool:
+        store = self.store
+        return id in store.added or (id in store.offsets and id not in store.deleted)
+
+    def __iter__(self) -> Iterator[str]:
+        return self.store.ids()
+
+    def __len__(self) -> int:
+        return self.store.count()
+
+
+def serialize_docs(docstore: Docstore) -> tuple[bytes, dict[str, tuple[int, int]]]:
+    if isinstance(docstore, LazyDocstore):
+        return docstore.serialize()
+    parts = []
+    offsets = {}
+    pos = 0
+    for id, doc in docstore._dict.items():  # type: ignore
+        raw = pickle.dumps(doc, protocol=pickle.HIGHEST_PROTOCOL)
+        parts.append(raw)
+        offsets[id] = (pos, len(raw))
+        pos += len(raw)
+    return b"".join(parts), offsets
+
+
+def read_docs_index(db_dir: str) -> dict[str, Any]:
+    with open(os.path.join(db_dir, DOCS_INDEX_FILE), "rb") as f:
+        return pickle.load(f)
+
+
+def read_manifest(db_dir: str) -> dict[str, Any] | None:
+    path = os.path.join(db_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def snapshot_dir(db_dir: str) -> str | None:
+    # directory holding the files of the current snapshot, None without one
+    manifest = read_manifest(db_dir)
+    if manifest is None:
+        # flat layout written before snapshot directories
+        if os.path.exists(os.path.join(db_dir, INDEX_FILE)):
+            return db_dir
+        return None
+    path = os.path.join(db_dir, manifest["dir"])
+    for name, size in manifest["files"].items():
+        file = os.path.join(path, name)
+        if not os.path.exists(file) or os.path.getsize(file) != size:
+            raise Exception(f"Memory snapshot {path} is damaged, {name} does not match")
+    return path
+
+
+def has_snapshot(db_dir: str) -> bool:
+    return snapshot_dir(db_dir) is not None
+
+
+def write_snapshot(db_dir: str, parts: dict[str, bytes | bytearray]) -> str:
+    # files go to a new directory, the manifest swap makes them current together
+    name = f"snapshot.{uuid.uuid4().hex}"
+    path = os.path.join(db_dir, name)
+    os.makedirs(path)
+    for file in SNAPSHOT_FILES:
+        with open(os.path.join(path, file), "wb") as f:
+            f.write(parts[file])
+            f.flush()
+            os.fsync(f.fileno())
+    _fsync_dir(path)
+    manifest = {"dir": name, "files": {file: len(parts[file]) for file in SNAPSHOT_FILES}}
+    write_manifest(db_dir, manifest)
+    return path
+
+
+def write_manifest(db_dir: str, manifest: dict[str, Any]):
+    write_atomic(os.path.join(db_dir, MANIFEST_FILE), json.dumps(manifest).encode())
+    _fsync_dir(db_dir)
+
+
+def remove_old_snapshots(db_dir: str):
+    # directories of replaced or unfinished snapshots and files of the flat layout
+    manifest = read_manifest(db_dir)
+    if manifest is None:
+        return
+    for name in os.listdir(db_dir):
+        path = os.path.join(db_dir, name)
+        if _SNAPSHOT_DIR_PATTERN.match(name) and name != manifest["dir"]:
+            shutil.rmtree(path, ignore_errors=True)
+        elif name in SNAPSHOT_FILES or name == LEGACY_DOCSTORE_FILE:
+            os.remove(path)
+
+
+def _fsync_dir(path: str):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def is_lazy_snapshot(db_dir: str) -> bool:
+    return os.path.exists(os.path.join(db_dir, DOCS_INDEX_FILE))
@@ -0,0 +1,402 @@
+import ast
+import bisect
+from functools import lru_cache
+import operator
+from typing import Any, Callable
+
+from python.helpers.print_style import PrintStyle
+
+# metadata fields kept in the inverted index
+INDEXED_FIELDS = ("area", "timestamp", "knowledge_source")
+
+_COMPARE_OPS: dict[type, Callable[[Any, Any], Any]] = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.In: lambda a, b: a in b,
+    ast.NotIn: lambda a, b: a not in b,
+    ast.Is: operator.is_,
+    ast.IsNot: operator.is_not,
+}
+
+_BIN_OPS: dict[type, Callable[[Any, Any], Any]] = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+}
+
+_UNARY_OPS: dict[type, Callable[[Any], Any]] = {
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+}
+
+# methods a filter may call, only on values of these builtin types
+_METHODS = frozenset(
+    {
+        "startswith", "endswith", "lower", "upper", "casefold", "title", "capitalize",
+        "strip", "lstrip", "rstrip", "find", "rfind", "replace", "split", "rsplit",
+        "isdigit", "isnumeric", "isalpha", "isalnum", "isspace",
+        "count", "index", "get", "keys", "values", "items",
+    }
+)
+_METHOD_TYPES = (str, list, tuple, dict)
+
+# plain functions a filter may call
+_FUNCTIONS: dict[str, Callable[..., Any]] = {
+    "len": len,
+    "str": str,
+    "int": int,
+    "float": float,
+    "bool": bool,
+    "abs": abs,
+    "min": min,
+    "max": max,
+    "round": round,
+}
+
+# flipped operators for constants on the left side, like '2024' < timestamp
+_FLIPPED_OPS: dict[type, type] = {
+    ast.Eq: ast.Eq,
+    ast.Lt: ast.Gt,
+    ast.LtE: ast.GtE,
+    ast.Gt: ast.Lt,
+    ast.GtE: ast.LtE,
+}
+
+
+class MetadataIndex:
+    """Inverted index of document ids by metadata field value."""
+
+    def __init__(self, fields: tuple[str, ...] = INDEXED_FIELDS):
+        self.fields = fields
+        self.values: dict[str, dict[Any, set[str]]] = {f: {} for f in fields}
+        self.sorted_values: dict[str, list[Any]] = {f: [] for f in fields}
+
+    def add(self, id: str, metadata: dict[str, Any]):
+        for field in self.fields:
+            value = metadata.get(field)
+            if value is None:
+                continue
+            ids = self.values[field].get(value)
+            if ids is None:
+                ids = self.values[field][value] = set()
+                self._insort(field, value)
+            ids.add(id)
+
+    def remove(self, id: str, metadata: dict[str, Any]):
+        for field in self.fields:
+            value = metadata.get(field)
+            ids = self.values[field].get(value)
+            if ids is None:
+                continue
+            ids.discard(id)
+            if not ids:
+                del self.values[field][value]
+                self._remove_sorted(field, value)
+
+    def lookup(self, field: str, value: Any) -> set[str]:
+        try:
+            return self.values[field].get(value, set())
+        except TypeError:
+            return set()  # unhashable value
+
+    def range(self, field: str, op: type, value: Any) -> set[str] | None:
+        keys = self.sorted_values[field]
+        try:
+            if op is ast.Gt:
+                selected = keys[bisect.bisect_right(keys, value) :]
+            elif op is ast.GtE:
+                selected = keys[bisect.bisect_left(keys, value) :]
+            elif op is ast.Lt:
+                selected = keys[: bisect.bisect_left(keys, value)]
+            else:
+                selected = keys[: bisect.bisect_right(keys, value)]
+        except TypeError:
+            return None  # mixed value types, can't use ordering
+        result: set[str] = set()
+        for key in selected:
+            result |= self.values[field][key]
+        return result
+
+    def prefix(self, field: str, prefix: str) -> set[str] | None:
+        keys = self.sorted_values[field]
+        try:
+            start = bisect.bisect_left(keys, prefix)
+        except TypeError:
+            return None
+        result: set[str] = set()
+        for key in keys[start:]:
+            if not (isinstance(key, str) and key.startswith(prefix)):
+                break
+            result |= self.values[field][key]
+        return result
+
+    def _insort(self, field: str, value: Any):
+        try:
+            bisect.insort(self.sorted_values[field], value)
+        except TypeError:
+            pass  # values that can't be ordered are only used for equality
+
+    def _remove_sorted(self, field: str, value: Any):
+        keys = self.sorted_values[field]
+        try:
+            pos = bisect.bisect_left(keys, value)
+        except TypeError:
+            return
+        if pos < len(keys) and keys[pos] == value:
+            del keys[pos]
+
+
+class _Node:
+    def evaluate(self, data: dict[str, Any]) -> Any:
+        raise NotImplementedError
+
+    def candidates(self, index: MetadataIndex) -> set[str] | None:
+        # superset of matching ids, None when the index can't narrow it down
+        return None
+
+
+class _BoolOp(_Node):
+    def __init__(self, is_and: bool, values: list[_Node]):
+        self.is_and = is_and
+        self.values = values
+
+    def evaluate(self, data):
+        if self.is_and:
+            return all(v.evaluate(data) for v in self.values)
+        return any(v.evaluate(data) for v in self.values)
+
+    def candidates(self, index):
+        sets = [v.candidates(index) for v in self.values]
+        if self.is_and:
+            known = [s for s in sets if s is not None]
+            if not known:
+                return None
+            return set.intersection(*sorted(known, key=len))
+        if any(s is None for s in sets):
+            return None
+        return set().union(*sets)  # type: ignore
+
+
+class _Not(_Node):
+    def __init__(self, operand: _Node):
+        self.operand = operand
+
+    def evaluate(self, data):
+        return not self.operand.evaluate(data)
+
+
+class _Compare(_Node):
+    def __init__(self, operands: list[_Node], ops: list[type]):
+        self.operands = operands
+        self.ops = ops
+        self.funcs = [_COMPARE_OPS[op] for op in ops]
+
+    def evaluate(self, data):
+        left = self.operands[0].evaluate(data)
+        for func, node in zip(self.funcs, self.operands[1:]):
+            right = node.evaluate(data)
+            if not func(left, right):
+                return False
+            left = right
+        return True
+
+    def candidates(self, index):
+        if len(self.ops) != 1:
+            return None
+        left, right = self.operands
+        op = self.ops[0]
+        if isinstance(right, _Name) and isinstance(left, _Constant):
+            if op not in _FLIPPED_OPS:
+                return None
+            left, right, op = right, left, _FLIPPED_OPS[op]
+        if not (isinstance(left, _Name) and isinstance(right, _Constant)):
+            return None
+        if left.name not in index.fields:
+            return None
+        if op is ast.Eq:
+            return index.lookup(left.name, right.value)
+        if op is ast.In and isinstance(right.value, (list, tuple, set, frozenset)):
+            result: set[str] = set()
+            for value in right.value:
+                result |= index.lookup(left.name, value)
+            return result
+        if op in (ast.Lt, ast.LtE, ast.Gt, ast.GtE):
+            return index.range(left.name, op, right.value)
+        return None
+
+
+class _Name(_Node):
+    def __init__(self, name: str):
+        self.name = name
+
+    def evaluate(self, data):
+        return data[self.name]  # missing field fails the whole filter
+
+
+class _Method(_Node):
+    def __init__(self, target: _Node, name: str, args: list[_Node]):
+        self.target = target
+        self.name = name
+        self.args = args
+
+    def evaluate(self, data):
+        value = self.target.evaluate(data)
+        if not isinstance(value, _METHOD_TYPES):
+            raise TypeError(f"{self.name} can't be called on {type(value).__name__}")
+        return getattr(value, self.name)(*(a.evaluate(data) for a in self.args))
+
+    def candidates(self, index):
+        if not (
+            self.name == "startswith"
+            and isinstance(self.target, _Name)
+            and self.target.name in index.fields
+            and len(self.args) == 1
+            and isinstance(self.args[0], _Constant)
+            and isinstance(self.args[0].value, str)
+        ):
+            return None
+        return index.prefix(self.target.name, self.args[0].value)
+
+
+class _Call(_Node):
+    def __init__(self, func: Callable[..., Any], args: list[_Node]):
+        self.func = func
+        self.args = args
+
+    def evaluate(self, data):
+        return self.func(*(a.evaluate(data) for a in self.args))
+
+
+class _Operation(_Node):
+    # arithmetic, subscripts, slices and collections, built from their evaluated operands
+    def __init__(self, func: Callable[..., Any], operands: list[_Node]):
+        self.func = func
+        self.operands = operands
+
+    def evaluate(self, data):
+        return self.func(*(o.evaluate(data) for o in self.operands))
+
+
+class _IfExp(_Node):
+    def __init__(self, test: _Node, body: _Node, orelse: _Node):
+        self.test = test
+        self.body = body
+        self.orelse = orelse
+
+    def evaluate(self, data):
+        if self.test.evaluate(data):
+            return self.body.evaluate(data)
+        return self.orelse.evaluate(data)
+
+
+class _Eval(_Node):
+    # python evaluation of expressions the compiler doesn't cover, as before compiled filters
+    def __init__(self, code: Any):
+        self.code = code
+
+    def evaluate(self, data):
+        return eval(self.code, {}, data)
+
+
+class _Constant(_Node):
+    def __init__(self, value: Any):
+        self.value = value
+
+    def evaluate(self, data):
+        return self.value
+
+
+class MetadataFilter:
+    """Filter expression compiled once, called with document metadata."""
+
+    def __init__(self, condition: str, root: _Node | None):
+        self.condition = condition
+        self.root = root
+
+    def __call__(self, data: dict[str, Any]) -> bool:
+        if self.root is None:
+            return False
+        try:
+            return bool(self.root.evaluate(data))
+        except Exception:
+            return False
+
+    def candidates(self, index: MetadataIndex) -> set[str] | None:
+        if self.root is None:
+            return set()
+        return self.root.candidates(index)
+
+
+@lru_cache(maxsize=256)
+def compile_filter(condition: str) -> MetadataFilter:
+    # invalid expressions match nothing, same as a failing comparison
+    try:
+        tree = ast.parse(condition.strip(), mode="eval")
+    except SyntaxError:
+        return MetadataFilter(condition, None)
+    try:
+        root = _compile(tree.body)
+    except ValueError as e:
+        # valid python outside the supported subset is evaluated, without index lookups
+        PrintStyle.warning(
+            f"Memory filter \"{condition}\" is evaluated with eval() for every document: {e}"
+        )
+        root = _Eval(compile(tree, "<filter>", "eval"))
+    return MetadataFilter(condition, root)
+
+
+def _compile(node: ast.AST) -> _Node:
+    if isinstance(node, ast.BoolOp):
+        return _BoolOp(
+            isinstance(node.op, ast.And), [_compile(v) for v in node.values]
+        )
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+        return _Not(_compile(node.operand))
+    if isinstance(node, ast.Compare):
+        ops = [type(op) for op in node.ops]
+        if any(op not in _COMPARE_OPS for op in ops):
+            raise ValueError("Unsupported comparison")
+        return _Compare([_compile(node.left)] + [_compile(c) for c in node.comparators], ops)
+    if isinstance(node, ast.Call) and not node.keywords:
+        args = [_compile(a) for a in node.args]
+        func = node.func
+        if isinstance(func, ast.Attribute) and func.attr in _METHODS:
+            return _Method(_compile(func.value), func.attr, args)
+        if isinstance(func, ast.Name) and func.id in _FUNCTIONS:
+            return _Call(_FUNCTIONS[func.id], args)
+        raise ValueError(f"Unsupported filter call: {ast.dump(func)}")
+    if isinstance(node, ast.Name):
+        return _Name(node.id)
+    if isinstance(node, ast.IfExp):
+        return _IfExp(_compile(node.test), _compile(node.body), _compile(node.orelse))
+    if isinstance(node, ast.BinOp) and type(node.op) in _BIN_OPS:
+        return _Operation(_BIN_OPS[type(node.op)], [_compile(node.left), _compile(node.right)])
+    if isinstance(node, ast.Subscript):
+        return _Operation(operator.getitem, [_compile(node.value), _compile(node.slice)])
+    if isinstance(node, ast.Slice):
+        parts = [node.lower, node.upper, node.step]
+        return _Operation(
+            slice, [_compile(p) if p else _Constant(None) for p in parts]
+        )
+    if isinstance(node, (ast.Constant, ast.List, ast.Tuple, ast.Set)):
+        try:
+            # literal values stay constants, usable for index lookups
+            return _Constant(ast.literal_eval(node))
+        except (ValueError, TypeError):
+            pass
+    if isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+        # collections with field names in them, like [area, 'main']
+        kind = {ast.List: list, ast.Tuple: tuple, ast.Set: set}[type(node)]
+        return _Operation(lambda *items: kind(items), [_compile(e) for e in node.elts])
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPS:
+        if isinstance(node.operand, ast.Constant):
+            return _Constant(ast.literal_eval(node))
+        return _Operation(_UNARY_OPS[type(node.op)], [_compile(node.operand)])
+    raise ValueError(f"Unsupported filter expression: {ast.dump(node)}")
@@ -0,0 +1,231 @@
+from dataclasses import dataclass, fields, replace
+import json
+import math
+import os
+from typing import Literal, get_args
+
+import faiss
+import numpy as np
+
+IndexType = Literal["auto", "flat", "ivf_flat", "hnsw", "ivf_pq"]
+Quantization = Literal["none", "sq8", "sq_fp16", "pq"]
+
+# faiss needs roughly this many training points per IVF list
+TRAIN_POINTS_PER_LIST = 39
+# deleted slots in non-removable indexes trigger a rebuild above this ratio
+MAX_TOMBSTONE_RATIO = 0.2
+# filtered searches with fewer candidates are scored exactly instead of via the index
+EXACT_SEARCH_LIMIT = 4096
+# scalar quantizers need some vectors to learn value ranges
+MIN_SQ_TRAIN_COUNT = 1000
+# product quantizer codebooks have 256 centroids per sub-vector
+MIN_PQ_TRAIN_COUNT = 256 * TRAIN_POINTS_PER_LIST
+# quantized range searches start this far below the threshold before exact re-scoring
+RANGE_MARGIN = {"sq8": 0.05, "sq_fp16": 0.01, "pq": 0.15}
+# optional overrides of the settings in a memory subdir, e.g. {"type": "ivf_pq"}
+CONFIG_FILE = "index_config.json"
+
+_SQ_TYPES = {
+    "sq8": faiss.ScalarQuantizer.QT_8bit,
+    "sq_fp16": faiss.ScalarQuantizer.QT_fp16,
+}
+
+
+@dataclass
+class IndexConfig:
+    type: IndexType = "auto"
+    promote_at: int = 50000
+    hnsw_m: int = 32
+    hnsw_ef_search: int = 128
+    ivf_nprobe: int = 16
+    pq_m: int = 16
+    quantization: Quantization = "none"
+    rerank_factor: int = 4
+
+
+def read_config(db_dir: str, defaults: IndexConfig) -> IndexConfig:
+    path = os.path.join(db_dir, CONFIG_FILE)
+    if not os.path.exists(path):
+        return defaults
+    with open(path) as f:
+        overrides = json.load(f)
+    unknown = set(overrides) - {field.name for field in fields(IndexConfig)}
+    if unknown:
+        raise ValueError(f"Unknown index settings {sorted(unknown)} in {path}")
+    config = replace(defaults, **overrides)
+    if config.type not in get_args(IndexType):
+        raise ValueError(f"Unknown index type '{config.type}' in {path}")
+    if config.quantization not in get_args(Quantization):
+        raise ValueError(f"Unknown quantization '{config.quantization}' in {path}")
+    return config
+
+
+def get_index_type(index: faiss.Index) -> IndexType:
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+
+def get_quantization(index: faiss.Index) -> Quantization:
+    if isinstance(index, (faiss.IndexPQ, faiss.IndexHNSWPQ, faiss.IndexIVFPQ)):
+        return "pq"
+    sq = None
+    if isinstance(index, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        sq = index.sq
+    elif isinstance(index, faiss.IndexHNSWSQ):
+        sq = faiss.downcast_index(index.storage).sq
+    if sq is not None:
+        return "sq8" if sq.qtype == faiss.ScalarQuantizer.QT_8bit else "sq_fp16"
+    return "none"
+
+
+def target_index_type(config: IndexConfig, count: int) -> IndexType:
+    # small collections are served best by exact search
+    if config.type == "auto":
+        return "hnsw" if count >= config.promote_at else "flat"
+    # ivf indexes need enough vectors to train the coarse quantizer first
+    if config.type in ("ivf_flat", "ivf_pq"):
+        if count < max(config.promote_at, _min_train_count(count)):
+            return "flat"
+        # product quantized ivf is the ivf_pq type
+        if config.type == "ivf_flat" and target_quantization(config, count) == "pq":
+            return "ivf_pq"
+    return config.type
+
+
+def target_quantization(config: IndexConfig, count: int) -> Quantization:
+    if config.type == "ivf_pq" and target_index_type(config, count) == "ivf_pq":
+        return "pq"
+    # quantizers are trained on existing vectors, stay uncompressed until there are enough
+    if config.quantization == "pq" and count < MIN_PQ_TRAIN_COUNT:
+        return "none"
+    if config.quantization in _SQ_TYPES and count < MIN_SQ_TRAIN_COUNT:
+        return "none"
+    return config.quantization
+
+
+def needs_rebuild(index: faiss.Index, config: IndexConfig, count: int) -> bool:
+    current = get_index_type(index)
+    if current != target_index_type(config, count):
+        return True
+    if get_quantization(index) != target_quantization(config, count):
+        return True
+    if not supports_remove(index) and index.ntotal:
+        # too many tombstones left behind by deletes
+        if (index.ntotal - count) / index.ntotal > MAX_TOMBSTONE_RATIO:
+            return True
+    if isinstance(index, faiss.IndexIVF):
+        # retrain when the collection outgrew the coarse quantizer
+        return _nlist(count) >= index.nlist * 2
+    return False
+
+
+def supports_remove(index: faiss.Index) -> bool:
+    # flat indexes compact on removal, others keep positions as tombstones
+    return isinstance(index, faiss.IndexFlat)
+
+
+def create_index(
+    index_type: IndexType,
+    dim: int,
+    config: IndexConfig,
+    vectors: np.ndarray,
+    quantization: Quantization = "none",
+) -> faiss.Index:
+    # build and train the index, vectors are only used for training
+    metric = faiss.METRIC_INNER_PRODUCT
+    if index_type == "hnsw":
+        if quantization == "pq":
+            index = faiss.IndexHNSWPQ(dim, _pq_m(config, dim), config.hnsw_m, 8, metric)
+        elif quantization in _SQ_TYPES:
+            index = faiss.IndexHNSWSQ(dim, _SQ_TYPES[quantization], config.hnsw_m, metric)
+        else:
+            index = faiss.IndexHNSWFlat(dim, config.hnsw_m, metric)
+        index.hnsw.efSearch = config.hnsw_ef_search
+    elif index_type in ("ivf_flat", "ivf_pq"):
+        nlist = _nlist(len(vectors))
+        quantizer = faiss.IndexFlatIP(dim)
+        if index_type == "ivf_pq":
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, _pq_m(config, dim), 8, metric)
+        elif quantization in _SQ_TYPES:
+            index = faiss.IndexIVFScalarQuantizer(
+                quantizer, dim, nlist, _SQ_TYPES[quantization], metric
+            )
+        else:
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, metric)
+        index.nprobe = min(config.ivf_nprobe, nlist)
+    elif quantization == "pq":
+        index = faiss.IndexPQ(dim, _pq_m(config, dim), 8, metric)
+    elif quantization in _SQ_TYPES:
+        index = faiss.IndexScalarQuantizer(dim, _SQ_TYPES[quantization], metric)
+    else:
+        return faiss.IndexFlatIP(dim)
+    if not index.is_trained:
+        index.train(vectors)
+    return index
+
+
+def serialize_index(index: faiss.Index) -> bytearray:
+    # streamed into one buffer, faiss.serialize_index grows a vector by doubling and copies it out
+    buffer = bytearray()
+    faiss.write_index(index, faiss.PyCallbackIOWriter(buffer.extend))
+    return buffer
+
+
+def read_index(path: str) -> faiss.Index:
+    # vectors stay on disk and are paged in on demand
+    index = faiss.read_index(path, faiss.IO_FLAG_MMAP)
+    if isinstance(index, faiss.IndexIVF):
+        # mapped inverted lists are read-only, ivf indexes have to be loaded to accept adds
+        index = faiss.read_index(path)
+    return index
+
+
+def reconstruct_all(index: faiss.Index) -> np.ndarray:
+    _ensure_direct_map(index)
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def reconstruct_batch(index: faiss.Index, positions: np.ndarray) -> np.ndarray:
+    _ensure_direct_map(index)
+    return index.reconstruct_batch(positions)
+
+
+def _ensure_direct_map(index: faiss.Index):
+    # ivf indexes need a position lookup before vectors can be reconstructed
+    if isinstance(index, faiss.IndexIVF) and index.direct_map.no():
+        index.make_direct_map()
+
+
+def supports_selector(index: faiss.Index) -> bool:
+    # plain product quantizer search ignores id selectors
+    return not isinstance(index, faiss.IndexPQ)
+
+
+def search_params(index: faiss.Index, selector: faiss.IDSelector) -> faiss.SearchParameters:
+    # each index family requires its own parameter type
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    if isinstance(index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=index.nprobe)
+    return faiss.SearchParameters(sel=selector)
+
+
+def _nlist(count: int) -> int:
+    return max(1, int(4 * math.sqrt(count)))
+
+
+def _min_train_count(count: int) -> int:
+    return _nlist(count) * TRAIN_POINTS_PER_LIST
+
+
+def _pq_m(config: IndexConfig, dim: int) -> int:
+    # number of sub-quantizers has to divide the dimension
+    m = min(config.pq_m, dim)
+    while dim % m:
+        m -= 1
+    return m
@@ -0,0 +1,323 @@
+import asyncio
+import json
+import os
+import shutil
+import threading
+import time
+from typing import TYPE_CHECKING, Any
+
+import faiss
+from langchain_community.vectorstores.utils import DistanceStrategy
+
+from python.helpers.defer import DeferredTask
+from python.helpers.log import LogItem
+from python.helpers.memory_wal import MemoryWal
+from python.helpers import memory_docstore
+from python.helpers.memory_docstore import LazyDocstore
+from python.helpers.memory_vectors import FullVectors
+from python.helpers.print_style import PrintStyle
+from python.helpers import errors
+
+if TYPE_CHECKING:
+    from agent import Agent, ModelConfig
+    from python.helpers.memory import MyFaiss
+
+STAGING_DIR = "reindex"
+READY_FILE = "READY"
+EMBEDDING_FILE = "embedding.json"
+BATCH_SIZE = 64
+
+# running jobs by memory subdir
+jobs: dict[str, "ReindexJob"] = {}
+
+
+class ReindexJob:
+    """
+    Re-embeds all documents of a memory database with a new embedding model.
+    The new index is built in a staging folder next to the live one, with its
+    own log as checkpoint, so an interrupted job resumes where it stopped.
+    Writes to the live database are mirrored into the staging one until the
+    new index is swapped in.
+    """
+
+    def __init__(
+        self,
+        db: "MyFaiss",
+        memory_subdir: str,
+        db_dir: str,
+        model_config: "ModelConfig",
+        embedder: Any,
+        keyword_only: bool,
+    ):
+        self.db = db
+        self.memory_subdir = memory_subdir
+        self.db_dir = db_dir
+        self.staging_dir = os.path.join(db_dir, STAGING_DIR)
+        self.model_config = model_config
+        self.embedder = embedder
+        self.keyword_only = keyword_only
+        self.staging: "MyFaiss | None" = None
+        self.lock = threading.RLock()
+        self.finished = threading.Event()
+        self.state = "pending"
+        self.total = 0
+        self.done = 0
+        self.error = ""
+        self.started_at = 0.0
+        self.agent: "Agent | None" = None
+        self.log_item: LogItem | None = None
+        self.task: DeferredTask | None = None
+
+    def start(self, agent: "Agent", log_item: LogItem | None):
+        # a job still running for the same subdir is replaced, this one resumes its checkpoint
+        cancel(self.memory_subdir)
+        jobs[self.memory_subdir] = self
+        self.agent = agent
+        self.log_item = log_item
+        self.task = DeferredTask(thread_name="MemoryReindex")
+        self.task.start_task(self.run)
+
+    def status(self) -> dict[str, Any]:
+        return {
+            "subdir": self.memory_subdir,
+            "state": self.state,
+            "total": self.total,
+            "done": self.done,
+            "keyword_only": self.keyword_only,
+            "model": f"{self.model_config.provider.name}/{self.model_config.name}",
+            "elapsed": round(time.time() - self.started_at, 1) if self.started_at else 0,
+            "error": self.error,
+        }
+
+    async def run(self):
+        from python.helpers.memory import Memory
+
+        self.started_at = time.time()
+        self.state = "running"
+        try:
+            self.staging = self._load_staging()
+            todo = self._reconcile()
+            self._progress()
+
+            for i in range(0, len(todo), BATCH_SIZE):
+                await self._embed_batch(todo[i : i + BATCH_SIZE])
+                self._progress()
+                # checkpoint, folds the staging log into a snapshot when large
+                if self.staging.wal and self.staging.wal.needs_compaction():
+                    await Memory.compact(self.staging)
+
+            await self._swap()
+            self.state = "done"
+            self._progress()
+        except Exception as e:
+            self.state = "failed"
+            self.error = errors.error_text(e)
+            PrintStyle.error(f"Memory re-index failed: {errors.format_error(e)}")
+            if self.log_item:
+                self.log_item.stream(progress=f"\nRe-index failed: {self.error}")
+        finally:
+            self.finished.set()
+            if jobs.get(self.memory_subdir) is self:
+                del jobs[self.memory_subdir]
+
+    async def mirror(self, record: dict) -> dict:
+        # same mutation with vectors from the new model
+        if record["op"] == "add":
+            vectors = await self.embedder.aembed_documents(record["texts"])
+            return {**record, "vectors": vectors}
+        if record["op"] == "batch":
+            return {
+                **record,
+                "records": [await self.mirror(sub) for sub in record["records"]],
+            }
+        return record
+
+    def apply_staging(self, record: dict):
+        from python.helpers.memory import Memory
+
+        if self.staging and self.staging.wal:
+            # wal lock keeps a concurrent compaction from serializing half a change
+            with self.staging.wal.lock:
+                self.staging.wal.append(record)
+                Memory._apply_record(self.staging, record)
+
+    async def _embed_batch(self, ids: list[str]):
+        from python.helpers.memory import Memory
+
+        live = self.db.get_all_docs()
+        docs = [live[id] for id in ids if id in live]
+        if not docs:
+            return
+        if self.agent:
+            await self.agent.rate_limiter(
+                model_config=self.model_config,
+                input="".join(doc.page_content for doc in docs),
+                background=True,
+            )
+        vectors = await self.embedder.aembed_documents(
+            [doc.page_content for doc in docs]
+        )
+
+        with self.lock:
+            # documents deleted while embedding must not come back
+            live = self.db.get_all_docs()
+            staged = self.staging.get_all_docs()  # type: ignore
+            keep = [
+                i
+                for i, doc in enumerate(docs)
+                if doc.metadata["id"] in live and doc.metadata["id"] not in staged
+            ]
+            if keep:
+                record = Memory._insert_record(
+                    [docs[i].metadata["id"] for i in keep],
+                    [docs[i] for i in keep],
+                    [vectors[i] for i in keep],
+                )
+                self.apply_staging(record)
+            self.done += len(docs)
+        if self.staging and self.staging.wal:
+            await asyncio.to_thread(self.staging.wal.sync)
+
+    async def _swap(self):
+        from python.helpers.memory import Memory
+
+        staging = self.staging
+        if not staging or not staging.wal:
+            return
+
+        # final snapshot of the staging database
+        while staging.wal.compacting:
+            await asyncio.sleep(0.1)
+        await Memory.compact(staging, force=True)
+
+        # live searches must not run while the database is replaced
+        async with self.db.lock.write():
+            with self.lock:
+                # marker makes the file swap resumable after a crash
+                with open(os.path.join(self.staging_dir, READY_FILE), "w") as f:
+                    f.write(str(time.time()))
+                finish_swap(self.db_dir)
+                if staging.full_vectors:
+                    staging.full_vectors = FullVectors(
+                        os.path.join(self.db_dir, staging.full_vectors.name),
+                        staging.full_vectors.dim,
+                    )
+                Memory._rebase_docstore(staging, self.db_dir, staging.docstore.offsets)  # type: ignore
+                staging.wal = MemoryWal(self.db_dir)
+                self.db.replace_with(staging)
+                self.db.reindex = None
+
+    def _load_staging(self) -> "MyFaiss":
+        from python.helpers.memory import Memory, MyFaiss
+
+        # checkpoint of a different model can't be resumed
+        staged_set = read_embedding_set(self.staging_dir)
+        if staged_set and (
+            staged_set["model_provider"] != self.model_config.provider.name
+            or staged_set["model_name"] != self.model_config.name
+        ):
+            shutil.rmtree(self.staging_dir, ignore_errors=True)
+
+        os.makedirs(self.staging_dir, exist_ok=True)
+        if memory_docstore.has_snapshot(self.staging_dir):
+            staging = MyFaiss.load_snapshot(
+                folder_path=self.staging_dir,
+                embeddings=self.embedder,
+                distance_strategy=DistanceStrategy.COSINE,
+                relevance_score_fn=Memory._cosine_normalizer,
+            )  # type: ignore
+        else:
+            staging = MyFaiss(
+                embedding_function=self.embedder,
+                index=faiss.IndexFlatIP(len(self.embedder.embed_query("example"))),
+                docstore=LazyDocstore(),
+                index_to_docstore_id={},
+                distance_strategy=DistanceStrategy.COSINE,
+                relevance_score_fn=Memory._cosine_normalizer,
+            )
+        staging.wal = MemoryWal(self.staging_dir)
+        Memory._replay_wal(staging)
+        staging.index_config = self.db.index_config
+        write_embedding_set(self.staging_dir, self.model_config)
+        return staging
+
+    def _reconcile(self) -> list[str]:
+        # bring a resumed checkpoint in line with the live database
+        with self.lock:
+            live = self.db.get_all_docs()
+            staged = self.staging.get_all_docs()  # type: ignore
+            removed = [id for id in staged if id not in live]
+            if removed:
+                self.apply_staging({"op": "delete", "ids": removed})
+            todo = [id for id in live if id not in staged]
+            self.total = len(live)
+            self.done = self.total - len(todo)
+            return todo
+
+    def _progress(self):
+        msg = f"Re-indexing memory '{self.memory_subdir}': {self.done}/{self.total}"
+        if self.state == "done":
+            msg = f"Re-indexed {self.total} memories in '{self.memory_subdir}'"
+        PrintStyle.standard(msg)
+        if self.log_item:
+            self.log_item.update(reindex=msg)
+
+
+def finish_swap(db_dir: str):
+    # move a completed staging database in place of the live one
+    staging_dir = os.path.join(db_dir, STAGING_DIR)
+    if not os.path.exists(os.path.join(staging_dir, READY_FILE)):
+        return False
+
+    # switching the manifest completes the swap, until then it can be repeated from the start
+    staged = memory_docstore.read_manifest(staging_dir)
+    current = memory_docstore.read_manifest(db_dir)
+    if staged and (not current or current["dir"] != staged["dir"]):
+        # log records of the old model are contained in the new snapshot
+        MemoryWal(db_dir).clear()
+        for name in os.listdir(staging_dir):
+            if name in (EMBEDDING_FILE, staged["dir"]) or name.startswith("vectors."):
+                os.replace(os.path.join(staging_dir, name), os.path.join(db_dir, name))
+        memory_docstore.write_manifest(db_dir, staged)
+
+    for name in os.listdir(staging_dir):
+        if name.startswith("wal."):
+            os.replace(os.path.join(staging_dir, name), os.path.join(db_dir, name))
+
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    return True
+
+
+def cancel(memory_subdir: str):
+    # stop a running job, its checkpoint stays on disk to be resumed
+    job = jobs.pop(memory_subdir, None)
+    if job and job.task:
+        job.task.kill()
+
+
+def discard_staging(db_dir: str):
+    # leftover checkpoint of a model that is no longer selected
+    shutil.rmtree(os.path.join(db_dir, STAGING_DIR), ignore_errors=True)
+
+
+def read_embedding_set(db_dir: str) -> dict[str, str] | None:
+    path = os.path.join(db_dir, EMBEDDING_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def write_embedding_set(db_dir: str, model_config: "ModelConfig"):
+    with open(os.path.join(db_dir, EMBEDDING_FILE), "w") as f:
+        json.dump(
+            {
+                "model_provider": model_config.provider.name,
+                "model_name": model_config.name,
+            },
+            f,
+        )
+
+
+def status() -> list[dict[str, Any]]:
+    return [job.status() for job in jobs.values()]
@@ -0,0 +1,195 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from datetime import datetime
+
+import numpy as np
+
+from python.helpers.memory import Memory, MyFaiss
+from python.helpers import memory_index
+from python.helpers.print_style import PrintStyle
+from python.helpers import errors
+
+# seconds between retention runs of one database
+RETENTION_INTERVAL = 6 * 60 * 60
+# score of a memory halves every this many days without being recalled
+HALF_LIFE_DAYS = 30
+# relevance from which memories of a full area are merged into one
+MERGE_THRESHOLD = 0.9
+MERGE_BLOCK = 1024
+
+# last run by memory subdir
+last_run: dict[str, float] = {}
+
+
+@dataclass
+class RetentionPolicy:
+    max_entries: int = 0  # 0 for no limit
+    max_age_days: float = 0  # since created or last recalled, 0 for no limit
+
+
+def policies_from_settings(settings: dict) -> dict[str, RetentionPolicy]:
+    return {
+        Memory.Area.FRAGMENTS.value: RetentionPolicy(
+            settings["memory_fragments_max"], settings["memory_fragments_max_age_days"]
+        ),
+        Memory.Area.SOLUTIONS.value: RetentionPolicy(
+            settings["memory_solutions_max"], settings["memory_solutions_max_age_days"]
+        ),
+    }
+
+
+async def tick():
+    # called from the job loop, runs retention of each loaded database when due
+    from python.helpers import settings
+
+    policies = policies_from_settings(settings.get_settings())  # type: ignore
+    for memory_subdir, db in list(Memory.index.items()):
+        if time.time() - last_run.get(memory_subdir, 0) < RETENTION_INTERVAL:
+            continue
+        last_run[memory_subdir] = time.time()
+        try:
+            await enforce(db, policies, knowledge_ids(memory_subdir))
+        except Exception as e:
+            PrintStyle.error(f"Memory retention failed: {errors.format_error(e)}")
+
+
+def knowledge_ids(memory_subdir: str) -> set[str]:
+    # chunks of imported files, evicting them would not bring them back on the next import
+    index = Memory._load_knowledge_index(memory_subdir)
+    return {id for file in index.values() for id in file.get("ids", [])}
+
+
+async def enforce(
+    db: MyFaiss, policies: dict[str, RetentionPolicy], protected: set[str] = set()
+) -> dict[str, int]:
+    # evict expired and low scoring memories in bulk, one mutation and one rebuild
+    if db.reindex or db.rebuilding:
+        return {}
+
+    now = time.time()
+    removed: dict[str, int] = {}
+    evict: list[str] = []
+    merged: dict[str, tuple[int, float]] = {}
+    async with db.lock.read():
+        for area, policy in policies.items():
+            area_evict, area_merged = _plan_area(db, area, policy, now, protected)
+            if area_evict:
+                removed[area] = len(area_evict)
+                evict.extend(area_evict)
+                merged.update(area_merged)
+
+    if not evict:
+        return removed
+
+    async with db.lock.write():
+        ids = [id for id in evict if id in db.get_all_docs()]
+        record = {"op": "delete", "ids": ids}
+        if db.wal:
+            db.wal.append(record)
+            await asyncio.to_thread(db.wal.sync)
+        Memory._apply_record(db, record)
+        # merged memories pass their recall history to the one kept
+        db.access.update(merged)
+
+    PrintStyle.standard(
+        "Memory retention removed "
+        + ", ".join(f"{count} {area}" for area, count in removed.items())
+    )
+
+    # approximate indexes only tombstone deletes, rebuild once instead
+    if memory_index.supports_remove(db.index):
+        await Memory.compact(db, force=True)
+    else:
+        await Memory.rebuild_index(db, "retention")
+    return removed
+
+
+def _plan_area(
+    db: MyFaiss, area: str, policy: RetentionPolicy, now: float, protected: set[str]
+) -> tuple[list[str], dict[str, tuple[int, float]]]:
+    if not policy.max_entries and not policy.max_age_days:
+        return [], {}
+
+    docs = db.get_all_docs()
+    candidates = Memory._get_comparator(f"area == '{area}'").candidates(db.meta_index)
+    ids = [
+        id
+        for id in (candidates if candidates is not None else docs)
+        if id in docs and id in db.positions
+        # knowledge chunks, also those stored before the import index was saved
+        and id not in protected
+        and "source" not in docs[id].metadata
+    ]
+    if not ids:
+        return [], {}
+
+    hits = np.zeros(len(ids))
+    last_used = np.zeros(len(ids))
+    for i, id in enumerate(ids):
+        count, accessed = db.access.get(id, (0, 0.0))
+        hits[i] = count
+        last_used[i] = max(_created(docs[id].metadata, now), accessed)
+    age_days = (now - last_used) / 86400
+    scores = (1 + hits) * 0.5 ** (age_days / HALF_LIFE_DAYS)
+
+    evict = np.zeros(len(ids), dtype=bool)
+    if policy.max_age_days:
+        evict |= age_days > policy.max_age_days
+
+    merged: dict[int, tuple[int, float]] = {}
+    if policy.max_entries and (~evict).sum() > policy.max_entries:
+        # merging near duplicates loses less than evicting distinct memories
+        keep = np.flatnonzero(~evict)
+        for cluster in _clusters(db, [ids[i] for i in keep]):
+            members = keep[cluster]
+            best = members[np.argmax(scores[members])]
+            evict[members] = True
+            evict[best] = False
+            merged[best] = (int(hits[members].sum()), float(last_used[members].max()))
+            scores[best] = (1 + hits[members].sum()) * 0.5 ** (
+                age_days[members].min() / HALF_LIFE_DAYS
+            )
+
+    excess = int((~evict).sum()) - policy.max_entries
+    if policy.max_entries and excess > 0:
+        keep = np.flatnonzero(~evict)
+        evict[keep[np.argsort(scores[keep], kind="stable")[:excess]]] = True
+
+    return [ids[i] for i in np.flatnonzero(evict)], {
+        ids[i]: stats for i, stats in merged.items() if not evict[i]
+    }
+
+
+def _clusters(db: MyFaiss, ids: list[str]) -> list[np.ndarray]:
+    # groups of memories connected by similarity over the merge threshold
+    vectors = db._vectors(np.asarray([db.positions[id] for id in ids], dtype=np.int64))
+    min_score = Memory._cosine_threshold_to_score(MERGE_THRESHOLD)
+    parent = np.arange(len(ids))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for start in range(0, len(ids), MERGE_BLOCK):
+        sims = vectors[start : start + MERGE_BLOCK] @ vectors.T
+        rows, cols = np.nonzero(sims >= min_score)
+        for row, col in zip(rows + start, cols):
+            if col > row:
+                a, b = find(row), find(col)
+                if a != b:
+                    parent[b] = a
+
+    roots = np.asarray([find(i) for i in range(len(ids))])
+    order = np.argsort(roots, kind="stable")
+    groups = np.split(order, np.flatnonzero(np.diff(roots[order])) + 1)
+    return [group for group in groups if len(group) > 1]
+
+
+def _created(metadata: dict, default: float) -> float:
+    try:
+        return datetime.strptime(metadata["timestamp"], "%Y-%m-%d %H:%M:%S").timestamp()
+    except (KeyError, ValueError, TypeError):
+        return default
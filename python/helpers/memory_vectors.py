@@ -0,0 +1,90 @@
+import os
+import re
+import threading
+
+import numpy as np
+
+# full precision vectors of a quantized index, one file per index build
+_FILE_PATTERN = re.compile(r"^vectors\.(\d+)\.f32$")
+
+
+class FullVectors:
+    """
+    Float32 vectors stored on disk row by row in index position order.
+    Quantized indexes keep only compressed codes in memory, these rows are
+    memory mapped to re-score search candidates exactly.
+    """
+
+    def __init__(self, path: str, dim: int):
+        self.path = path
+        self.dim = dim
+        self.row_size = dim * 4
+        self.count = os.path.getsize(path) // self.row_size if os.path.exists(path) else 0
+        self._map: np.memmap | None = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def create(db_dir: str, vectors: np.ndarray) -> "FullVectors":
+        # new generation file, the previous one stays valid for the current snapshot
+        path = os.path.join(db_dir, f"vectors.{_next_generation(db_dir):06d}.f32")
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with open(path, "wb") as f:
+            f.write(vectors.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        return FullVectors(path, vectors.shape[1])
+
+    @property
+    def name(self) -> str:
+        return os.path.basename(self.path)
+
+    def append(self, vectors: np.ndarray, start: int):
+        # rows past start are leftovers of changes not in the snapshot, replayed ones overwrite them
+        with self._lock:
+            if self.count > start:
+                self._truncate(start)
+            with open(self.path, "ab") as f:
+                f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+            self.count += len(vectors)
+
+    def truncate(self, count: int):
+        with self._lock:
+            if self.count > count:
+                self._truncate(count)
+
+    def read(self, positions: np.ndarray) -> np.ndarray:
+        with self._lock:
+            if self._map is None or len(self._map) < self.count:
+                self._map = (
+                    np.memmap(self.path, dtype=np.float32, mode="r", shape=(self.count, self.dim))
+                    if self.count
+                    else None
+                )
+            if self._map is None:
+                return np.empty((0, self.dim), dtype=np.float32)
+            return np.asarray(self._map[positions])
+
+    def read_all(self) -> np.ndarray:
+        return self.read(np.arange(self.count))
+
+    def _truncate(self, count: int):
+        self._map = None
+        with open(self.path, "r+b") as f:
+            f.truncate(count * self.row_size)
+        self.count = count
+
+
+def remove_unused(db_dir: str, keep: str | None):
+    # drop files of previous index builds once a snapshot no longer refers to them
+    for name in os.listdir(db_dir):
+        if _FILE_PATTERN.match(name) and name != keep:
+            os.remove(os.path.join(db_dir, name))
+
+
+def _next_generation(db_dir: str) -> int:
+    nums = [
+        int(match.group(1))
+        for match in (_FILE_PATTERN.match(name) for name in os.listdir(db_dir))
+        if match
+    ]
+    return max(nums, default=0) + 1
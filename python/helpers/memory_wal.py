@@ -0,0 +1,146 @@
+import os
+import pickle
+import re
+import struct
+import threading
+import time
+import zlib
+from typing import Any
+
+# every record is prefixed with payload length and crc32 of the payload
+_HEADER = struct.Struct("<II")
+_SEGMENT_PATTERN = re.compile(r"^wal\.(\d+)\.log$")
+
+# compact when the log grows over this size or gets older than this interval
+COMPACT_SIZE = 32 * 1024 * 1024
+COMPACT_INTERVAL = 10 * 60
+
+
+class MemoryWal:
+    """
+    Append-only log of memory mutations stored next to the FAISS snapshot.
+    Records are kept in numbered segments, the newest one is active for writing.
+    Segments older than the active one are sealed and can be dropped once
+    a snapshot containing their changes has been written.
+    """
+
+    def __init__(self, db_dir: str):
+        self.db_dir = db_dir
+        self.lock = threading.RLock()
+        # segments written since the last fsync
+        self.unsynced: set[int] = set()
+        self._sync_lock = threading.Lock()
+        self.compacting = False
+        self.last_compaction = time.time()
+        segments = self._segments()
+        self.active = segments[-1] if segments else 1
+        self.size = sum(
+            os.path.getsize(self._segment_path(num)) for num in segments
+        )
+
+    def append(self, record: dict[str, Any]):
+        # handed to the os here, durable after the next sync
+        payload = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        header = _HEADER.pack(len(payload), zlib.crc32(payload))
+        with self.lock:
+            with open(self._segment_path(self.active), "ab") as f:
+                f.write(header)
+                f.write(payload)
+            self.size += len(header) + len(payload)
+            self.unsynced.add(self.active)
+
+    def sync(self):
+        # blocking, run it in a worker thread; callers waiting meanwhile share the next fsync
+        with self._sync_lock:
+            with self.lock:
+                pending, self.unsynced = self.unsynced, set()
+            for num in sorted(pending):
+                try:
+                    with open(self._segment_path(num), "ab") as f:
+                        os.fsync(f.fileno())
+                except FileNotFoundError:
+                    pass  # dropped, its records are in a snapshot
+
+    def read(self) -> list[dict[str, Any]]:
+        records = []
+        with self.lock:
+            for num in self._segments():
+                records += self._read_segment(self._segment_path(num))
+        return records
+
+    def rotate(self) -> int:
+        # seal the active segment, new records go to the next one
+        with self.lock:
+            sealed = self.active
+            self.active += 1
+            return sealed
+
+    def drop_sealed(self, upto: int):
+        # remove segments already contained in a snapshot
+        with self.lock:
+            for num in self._segments():
+                if num <= upto:
+                    os.remove(self._segment_path(num))
+            self.size = sum(
+                os.path.getsize(self._segment_path(num)) for num in self._segments()
+            )
+            self.last_compaction = time.time()
+
+    def clear(self):
+        with self.lock:
+            self.drop_sealed(self.active)
+
+    def needs_compaction(self) -> bool:
+        if self.compacting or not self.size:
+            return False
+        return (
+            self.size >= COMPACT_SIZE
+            or time.time() - self.last_compaction >= COMPACT_INTERVAL
+        )
+
+    def _read_segment(self, path: str) -> list[dict[str, Any]]:
+        records = []
+        valid_end = 0
+        with open(path, "rb") as f:
+            data = f.read()
+        pos = 0
+        while pos + _HEADER.size <= len(data):
+            length, crc = _HEADER.unpack_from(data, pos)
+            start = pos + _HEADER.size
+            payload = data[start : start + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break  # torn write at the end of the log
+            try:
+                records.append(pickle.loads(payload))
+            except Exception:
+                break
+            pos = start + length
+            valid_end = pos
+        # cut off incomplete tail so new records are not appended after garbage
+        if valid_end < len(data):
+            with open(path, "r+b") as f:
+                f.truncate(valid_end)
+        return records
+
+    def _segments(self) -> list[int]:
+        if not os.path.isdir(self.db_dir):
+            return []
+        nums = []
+        for name in os.listdir(self.db_dir):
+            match = _SEGMENT_PATTERN.match(name)
+            if match:
+                nums.append(int(match.group(1)))
+        return sorted(nums)
+
+    def _segment_path(self, num: int) -> str:
+        return os.path.join(self.db_dir, f"wal.{num:06d}.log")
+
+
+def write_atomic(path: str, content: bytes):
+    # write to temp file and swap it in so readers never see a partial file
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
@@ -1,5 +1,7 @@
 from collections import OrderedDict
 from datetime import datetime
+import os
+import threading
 from typing import Any
 import uuid
 from agent import Agent, AgentConfig, AgentContext, AgentContextType
@@ -7,11 +9,18 @@ from python.helpers import files, history
 import json
 from initialize import initialize
 
+from python.helpers.localization import Localization
 from python.helpers.log import Log, LogItem
 
 CHATS_FOLDER = "tmp/chats"
 LOG_SIZE = 1000
 CHAT_FILE_NAME = "chat.json"
+JOURNAL_FILE_NAME = "chat.journal"
+# the journal is folded into a new chat.json once it outgrows the chat file and this size
+JOURNAL_COMPACT_SIZE = 1024 * 1024
+# saved chats listed without loading them, outside the chats folder
+CHAT_INDEX_FILE = "tmp/chat_index.json"
+INDEX_FIELDS = ["id", "name", "type", "created_at", "last_message"]
 
 
 def get_chat_folder_path(ctxid: str):
@@ -27,39 +36,339 @@ def get_chat_folder_path(ctxid: str):
     return files.get_abs_path(CHATS_FOLDER, ctxid)
 
 
+class ChatJournal:
+    """
+    What of a context was last saved. Saves append only the changes since
+    to the chat journal: new messages of the current topic, changed log
+    items, and whole records only where more than that changed.
+    """
+
+    def __init__(self, ctxid: str):
+        self.ctxid = ctxid
+        self.lock = threading.Lock()
+        self.id = ""  # of the chat file the journal continues, empty until written
+        self.chat_size = 0
+        self.journal_size = 0
+        self.header: dict[str, Any] = {}
+        self.agents: list[dict[str, Any]] = []
+        self.log_guid = ""
+        self.log_updates = 0
+        self.log_progress: tuple = ()
+
+    def needs_snapshot(self) -> bool:
+        return (
+            not self.id
+            or self.journal_size > max(JOURNAL_COMPACT_SIZE, self.chat_size)
+            or not os.path.exists(_get_chat_file_path(self.ctxid))
+        )
+
+    def write_snapshot(self, context: AgentContext):
+        # full chat file under a new journal id, then a new journal continuing it
+        self.changes(context, record=False)
+        self.id = str(uuid.uuid4())
+        data = _serialize_context(context)
+        data["journal"] = self.id
+        js = _safe_json_serialize(data, ensure_ascii=False)
+        path = _get_chat_file_path(context.id)
+        files.write_file(path + ".tmp", js)
+        os.replace(path + ".tmp", path)
+        header = json.dumps({"journal": self.id}) + "\n"
+        files.write_file(_get_journal_file_path(context.id), header)
+        self.chat_size = len(js)
+        self.journal_size = len(header)
+
+    def append(self, context: AgentContext):
+        entry = self.changes(context)
+        if not entry:
+            return
+        line = _safe_json_serialize(entry, ensure_ascii=False) + "\n"
+        with open(_get_journal_file_path(context.id), "a", encoding="utf-8") as f:
+            f.write(line)
+        self.journal_size += len(line)
+
+    def changes(self, context: AgentContext, record=True) -> dict[str, Any]:
+        # changes since the last call, remembers the current state as saved
+        entry: dict[str, Any] = {}
+
+        header = _serialize_header(context)
+        if header != self.header:
+            entry["context"] = header
+            self.header = header
+
+        agents = []
+        agent = context.agent0
+        while agent:
+            agents.append(agent)
+            agent = agent.data.get(Agent.DATA_NAME_SUBORDINATE, None)
+        if len(agents) != len(self.agents):
+            entry["agent_count"] = len(agents)
+            del self.agents[len(agents) :]
+        changed = []
+        for agent in agents:
+            if agent.number >= len(self.agents):
+                self.agents.append({})
+            change = _agent_changes(agent, self.agents[agent.number], record)
+            if change:
+                changed.append(change)
+        if changed:
+            entry["agents"] = changed
+
+        log = context.log
+        progress = (log.progress, log.progress_no)
+        if log.guid != self.log_guid:
+            self.log_guid, self.log_updates = log.guid, 0
+            entry["log"] = {"guid": log.guid, "reset": True}
+        nos = sorted(set(log.updates[self.log_updates :]))
+        self.log_updates = len(log.updates)
+        first = len(log.logs) - LOG_SIZE
+        items = [log.logs[no].output() for no in nos if no >= first and record]
+        if items or progress != self.log_progress or "log" in entry:
+            entry.setdefault("log", {}).update(
+                {"items": items, "progress": progress[0], "progress_no": progress[1]}
+            )
+            self.log_progress = progress
+
+        return entry
+
+
+# journal state by context id, only for chats saved by this process
+_journals: dict[str, ChatJournal] = {}
+_journals_lock = threading.Lock()
+
+
 def save_tmp_chat(context: AgentContext):
     """Save context to the chats folder"""
-    path = _get_chat_file_path(context.id)
-    files.make_dirs(path)
-    data = _serialize_context(context)
-    js = _safe_json_serialize(data, ensure_ascii=False)
-    files.write_file(path, js)
+    with _journals_lock:
+        journal = _journals.get(context.id)
+        if not journal:
+            journal = _journals[context.id] = ChatJournal(context.id)
+    with journal.lock:
+        try:
+            snapshot = journal.needs_snapshot()
+            if snapshot:
+                journal.write_snapshot(context)
+            else:
+                journal.append(context)
+        except Exception:
+            # the saved state is unknown, start over with a full chat file
+            journal.id = ""
+            raise
+        entry = _index_entry(journal.header, journal.chat_size + journal.journal_size)
+    _update_index(entry, force=snapshot)
 
 
 def load_tmp_chats():
-    """Load all contexts from the chats folder"""
+    """Index the chats in the chats folder, contexts are loaded once opened"""
     _convert_v080_chats()
     folders = files.list_files(CHATS_FOLDER, "*")
-    json_files = []
-    for folder_name in folders:
-        json_files.append(_get_chat_file_path(folder_name))
 
-    ctxids = []
-    for file in json_files:
-        try:
-            js = files.read_file(file)
-            data = json.loads(js)
-            ctx = _deserialize_context(data)
-            ctxids.append(ctx.id)
-        except Exception as e:
-            print(f"Error loading chat {file}: {e}")
-    return ctxids
+    with _index_lock:
+        _ensure_index()
+        changed = False
+        for ctxid in set(_index) - set(folders):
+            del _index[ctxid]
+            changed = True
+        # chats saved before the index, or while it was not written
+        for folder_name in folders:
+            if folder_name in _index:
+                continue
+            file = _get_chat_file_path(folder_name)
+            try:
+                data = _read_chat(folder_name)
+                _index[folder_name] = _index_entry(data, _chat_size(folder_name))
+                changed = True
+            except Exception as e:
+                print(f"Error loading chat {file}: {e}")
+        if changed:
+            _write_index()
+        return list(_index)
+
+
+def load_tmp_chat(ctxid: str) -> AgentContext | None:
+    """Get a context, loading it from the chats folder if not loaded yet"""
+    with _load_lock:
+        context = AgentContext.get(ctxid)
+        if context or not ctxid or not os.path.exists(_get_chat_file_path(ctxid)):
+            return context
+        return _deserialize_context(_read_chat(ctxid))
+
+
+def list_tmp_chats() -> list[dict[str, Any]]:
+    """Saved chats not loaded, serialized like loaded contexts are"""
+    with _index_lock:
+        _ensure_index()
+        entries = [e for id, e in _index.items() if not AgentContext.get(id)]
+    return [
+        {
+            "id": entry["id"],
+            "name": entry["name"],
+            "created_at": Localization.get().serialize_datetime(
+                datetime.fromisoformat(entry["created_at"])
+            ),
+            "no": 0,
+            "log_guid": "",
+            "log_version": 0,
+            "log_length": 0,
+            "paused": False,
+            "last_message": Localization.get().serialize_datetime(
+                datetime.fromisoformat(entry["last_message"])
+            ),
+            "type": entry["type"],
+        }
+        for entry in entries
+    ]
+
+
+def latest_tmp_chat() -> str | None:
+    """Id of the saved chat with the most recent message"""
+    with _index_lock:
+        _ensure_index()
+        entries = list(_index.values())
+    if not entries:
+        return None
+    return max(entries, key=lambda e: datetime.fromisoformat(e["last_message"]))["id"]
 
 
 def _get_chat_file_path(ctxid: str):
     return files.get_abs_path(CHATS_FOLDER, ctxid, CHAT_FILE_NAME)
 
 
+def _get_journal_file_path(ctxid: str):
+    return files.get_abs_path(CHATS_FOLDER, ctxid, JOURNAL_FILE_NAME)
+
+
+# index entries by context id, written to the index file on changes
+_index: dict[str, dict[str, Any]] = {}
+_index_read = False
+_index_lock = threading.Lock()
+_load_lock = threading.Lock()
+
+
+def _index_entry(data: dict[str, Any], size: int) -> dict[str, Any]:
+    entry = {field: data.get(field) for field in INDEX_FIELDS}
+    entry["created_at"] = entry["created_at"] or datetime.fromtimestamp(0).isoformat()
+    entry["last_message"] = entry["last_message"] or entry["created_at"]
+    entry["type"] = entry["type"] or AgentContextType.USER.value
+    entry["size"] = size
+    return entry
+
+
+def _update_index(entry: dict[str, Any], force=False):
+    # the size alone is updated with the next change of the other fields
+    with _index_lock:
+        _ensure_index()
+        saved = _index.get(entry["id"])
+        if (
+            not force
+            and saved
+            and all(saved[field] == entry[field] for field in INDEX_FIELDS)
+        ):
+            return
+        _index[entry["id"]] = entry
+        _write_index()
+
+
+def _ensure_index():
+    # read the index file once, with the index lock held
+    global _index_read
+    if _index_read:
+        return
+    _index_read = True
+    path = files.get_abs_path(CHAT_INDEX_FILE)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            entries = {entry["id"]: entry for entry in json.load(f)}
+    except (OSError, ValueError, KeyError, TypeError):
+        return
+    _index.update(entries)
+
+
+def _write_index():
+    path = files.get_abs_path(CHAT_INDEX_FILE)
+    js = json.dumps(list(_index.values()), ensure_ascii=False)
+    files.write_file(path + ".tmp", js)
+    os.replace(path + ".tmp", path)
+
+
+def _chat_size(ctxid: str) -> int:
+    paths = [_get_chat_file_path(ctxid), _get_journal_file_path(ctxid)]
+    return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+
+def _read_chat(ctxid: str) -> dict[str, Any]:
+    # read as is, read_file would expand prompt includes quoted in the chat
+    with open(_get_chat_file_path(ctxid), "r", encoding="utf-8") as f:
+        data = json.load(f)
+    path = _get_journal_file_path(ctxid)
+    if data.get("journal") and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            _replay_journal(data, f)
+    return data
+
+
+def _replay_journal(data: dict[str, Any], lines):
+    # applies the journal to the chat file data, if it continues this chat file
+    try:
+        header = json.loads(next(lines, ""))
+    except json.JSONDecodeError:
+        return
+    if header.get("journal") != data["journal"]:
+        return
+
+    agents: list[dict[str, Any]] = data.setdefault("agents", [])
+    histories: dict[int, dict[str, Any]] = {}
+    log = data.setdefault("log", {})
+    logs: list[dict[str, Any]] = log.setdefault("logs", [])
+    positions = {item["no"]: i for i, item in enumerate(logs)}
+
+    for line in lines:
+        try:
+            entry = json.loads(line)
+        except json.JSONDecodeError:
+            break  # torn write of the last entry
+
+        data.update(entry.get("context", {}))
+
+        if "agent_count" in entry:
+            del agents[entry["agent_count"] :]
+            for number in [n for n in histories if n >= entry["agent_count"]]:
+                del histories[number]
+        for change in entry.get("agents", []):
+            number = change["number"]
+            while len(agents) <= number:
+                agents.append({"number": len(agents), "data": {}, "history": ""})
+            if "data" in change:
+                agents[number]["data"] = change["data"]
+            if "history" in change:
+                agents[number]["history"] = change["history"]
+                histories.pop(number, None)
+            if "messages" in change:
+                if number not in histories:
+                    histories[number] = json.loads(agents[number]["history"])
+                current = histories[number]["current"]
+                current["messages"] += change["messages"]
+                current["tokens"] = change["tokens"]
+
+        if "log" in entry:
+            update = entry["log"]
+            if update.get("reset"):
+                logs.clear()
+                positions.clear()
+                log["guid"] = update["guid"]
+            for item in update.get("items", []):
+                if item["no"] in positions:
+                    logs[positions[item["no"]]] = item
+                else:
+                    positions[item["no"]] = len(logs)
+                    logs.append(item)
+            log["progress"] = update["progress"]
+            log["progress_no"] = update["progress_no"]
+
+    for number, hist in histories.items():
+        agents[number]["history"] = json.dumps(hist, ensure_ascii=False)
+    del logs[:-LOG_SIZE]
+
+
 def _convert_v080_chats():
     json_files = files.list_files(CHATS_FOLDER, "*.json")
     for file in json_files:
@@ -90,6 +399,12 @@ def export_json_chat(context: AgentContext):
 
 def remove_chat(ctxid):
     """Remove a chat or task context"""
+    with _journals_lock:
+        _journals.pop(ctxid, None)
+    with _index_lock:
+        _ensure_index()
+        if _index.pop(ctxid, None):
+            _write_index()
     path = get_chat_folder_path(ctxid)
     files.delete_dir(path)
 
@@ -102,6 +417,14 @@ def _serialize_context(context: AgentContext):
         agents.append(_serialize_agent(agent))
         agent = agent.data.get(Agent.DATA_NAME_SUBORDINATE, None)
 
+    return {
+        **_serialize_header(context),
+        "agents": agents,
+        "log": _serialize_log(context.log),
+    }
+
+
+def _serialize_header(context: AgentContext):
     return {
         "id": context.id,
         "name": context.name,
@@ -114,11 +437,9 @@ def _serialize_context(context: AgentContext):
             context.last_message.isoformat() if context.last_message
             else datetime.fromtimestamp(0).isoformat()
         ),
-        "agents": agents,
         "streaming_agent": (
             context.streaming_agent.number if context.streaming_agent else 0
         ),
-        "log": _serialize_log(context.log),
     }
 
 
@@ -134,6 +455,47 @@ def _serialize_agent(agent: Agent):
     }
 
 
+def _agent_changes(
+    agent: Agent, saved: dict[str, Any], record=True
+) -> dict[str, Any]:
+    # journal entry of an agent, saved holds what was written last and is updated
+    change: dict[str, Any] = {}
+
+    data = {k: v for k, v in agent.data.items() if not k.startswith("_")}
+    data_js = _safe_json_serialize(data, ensure_ascii=False)
+    if saved.get("agent") is not agent or data_js != saved.get("data"):
+        change["data"] = data
+        saved["data"] = data_js
+
+    hist = agent.history
+    current = hist.current
+    if not record:
+        pass
+    elif (
+        saved.get("agent") is agent
+        and saved.get("history") is hist
+        and saved.get("current") is current
+        and saved.get("rewrite_version") == hist.rewrite_version
+    ):
+        if hist.version != saved["version"]:
+            change["messages"] = [m.to_dict() for m in current.messages[saved["count"] :]]
+            change["tokens"] = current.tokens
+    else:
+        change["history"] = hist.serialize()
+
+    saved.update(
+        agent=agent,
+        history=hist,
+        current=current,
+        version=hist.version,
+        rewrite_version=hist.rewrite_version,
+        count=len(current.messages),
+    )
+    if change:
+        change["number"] = agent.number
+    return change
+
+
 def _serialize_log(log: Log):
     return {
         "guid": log.guid,
@@ -1,4 +1,5 @@
-from typing import List
+import re
+from typing import BinaryIO, Generator, Iterator, List
 
 from langchain_core.documents import Document
 from python.helpers import files
@@ -15,46 +16,79 @@ from langchain_community.document_loaders import (
 # def extract_file(path: str) -> List[Document]:
 #     pass  # TODO finish implementing
 
+# bytes that count as control characters, other than tab and line breaks
+CONTROL_BYTES = bytes(c for c in range(32) if c not in b"\n\r\t")
+BINARY_RATIO = 0.3
+BINARY_MARKER = "[BINARY]"
+# bytes searched past a chunk for a word boundary to end it at
+BOUNDARY_LOOKAHEAD = 100
+READ_SIZE = 1024 * 1024
+
+_BOUNDARY = re.compile(rb"[ \n\r]")
+
+
 def extract_text(content: bytes, chunk_size: int = 128) -> List[str]:
-    result = []
-
-    def is_binary_chunk(chunk: bytes) -> bool:
-        # Check for high concentration of control chars
-        try:
-            text = chunk.decode("utf-8", errors="ignore")
-            control_chars = sum(1 for c in text if ord(c) < 32 and c not in "\n\r\t")
-            return control_chars / len(text) > 0.3
-        except UnicodeDecodeError:
-            return True
-
-    # Process the content in overlapping chunks to handle boundaries
-    pos = 0
-    while pos < len(content):
-        # Get current chunk with overlap
-        chunk_end = min(pos + chunk_size, len(content))
-
-        # Add overlap to catch word boundaries, unless at end of content
-        if chunk_end < len(content):
-            # Look ahead for next newline or space to avoid splitting words
-            for i in range(chunk_end, min(chunk_end + 100, len(content))):
-                if content[i : i + 1] in [b" ", b"\n", b"\r"]:
-                    chunk_end = i + 1
-                    break
-
-        chunk = content[pos:chunk_end]
-
-        if is_binary_chunk(chunk):
-            if not result or result[-1] != "[BINARY]":
-                result.append("[BINARY]")
-        else:
-            try:
-                text = chunk.decode("utf-8", errors="ignore").strip()
-                if text:  # Only add non-empty text chunks
-                    result.append(text)
-            except UnicodeDecodeError:
-                if not result or result[-1] != "[BINARY]":
-                    result.append("[BINARY]")
+    return list(iter_text(content, chunk_size))
+
+
+def iter_text(
+    source: bytes | bytearray | memoryview | BinaryIO, chunk_size: int = 128
+) -> Iterator[str]:
+    # text of each chunk, consecutive binary chunks as one marker
+    # buffers are read in place and files in blocks, content is never copied as a whole
+    binary = False
+    for chunk in _iter_chunks(source, chunk_size):
+        text = chunk.decode("utf-8", errors="ignore")
+        if _is_binary(chunk, text):
+            if not binary:
+                yield BINARY_MARKER
+            binary = True
+            continue
+        text = text.strip()
+        if text:  # Only add non-empty text chunks
+            yield text
+            binary = False
 
-        pos = chunk_end
 
-    return result
+def _is_binary(chunk: bytes, text: str) -> bool:
+    # high concentration of control chars, control bytes are never part of multibyte characters
+    if not text:
+        return True
+    control_chars = len(chunk) - len(chunk.translate(None, CONTROL_BYTES))
+    return control_chars / len(text) > BINARY_RATIO
+
+
+def _iter_chunks(
+    source: bytes | bytearray | memoryview | BinaryIO, chunk_size: int
+) -> Iterator[bytes]:
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        yield from _split(memoryview(source).cast("B"), chunk_size, final=True)
+        return
+    buffer = b""
+    while True:
+        data = source.read(READ_SIZE)
+        view = memoryview(buffer + data) if buffer else memoryview(data)
+        pos = yield from _split(view, chunk_size, final=not data)
+        if not data:
+            return
+        buffer = bytes(view[pos:])
+
+
+def _split(view: memoryview, chunk_size: int, final: bool) -> Generator[bytes, None, int]:
+    # chunks end after the next space or line break within the lookahead
+    # without final, stops where the lookahead could reach past the buffer, returns that position
+    pos = 0
+    size = len(view)
+    while pos < size:
+        chunk_end = min(pos + chunk_size, size)
+        if not final and chunk_end + BOUNDARY_LOOKAHEAD >= size:
+            break
+        if chunk_end < size:
+            match = _BOUNDARY.search(
+                view, chunk_end, min(chunk_end + BOUNDARY_LOOKAHEAD, size)
+            )
+            if match:
+                chunk_end = match.end()
+        yield bytes(view[pos:chunk_end])
+        pos = chunk_end
+    return pos
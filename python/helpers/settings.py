@@ -22,6 +22,7 @@ class Settings(TypedDict):
     chat_model_rl_requests: int
     chat_model_rl_input: int
     chat_model_rl_output: int
+    rate_limit_estimate_tokens: bool
 
     util_model_provider: str
     util_model_name: str
@@ -31,12 +32,14 @@ class Settings(TypedDict):
     util_model_rl_requests: int
     util_model_rl_input: int
     util_model_rl_output: int
+    util_model_summary_cache_mb: int
 
     embed_model_provider: str
     embed_model_name: str
     embed_model_kwargs: dict[str, str]
     embed_model_rl_requests: int
     embed_model_rl_input: int
+    embed_model_cache_size_mb: int
 
     browser_model_provider: str
     browser_model_name: str
@@ -46,6 +49,17 @@ class Settings(TypedDict):
     agent_prompts_subdir: str
     agent_memory_subdir: str
     agent_knowledge_subdir: str
+    knowledge_import_workers: int
+
+    memory_index_type: str
+    memory_index_promote_at: int
+    memory_quantization: str
+    memory_rerank_factor: int
+    memory_search_mode: str
+    memory_fragments_max: int
+    memory_fragments_max_age_days: int
+    memory_solutions_max: int
+    memory_solutions_max_age_days: int
 
     api_keys: dict[str, str]
 
@@ -202,6 +216,16 @@ def convert_out(settings: Settings) -> SettingsOutput:
         }
     )
 
+    chat_model_fields.append(
+        {
+            "id": "rate_limit_estimate_tokens",
+            "title": "Estimate tokens for rate limits",
+            "description": "Count tokens for the rate limits of all models from text length instead of encoding it. Faster for long prompts, but limits are less exact.",
+            "type": "switch",
+            "value": settings["rate_limit_estimate_tokens"],
+        }
+    )
+
     chat_model_fields.append(
         {
             "id": "chat_model_kwargs",
@@ -272,6 +296,16 @@ def convert_out(settings: Settings) -> SettingsOutput:
         }
     )
 
+    util_model_fields.append(
+        {
+            "id": "util_model_summary_cache_mb",
+            "title": "Summary cache size (MB)",
+            "description": "Maximum size of the cache of chat history summaries, reused after chats are reloaded. Least recently used summaries are evicted when the limit is reached. Set to 0 to disable the cache.",
+            "type": "number",
+            "value": settings["util_model_summary_cache_mb"],
+        }
+    )
+
     util_model_fields.append(
         {
             "id": "util_model_kwargs",
@@ -332,6 +366,16 @@ def convert_out(settings: Settings) -> SettingsOutput:
         }
     )
 
+    embed_model_fields.append(
+        {
+            "id": "embed_model_cache_size_mb",
+            "title": "Embedding cache size (MB)",
+            "description": "Maximum size of the embedding cache file. Least recently used embeddings are evicted when the limit is reached.",
+            "type": "number",
+            "value": settings["embed_model_cache_size_mb"],
+        }
+    )
+
     embed_model_fields.append(
         {
             "id": "embed_model_kwargs",
@@ -400,24 +444,114 @@ def convert_out(settings: Settings) -> SettingsOutput:
         "tab": "agent",
     }
 
-    # # Memory settings section
-    # memory_fields: list[SettingsField] = []
-    # memory_fields.append(
-    #     {
-    #         "id": "memory_settings",
-    #         "title": "Memory Settings",
-    #         "description": "<settings for memory>",
-    #         "type": "text",
-    #         "value": "",
-    #     }
-    # )
-
-    # memory_section: SettingsSection = {
-    #     "id": "memory",
-    #     "title": "Memory Settings",
-    #     "description": "<settings for memory management here>",
-    #     "fields": memory_fields,
-    # }
+    # Memory settings section
+    memory_fields: list[SettingsField] = []
+    memory_fields.append(
+        {
+            "id": "memory_index_type",
+            "title": "Vector index type",
+            "description": "Index used for memory and knowledge search. Auto uses exact search for small databases and switches to HNSW once the promotion threshold is reached. IVF types are trained once enough vectors are available. A memory subdirectory can override the index settings with an index_config.json file in its folder.",
+            "type": "select",
+            "value": settings["memory_index_type"],
+            "options": [
+                {"value": "auto", "label": "Auto (flat, then HNSW)"},
+                {"value": "flat", "label": "Flat (exact)"},
+                {"value": "hnsw", "label": "HNSW"},
+                {"value": "ivf_flat", "label": "IVF-Flat"},
+                {"value": "ivf_pq", "label": "IVF-PQ"},
+            ],
+        }
+    )
+    memory_fields.append(
+        {
+            "id": "memory_index_promote_at",
+            "title": "Index promotion threshold",
+            "description": "Number of vectors at which the flat index is rebuilt as the selected approximate index type. The rebuild runs in the background.",
+            "type": "number",
+            "value": settings["memory_index_promote_at"],
+        }
+    )
+    memory_fields.append(
+        {
+            "id": "memory_quantization",
+            "title": "Vector compression",
+            "description": "Store vectors compressed in RAM to fit more memories per process. Full vectors are kept on disk and used to re-rank the best candidates exactly. Compression is applied in the background once enough vectors are available for training.",
+            "type": "select",
+            "value": settings["memory_quantization"],
+            "options": [
+                {"value": "none", "label": "None (4 bytes per dimension, exact)"},
+                {"value": "sq_fp16", "label": "SQ fp16 (2 bytes per dimension, near exact)"},
+                {"value": "sq8", "label": "SQ8 (1 byte per dimension, high recall)"},
+                {"value": "pq", "label": "PQ (16 bytes per vector, lower recall)"},
+            ],
+        }
+    )
+    memory_fields.append(
+        {
+            "id": "memory_rerank_factor",
+            "title": "Re-rank factor",
+            "description": "With compression, this many times more candidates than requested are fetched and re-scored with full vectors. Higher values recover more recall at the cost of disk reads.",
+            "type": "number",
+            "value": settings["memory_rerank_factor"],
+        }
+    )
+    memory_fields.append(
+        {
+            "id": "memory_search_mode",
+            "title": "Search mode",
+            "description": "Hybrid combines vector similarity with BM25 keyword matching, so exact terms like product names, legal references and policy numbers are found even when their meaning is not captured by the embedding model. German, French and Italian compounds are split into their parts. Keyword matches still have to reach the similarity threshold of the search.",
+            "type": "select",
+            "value": settings["memory_search_mode"],
+            "options": [
+                {"value": "hybrid", "label": "Hybrid (vector + keywords)"},
+                {"value": "vector", "label": "Vector only"},
+            ],
+        }
+    )
+    memory_fields.append(
+        {
+            "id": "memory_fragments_max",
+            "title": "Max fragments",
+            "description": "Maximum number of memorized conversation fragments. When exceeded, near-duplicates are merged and the least recalled, oldest fragments are removed permanently. Imported knowledge is never removed. 0 for no limit (default).",
+            "type": "number",
+            "value": settings["memory_fragments_max"],
+        }
+    )
+    memory_fields.append(
+        {
+            "id": "memory_fragments_max_age_days",
+            "title": "Fragment retention days",
+            "description": "Fragments not recalled for this many days are removed permanently. 0 to keep them forever (default).",
+            "type": "number",
+            "value": settings["memory_fragments_max_age_days"],
+        }
+    )
+    memory_fields.append(
+        {
+            "id": "memory_solutions_max",
+            "title": "Max solutions",
+            "description": "Maximum number of memorized solutions, pruned the same way as fragments. 0 for no limit (default).",
+            "type": "number",
+            "value": settings["memory_solutions_max"],
+        }
+    )
+    memory_fields.append(
+        {
+            "id": "memory_solutions_max_age_days",
+            "title": "Solution retention days",
+            "description": "Solutions not recalled for this many days are removed permanently. 0 to keep them forever (default).",
+            "type": "number",
+            "value": settings["memory_solutions_max_age_days"],
+        }
+    )
+
+    memory_section: SettingsSection = {
+        "id": "memory",
+        "title": "Memory",
+        "description": "Settings for the memory and knowledge vector database.",
+        "fields": memory_fields,
+        "tab": "agent",
+    }
 
     # basic auth section
     auth_fields: list[SettingsField] = []
@@ -541,6 +675,16 @@ def convert_out(settings: Settings) -> SettingsOutput:
         }
     )
 
+    agent_fields.append(
+        {
+            "id": "knowledge_import_workers",
+            "title": "Knowledge import workers",
+            "description": "Number of processes parsing knowledge files (PDF, HTML, CSV...) in parallel on import. 0 uses one per CPU core.",
+            "type": "number",
+            "value": settings["knowledge_import_workers"],
+        }
+    )
+
     agent_section: SettingsSection = {
         "id": "agent",
         "title": "Agent Config",
@@ -778,7 +922,7 @@ def convert_out(settings: Settings) -> SettingsOutput:
             util_model_section,
             embed_model_section,
             browser_model_section,
-            # memory_section,
+            memory_section,
             stt_section,
             api_keys_section,
             auth_section,
@@ -919,6 +1063,7 @@ def get_default_settings() -> Settings:
         chat_model_rl_requests=0,
         chat_model_rl_input=0,
         chat_model_rl_output=0,
+        rate_limit_estimate_tokens=False,
         util_model_provider=ModelProvider.OPENAI.name,
         util_model_name="gpt-4.1-nano",
         util_model_ctx_length=100000,
@@ -927,11 +1072,13 @@ def get_default_settings() -> Settings:
         util_model_rl_requests=0,
         util_model_rl_input=0,
         util_model_rl_output=0,
+        util_model_summary_cache_mb=64,
         embed_model_provider=ModelProvider.HUGGINGFACE.name,
         embed_model_name="sentence-transformers/all-MiniLM-L6-v2",
         embed_model_kwargs={},
         embed_model_rl_requests=0,
         embed_model_rl_input=0,
+        embed_model_cache_size_mb=512,
         browser_model_provider=ModelProvider.OPENAI.name,
         browser_model_name="gpt-4.1",
         browser_model_vision=True,
@@ -943,6 +1090,16 @@ def get_default_settings() -> Settings:
         agent_prompts_subdir="default",
         agent_memory_subdir="default",
         agent_knowledge_subdir="custom",
+        knowledge_import_workers=0,
+        memory_index_type="auto",
+        memory_index_promote_at=50000,
+        memory_quantization="none",
+        memory_rerank_factor=4,
+        memory_search_mode="vector",
+        memory_fragments_max=0,
+        memory_fragments_max_age_days=0,
+        memory_solutions_max=0,
+        memory_solutions_max_age_days=0,
         rfc_auto_docker=True,
         rfc_url="localhost",
         rfc_password="",
@@ -982,11 +1139,15 @@ def _apply_settings(previous: Settings | None):
                 whisper.preload, _settings["stt_model_size"]
             )  # TODO overkill, replace with background task
 
-        # force memory reload on embedding model change
+        # force memory reload on embedding model or index change
         if not previous or (
             _settings["embed_model_name"] != previous["embed_model_name"]
             or _settings["embed_model_provider"] != previous["embed_model_provider"]
             or _settings["embed_model_kwargs"] != previous["embed_model_kwargs"]
+            or _settings["memory_index_type"] != previous["memory_index_type"]
+            or _settings["memory_index_promote_at"] != previous["memory_index_promote_at"]
+            or _settings["memory_quantization"] != previous["memory_quantization"]
+            or _settings["memory_rerank_factor"] != previous["memory_rerank_factor"]
         ):
             from python.helpers.memory import reload as memory_reload
 
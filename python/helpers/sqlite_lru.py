@@ -0,0 +1,159 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Iterator, Optional, Sequence
+
+from langchain_core.stores import ByteStore
+
+# evict down to this fraction of the cap so eviction doesn't run on every write
+EVICT_TO_RATIO = 0.9
+
+
+class SqliteLruStore(ByteStore):
+    """
+    Byte store in a single SQLite file with LRU eviction once the total size
+    of the values exceeds the cap. Used for cached embeddings and summaries.
+    """
+
+    _instances: dict[tuple[type, str], "SqliteLruStore"] = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, path: str, max_size_mb: int):
+        self.path = path
+        self.max_size = max_size_mb * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, "
+            "size INTEGER NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)"
+        )
+        self._conn.commit()
+        self.size = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM cache"
+        ).fetchone()[0]
+
+    @classmethod
+    def get(cls, path: str, max_size_mb: int) -> "SqliteLruStore":
+        # one connection per file shared by all users of the store
+        with SqliteLruStore._instances_lock:
+            store = SqliteLruStore._instances.get((cls, path))
+            if not store:
+                store = cls(path, max_size_mb)
+                SqliteLruStore._instances[(cls, path)] = store
+            store.max_size = max_size_mb * 1024 * 1024
+            return store
+
+    def mget(self, keys: Sequence[str]) -> list[Optional[bytes]]:
+        if not keys:
+            return []
+        with self._lock:
+            found: dict[str, bytes] = {}
+            for chunk in _chunks(list(keys), 500):
+                rows = self._conn.execute(
+                    f"SELECT key, value FROM cache WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                found.update(rows)
+            if found:
+                # refresh recency of hits for LRU
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE cache SET accessed = ? WHERE key = ?",
+                    [(now, key) for key in found],
+                )
+                self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+            return [found.get(key) for key in keys]
+
+    def mset(self, key_value_pairs: Sequence[tuple[str, bytes]]) -> None:
+        if not key_value_pairs:
+            return
+        with self._lock:
+            now = time.time()
+            keys = [key for key, _ in key_value_pairs]
+            replaced = 0
+            for chunk in _chunks(keys, 500):
+                replaced += self._conn.execute(
+                    f"SELECT COALESCE(SUM(size), 0) FROM cache WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchone()[0]
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO cache (key, value, size, accessed) VALUES (?, ?, ?, ?)",
+                [(key, value, len(value), now) for key, value in key_value_pairs],
+            )
+            self.size += sum(len(value) for _, value in key_value_pairs) - replaced
+            if self.size > self.max_size:
+                self._evict()
+            self._conn.commit()
+
+    def mdelete(self, keys: Sequence[str]) -> None:
+        with self._lock:
+            for chunk in _chunks(list(keys), 500):
+                self._conn.execute(
+                    f"DELETE FROM cache WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                )
+            self._conn.commit()
+            self.size = self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM cache"
+            ).fetchone()[0]
+
+    def yield_keys(self, *, prefix: Optional[str] = None) -> Iterator[str]:
+        with self._lock:
+            if prefix:
+                rows = self._conn.execute(
+                    "SELECT key FROM cache WHERE key >= ? AND key < ?",
+                    (prefix, prefix + "\uffff"),
+                ).fetchall()
+            else:
+                rows = self._conn.execute("SELECT key FROM cache").fetchall()
+        for (key,) in rows:
+            yield key
+
+    def stats(self) -> dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size_mb": round(self.size / 1024 / 1024, 2),
+        }
+
+    def _evict(self):
+        # drop least recently used entries until under the cap
+        target = self.max_size * EVICT_TO_RATIO
+        rows = self._conn.execute(
+            "SELECT key, size FROM cache ORDER BY accessed ASC"
+        )
+        evict = []
+        freed = 0
+        for key, size in rows:
+            if self.size - freed <= target:
+                break
+            evict.append(key)
+            freed += size
+        rows.close()
+        for chunk in _chunks(evict, 500):
+            self._conn.execute(
+                f"DELETE FROM cache WHERE key IN ({','.join('?' * len(chunk))})",
+                chunk,
+            )
+        self.size -= freed
+
+
+
+def _chunks(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
@@ -0,0 +1,40 @@
+import hashlib
+from typing import TYPE_CHECKING
+
+from python.helpers import files
+from python.helpers.sqlite_lru import SqliteLruStore
+
+if TYPE_CHECKING:
+    from agent import Agent
+
+# SQLite store with LRU eviction, values are the summary texts
+SUMMARY_CACHE_FILE = "tmp/summaries.db"
+
+
+def get_cache(max_size_mb: int) -> SqliteLruStore:
+    return SqliteLruStore.get(files.get_abs_path(SUMMARY_CACHE_FILE), max_size_mb)
+
+
+def cache_key(agent: "Agent", system: str, message: str) -> str:
+    # rendered prompts cover both the templates and the summarized text
+    model = agent.config.utility_model
+    data = "\0".join([model.provider.name, model.name, system, message])
+    return "summary:" + hashlib.sha256(data.encode("utf-8", errors="replace")).hexdigest()
+
+
+async def summarize(agent: "Agent", system: str, message: str) -> str:
+    # utility model summary, reused when the same text was summarized before
+    size_mb = agent.config.summary_cache_size_mb
+    if size_mb <= 0:
+        return await agent.call_utility_model(system=system, message=message)
+
+    cache = get_cache(size_mb)
+    key = cache_key(agent, system, message)
+    cached = cache.mget([key])[0]
+    if cached is not None:
+        return cached.decode("utf-8")
+
+    summary = await agent.call_utility_model(system=system, message=message)
+    if summary:
+        cache.mset([(key, summary.encode("utf-8"))])
+    return summary
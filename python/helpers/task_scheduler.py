@@ -17,7 +17,7 @@ from pydantic import BaseModel, Field, PrivateAttr
 
 from agent import Agent, AgentContext, UserMessage
 from initialize import initialize
-from python.helpers.persist_chat import save_tmp_chat
+from python.helpers.persist_chat import save_tmp_chat, load_tmp_chat
 from python.helpers.print_style import PrintStyle
 from python.helpers.defer import DeferredTask
 from python.helpers.files import get_abs_path, make_dirs, read_file, write_file
@@ -724,7 +724,7 @@ class TaskScheduler:
         return context
 
     async def _get_chat_context(self, task: Union[ScheduledTask, AdHocTask, PlannedTask]) -> AgentContext:
-        context = AgentContext.get(task.context_id) if task.context_id else None
+        context = load_tmp_chat(task.context_id) if task.context_id else None
 
         if context:
             assert isinstance(context, AgentContext)
@@ -1,30 +1,72 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import math
+import os
 from typing import Literal
 import tiktoken
 
 APPROX_BUFFER = 1.1
 TRIM_BUFFER = 0.8
+# average for English text with cl100k, used where a rough count is good enough
+CHARS_PER_TOKEN = 4
+# threads for batch counts, the native encoder runs without the GIL
+BATCH_THREADS = min(8, os.cpu_count() or 1)
+
+
+@lru_cache(maxsize=None)
+def get_encoding(encoding_name="cl100k_base") -> tiktoken.Encoding:
+    return tiktoken.get_encoding(encoding_name)
 
 
 def count_tokens(text: str, encoding_name="cl100k_base") -> int:
     if not text:
         return 0
 
-    # Get the encoding
-    encoding = tiktoken.get_encoding(encoding_name)
-
     # Encode the text and count the tokens
-    tokens = encoding.encode(text)
+    tokens = get_encoding(encoding_name).encode(text)
     token_count = len(tokens)
 
     return token_count
 
 
+def count_tokens_batch(texts: list[str], encoding_name="cl100k_base") -> list[int]:
+    # texts are encoded in parallel on a shared pool, tiktoken's encode_batch starts a new one per call
+    encoding = get_encoding(encoding_name)
+
+    def count(text: str) -> int:
+        return len(encoding.encode(text)) if text else 0
+
+    if len(texts) < 2 or BATCH_THREADS < 2:
+        return [count(text) for text in texts]
+    return list(_batch_pool().map(count, texts))
+
+
+@lru_cache(maxsize=None)
+def _batch_pool() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(BATCH_THREADS, thread_name_prefix="tokens")
+
+
 def approximate_tokens(
     text: str,
 ) -> int:
     return int(count_tokens(text) * APPROX_BUFFER)
 
 
+@lru_cache(maxsize=16)
+def approximate_tokens_cached(text: str) -> int:
+    # for texts counted again and again unchanged, like the system prompt
+    return approximate_tokens(text)
+
+
+def approximate_tokens_batch(texts: list[str]) -> list[int]:
+    return [int(count * APPROX_BUFFER) for count in count_tokens_batch(texts)]
+
+
+def estimate_tokens(text: str) -> int:
+    # from length only without encoding, for rate limiting
+    return math.ceil(len(text) / CHARS_PER_TOKEN * APPROX_BUFFER)
+
+
 def trim_to_tokens(
     text: str,
     max_tokens: int,
@@ -11,6 +11,7 @@ from langchain_community.vectorstores.utils import (
 from langchain.embeddings import CacheBackedEmbeddings
 
 from agent import Agent
+from python.helpers.memory_filter import MetadataFilter, compile_filter
 
 
 class MyFaiss(FAISS):
@@ -105,12 +106,5 @@ def cosine_normalizer(val: float) -> float:
     return res
 
 
-def get_comparator(condition: str):
-    def comparator(data: dict[str, Any]):
-        try:
-            return eval(condition, {}, data)
-        except Exception as e:
-            # PrintStyle.error(f"Error evaluating condition: {e}")
-            return False
-
-    return comparator
+def get_comparator(condition: str) -> MetadataFilter:
+    return compile_filter(condition)
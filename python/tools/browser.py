@@ -50,7 +50,7 @@ class Browser(Tool):
         def cleanup_message(msg):
             if not msg.ai and isinstance(msg.content, dict) and "tool_name" in msg.content and str(msg.content["tool_name"]).startswith("browser_"):
                 if not msg.summary:
-                    msg.summary = "browser content removed to save space"
+                    msg.set_summary("browser content removed to save space")
 
         for msg in self.agent.history.current.messages:
             cleanup_message(msg)
@@ -59,3 +59,5 @@ class Browser(Tool):
             if not prev.summary:
                 for msg in prev.messages:
                     cleanup_message(msg)
+
+        self.agent.history.update_tokens()
@@ -111,9 +111,10 @@ class SchedulerTool(Tool):
             await TaskScheduler.get().update_task(task_uuid, state=TaskState.IDLE)
             await TaskScheduler.get().save()
 
-        if context and context.id == task.uuid:
-            AgentContext.remove(context.id)
-            persist_chat.remove_chat(context.id)
+        # a dedicated context may not be loaded, its chat is removed either way
+        if task.context_id == task.uuid:
+            AgentContext.remove(task.context_id)
+            persist_chat.remove_chat(task.context_id)
 
         await TaskScheduler.get().remove_task_by_uuid(task_uuid)
         if TaskScheduler.get().get_task_by_uuid(task_uuid) is None:
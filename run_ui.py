@@ -402,7 +402,7 @@ def run():
 
 
 def init_a0():
-    # initialize contexts from persisted chats
+    # index persisted chats, their contexts are loaded when opened
     persist_chat.load_tmp_chats()
 
 
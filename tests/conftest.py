@@ -0,0 +1,114 @@
+import hashlib
+import uuid
+from types import SimpleNamespace
+
+import faiss
+import numpy as np
+import pytest
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.embeddings import Embeddings
+
+from python.helpers.memory import Memory, MyFaiss
+from python.helpers.memory_docstore import LazyDocstore
+from python.helpers.memory_wal import MemoryWal
+from python.helpers.print_style import PrintStyle
+
+DIM = 16
+
+
+class FakeEmbeddings(Embeddings):
+    # deterministic unit vectors derived from the text
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:4], "little")
+        vector = np.random.default_rng(seed).standard_normal(DIM).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+
+def new_db(db_dir: str) -> MyFaiss:
+    db = MyFaiss(
+        embedding_function=FakeEmbeddings(),
+        index=faiss.IndexFlatIP(DIM),
+        docstore=LazyDocstore(),
+        index_to_docstore_id={},
+        distance_strategy=DistanceStrategy.COSINE,
+        relevance_score_fn=Memory._cosine_normalizer,
+    )
+    db.wal = MemoryWal(db_dir)
+    Memory._save_db_file(db, db_dir)
+    return db
+
+
+def load_db(db_dir: str) -> MyFaiss:
+    db = MyFaiss.load_snapshot(
+        folder_path=db_dir,
+        embeddings=FakeEmbeddings(),
+        distance_strategy=DistanceStrategy.COSINE,
+        relevance_score_fn=Memory._cosine_normalizer,
+    )
+    db.wal = MemoryWal(db_dir)
+    Memory._replay_wal(db)
+    return db
+
+
+async def compact(db: MyFaiss):
+    await Memory.compact(db, force=True)
+
+
+def add_record(db: MyFaiss, texts: list[str], **metadata) -> list[str]:
+    # log and apply an insert the way Memory does
+    ids = [str(uuid.uuid4()) for _ in texts]
+    vectors = db.embedding_function.embed_documents(texts)  # type: ignore
+    record = {
+        "op": "add",
+        "ids": ids,
+        "texts": texts,
+        "metadatas": [dict(metadata, id=id) for id in ids],
+        "vectors": np.asarray(vectors, dtype=np.float32),
+    }
+    db.wal.append(record)  # type: ignore
+    Memory._apply_record(db, record)
+    return ids
+
+
+def delete_record(db: MyFaiss, ids: list[str]):
+    record = {"op": "delete", "ids": ids}
+    db.wal.append(record)  # type: ignore
+    Memory._apply_record(db, record)
+
+
+def assert_consistent(db, expected: set[str]):
+    docs = db.get_all_docs()
+    assert set(docs) == expected
+    assert db.index.ntotal == len(expected)
+    assert set(db.index_to_docstore_id.values()) == expected
+    db.lexical.ensure_loaded()
+    assert db.lexical.live == len(expected)
+    # every document is found by its own vector
+    for id, doc in docs.items():
+        vector = db.embedding_function.embed_query(doc.page_content)
+        found = db.similarity_search_with_score_by_vector(vector, k=1)
+        assert found[0][0].metadata["id"] == id
+
+
+def fake_agent(**config) -> SimpleNamespace:
+    async def rate_limiter(*args, **kwargs):
+        pass
+
+    config = {"memory_search_mode": "vector", "embeddings_model": None, **config}
+    return SimpleNamespace(config=SimpleNamespace(**config), rate_limiter=rate_limiter)
+
+
+@pytest.fixture
+def db_dir(tmp_path, monkeypatch) -> str:
+    # memory subdirs are plain paths in the tests
+    monkeypatch.setattr(Memory, "_abs_db_dir", staticmethod(lambda subdir: subdir))
+    return str(tmp_path / "memory")
+
+
+@pytest.fixture(autouse=True, scope="session")
+def print_log(tmp_path_factory):
+    # keep output of the tests out of the logs folder
+    PrintStyle.log_file_path = str(tmp_path_factory.mktemp("logs") / "log.html")
@@ -0,0 +1,16 @@
+from python.helpers import chunker
+
+
+def paragraphs(count: int) -> list[str]:
+    return [f"Paragraph {i} about clause {i * 7} of the policy. " * 4 for i in range(count)]
+
+
+def test_insertion_changes_only_nearby_chunks():
+    text = paragraphs(300)
+    before = chunker.chunk_text("\n\n".join(text))
+    after = chunker.chunk_text("\n\n".join(text[:10] + ["An inserted paragraph."] + text[10:]))
+
+    assert all(len(chunk) <= chunker.MAX_CHUNK_SIZE for chunk in before + after)
+    assert len(set(after) - set(before)) <= 2
+    # nothing is lost or repeated
+    assert "".join(before).replace("\n", "").replace(" ", "") == "".join(text).replace(" ", "")
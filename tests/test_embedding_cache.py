@@ -0,0 +1,29 @@
+import itertools
+
+from python.helpers import sqlite_lru
+from python.helpers.embedding_cache import EmbeddingCache
+
+
+def test_lru_eviction(tmp_path, monkeypatch):
+    clock = itertools.count(1)
+    monkeypatch.setattr(sqlite_lru.time, "time", lambda: float(next(clock)))
+    path = str(tmp_path / "embeddings.db")
+    cache = EmbeddingCache(path)
+    cache.max_size = 1000
+
+    for key in "abcdefgh":
+        cache.mset([(key, bytes(100))])
+    # replacing a value doesn't count its old size again
+    cache.mset([("h", bytes(100))])
+    assert cache.size == 800
+    # a hit makes the entry recently used
+    assert cache.mget(["a", "missing"]) == [bytes(100), None]
+
+    cache.mset([(key, bytes(100)) for key in "ijk"])
+
+    # evicted down to 90% of the cap, least recently used first
+    assert cache.size == 900
+    assert cache.mget(["b", "c"]) == [None, None]
+    assert all(cache.mget(list("adefghijk")))
+    assert cache.stats()["hits"] == 10
+    assert EmbeddingCache(path).size == 900
@@ -0,0 +1,147 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from python.helpers import history, settings, summary_cache, tokens
+
+
+@pytest.fixture(autouse=True)
+def word_tokens(monkeypatch):
+    # word counts, the tokenizer would be downloaded on first use
+    monkeypatch.setattr(tokens, "get_encoding", lambda *args: SimpleNamespace(encode=str.split))
+
+
+def recount(hist: history.History) -> int:
+    # count every record from its text as before counts were kept
+    total = 0
+    for record in [*hist.bulks, *hist.topics, hist.current]:
+        total += tokens.approximate_tokens(record.summary) if record.summary else sum(
+            tokens.approximate_tokens(msg.output_text()) for msg in record.messages
+        )
+    return total
+
+
+def test_token_counts_follow_changes(monkeypatch):
+    hist = history.History(agent=None)
+    for i in range(30):
+        hist.add_message(i % 2 == 0, {"step": i, "text": "word " * i})
+        if i % 10 == 9:
+            hist.new_topic()
+    assert hist.get_tokens() == recount(hist)
+
+    hist.topics[0].set_summary("first topic in a few words")
+    hist.topics[1].messages[3].set_summary("short")
+    hist.topics[1].update_tokens()
+    hist.add_message(False, "after summaries")
+    assert hist.get_tokens() == recount(hist)
+
+    # stored counts are loaded without encoding the messages again
+    data = hist.serialize()
+    monkeypatch.setattr(tokens, "get_encoding", None)
+    assert history.deserialize_history(data, agent=None).get_tokens() == hist.get_tokens()
+
+
+def converted(hist: history.History, extras: list) -> list:
+    # everything converted and grouped again from the records
+    outputs = [m for r in [*hist.bulks, *hist.topics, hist.current] for m in r.output()]
+    return history.output_langchain(outputs + extras)
+
+
+def test_cached_conversion_matches_full_conversion():
+    hist = history.History(agent=None)
+    extras = [history.OutputMessage(ai=False, content="extra")]
+    for i in range(24):
+        # runs of messages from one side are grouped together
+        hist.add_message(i % 3 == 0, {"step": i})
+        assert hist.output_langchain(extras) == converted(hist, extras)
+        if i % 8 == 7:
+            hist.new_topic()
+
+    hist.topics[0].set_summary("summary of the first topic")
+    hist.update_tokens()
+    assert hist.output_langchain(extras) == converted(hist, extras)
+    # message summaries edited from outside are followed by a recount
+    hist.add_message(True, "next")
+    hist.current.messages[-1].set_summary("shortened")
+    hist.update_tokens()
+    assert hist.output_langchain() == converted(hist, [])
+
+
+class SummaryAgent:
+    # utility model stub, counts calls running at the same time
+    def __init__(self, summary_cache_size_mb: int = 0):
+        self.running = self.most = self.calls = 0
+        self.config = SimpleNamespace(
+            utility_model=SimpleNamespace(provider=SimpleNamespace(name="TEST"), name="stub"),
+            summary_cache_size_mb=summary_cache_size_mb,
+        )
+
+    async def call_utility_model(self, system: str, message: str) -> str:
+        self.calls += 1
+        self.running += 1
+        self.most = max(self.most, self.running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        return "summary of earlier work"
+
+    def read_prompt(self, name: str, **kwargs) -> str:
+        return ""
+
+    def parse_prompt(self, name: str, **kwargs) -> str:
+        return kwargs.get("summary", "")
+
+
+@pytest.fixture
+def small_context(monkeypatch):
+    monkeypatch.setattr(
+        settings,
+        "get_settings",
+        lambda: {"chat_model_ctx_length": 2000, "chat_model_ctx_history": 0.7},
+    )
+
+
+def long_history(agent) -> history.History:
+    hist = history.History(agent=agent)
+    for topic in range(12):
+        for i in range(10):
+            hist.add_message(i % 2 == 0, f"topic {topic} message {i} " + "word " * 20)
+        hist.new_topic()
+    hist.add_message(False, "current question")
+    return hist
+
+
+def test_compression_runs_summaries_concurrently(small_context):
+    agent = SummaryAgent()
+    hist = long_history(agent)
+
+    assert asyncio.run(hist.compress())
+    assert not hist.is_over_limit()
+    assert agent.most > 1
+    assert hist.current.messages[-1].content == "current question"
+
+
+def test_reloaded_history_reuses_summaries(small_context, tmp_path, monkeypatch):
+    monkeypatch.setattr(summary_cache, "SUMMARY_CACHE_FILE", str(tmp_path / "summaries.db"))
+    first = SummaryAgent(summary_cache_size_mb=1)
+    hist = long_history(first)
+    data = hist.serialize()
+    asyncio.run(hist.compress())
+    assert first.calls
+
+    # the same chat compressed again after a restart
+    second = SummaryAgent(summary_cache_size_mb=1)
+    reloaded = history.deserialize_history(data, agent=second)
+    asyncio.run(reloaded.compress())
+    assert second.calls == 0
+    assert reloaded.serialize() == hist.serialize()
+
+
+def test_rate_limit_tokens_follow_config():
+    from agent import Agent
+
+    text = "word " * 1000
+    exact = SimpleNamespace(config=SimpleNamespace(rate_limit_estimate_tokens=False))
+    estimate = SimpleNamespace(config=SimpleNamespace(rate_limit_estimate_tokens=True))
+    assert Agent.rate_limit_tokens(exact, text) == tokens.approximate_tokens(text)  # type: ignore
+    assert Agent.rate_limit_tokens(estimate, text) == tokens.estimate_tokens(text)  # type: ignore
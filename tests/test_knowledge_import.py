@@ -0,0 +1,156 @@
+import asyncio
+import os
+
+from langchain_core.documents import Document
+
+from python.helpers import knowledge_import
+from python.helpers.memory import Memory
+
+from .conftest import fake_agent, new_db
+
+
+async def parse_all(jobs: list) -> dict[str, tuple]:
+    # documents of each file joined from its batches, with the error of its last item
+    results: dict[str, tuple] = {}
+    async for job, documents, last, error in knowledge_import.parse_files(jobs, 2):
+        docs, _ = results.get(job["path"], ([], ""))
+        results[job["path"]] = (docs + documents, error if last else "")
+    return results
+
+
+def test_failed_file_does_not_stop_import(tmp_path):
+    (tmp_path / "first.md").write_text("Water damage is covered.")
+    (tmp_path / "second.txt").write_text("Theft is not covered.")
+    (tmp_path / "broken.pdf").write_bytes(b"not a pdf")
+    index: dict = {}
+    jobs = knowledge_import.scan_knowledge(None, str(tmp_path), index, {"area": "main"})
+    assert len(jobs) == 3
+
+    results = asyncio.run(parse_all(jobs))
+
+    documents, error = results[str(tmp_path / "broken.pdf")]
+    assert documents == [] and error
+    documents, error = results[str(tmp_path / "first.md")]
+    assert [doc.page_content for doc in documents] == ["Water damage is covered."]
+    assert documents[0].metadata["area"] == "main"
+    assert results[str(tmp_path / "second.txt")][0]
+
+
+def scan(folder: str, index: dict) -> list:
+    # scan and store the stat and checksum of parsed files as the import does
+    for file_data in index.values():
+        file_data.pop("state", None)
+    jobs = knowledge_import.scan_knowledge(None, folder, index, {"area": "main"})
+    for job in jobs:
+        index[job["file_key"]].update(checksum=job["checksum"], **job["stat"])
+    return jobs
+
+
+def test_unchanged_files_are_not_hashed(tmp_path, monkeypatch):
+    first = tmp_path / "first.md"
+    first.write_text("Water damage is covered.")
+    index: dict = {}
+    assert len(scan(str(tmp_path), index)) == 1
+    key = knowledge_import.knowledge_key(str(first))
+
+    hashed = []
+    real_checksum = knowledge_import.calculate_checksum
+    monkeypatch.setattr(
+        knowledge_import,
+        "calculate_checksum",
+        lambda path: hashed.append(path) or real_checksum(path),
+    )
+    assert scan(str(tmp_path), index) == [] and hashed == []
+
+    # touched without a change, the content hash matches and the stat is updated
+    os.utime(first, ns=(first.stat().st_atime_ns, first.stat().st_mtime_ns + 10**9))
+    assert scan(str(tmp_path), index) == []
+    assert index[key]["mtime_ns"] == first.stat().st_mtime_ns
+
+    first.write_text("Storm damage is covered.")
+    assert len(scan(str(tmp_path), index)) == 1
+
+
+def test_absolute_keys_are_migrated():
+    moved = "/old/install/knowledge/custom/main/a.md"
+    index = knowledge_import.migrate_keys({moved: {"checksum": "x"}})
+    assert index == {"knowledge/custom/main/a.md": {"checksum": "x"}}
+
+
+def test_removed_folder_marks_its_files(tmp_path):
+    folder = tmp_path / "sub"
+    folder.mkdir()
+    (folder / "a.md").write_text("Water damage is covered.")
+    index: dict = {}
+    scan(str(tmp_path), index)
+    key = knowledge_import.knowledge_key(str(folder / "a.md"))
+
+    (folder / "a.md").unlink()
+    folder.rmdir()
+    jobs = knowledge_import.scan_paths([str(folder)], index, lambda path: {"area": "main"})
+    assert jobs == [] and index[key]["state"] == "removed"
+
+
+def import_dir(memory: Memory, folder: str, index: dict) -> int:
+    # one knowledge load: scan, mark missing files, parse in workers and store
+    jobs = knowledge_import.scan_knowledge(None, folder, index, {"area": "main"}, "**/*")
+    knowledge_import.mark_removed(index)
+    asyncio.run(memory._import_knowledge(None, index, jobs))
+    # saved index keeps no state and no removed files
+    for key, file_data in list(index.items()):
+        if file_data.pop("state", None) == "removed":
+            del index[key]
+    return len(jobs)
+
+
+def file_texts(memory: Memory, index: dict, key: str) -> list[str]:
+    docs = memory.db.get_all_docs()
+    return [docs[id].page_content for id in index[key]["ids"]]
+
+
+def test_stat_skip_and_reimport(db_dir, tmp_path):
+    folder = tmp_path / "knowledge"
+    folder.mkdir()
+    first, second = folder / "first.md", folder / "second.txt"
+    first.write_text("Water damage is covered.\n\nFire damage is covered.")
+    second.write_text("Theft is not covered.")
+    memory = Memory(fake_agent(knowledge_import_workers=1), new_db(db_dir), "test")  # type: ignore
+    index: dict = {}
+
+    assert import_dir(memory, str(folder), index) == 2
+    docs = dict(memory.db.get_all_docs())
+    key = knowledge_import.knowledge_key(str(first))
+    assert "Water damage" in " ".join(file_texts(memory, index, key))
+
+    # unchanged stat, nothing is hashed or parsed again
+    assert import_dir(memory, str(folder), index) == 0
+    assert memory.db.get_all_docs().keys() == docs.keys()
+
+    # touched without a change, the content hash matches and the stat is updated
+    os.utime(first, ns=(first.stat().st_atime_ns, first.stat().st_mtime_ns + 10**9))
+    assert import_dir(memory, str(folder), index) == 0
+    assert index[key]["mtime_ns"] == first.stat().st_mtime_ns
+
+    # edited, the file is imported again and its old chunks are replaced
+    first.write_text("Storm damage is covered.")
+    assert import_dir(memory, str(folder), index) == 1
+    assert file_texts(memory, index, key) == ["Storm damage is covered."]
+    texts = [doc.page_content for doc in memory.db.get_all_docs().values()]
+    assert not any("Water damage" in text for text in texts)
+
+    # removed, its chunks are deleted
+    second.unlink()
+    assert import_dir(memory, str(folder), index) == 0
+    texts = [doc.page_content for doc in memory.db.get_all_docs().values()]
+    assert not any("Theft" in text for text in texts)
+    assert knowledge_import.knowledge_key(str(second)) not in index
+
+
+def test_chunk_hash_ignores_loader_metadata():
+    doc = Document(
+        "Glass breakage is covered.", metadata={"area": "main", "source": "/a/x.csv", "row": 3}
+    )
+    moved = Document(doc.page_content, metadata={"area": "main", "source": "/b/x.csv", "row": 4})
+    assert knowledge_import.chunk_hash(doc) == knowledge_import.chunk_hash(moved)
+    other_area = Document(doc.page_content, metadata={"area": "solutions"})
+    assert knowledge_import.chunk_hash(doc) != knowledge_import.chunk_hash(other_area)
@@ -0,0 +1,72 @@
+import asyncio
+
+from langchain_core.documents import Document
+
+from python.helpers.memory import Memory
+
+from .conftest import add_record, assert_consistent, fake_agent, load_db, new_db
+
+
+def test_searches_during_writes(db_dir):
+    db = new_db(db_dir)
+    expected = set(add_record(db, [f"memory {i}" for i in range(50)], area="main"))
+    memory = Memory(fake_agent(), db, "concurrency")  # type: ignore
+    texts = {id: doc.page_content for id, doc in db.get_all_docs().items()}
+    victims = sorted(expected)[:5]
+
+    async def insert(n: int):
+        docs = [Document(f"inserted {n} {i}", metadata={"area": "main"}) for i in range(5)]
+        ids = await memory.insert_documents(docs)
+        texts.update((id, doc.page_content) for id, doc in zip(ids, docs))
+        return ids
+
+    async def delete(n: int):
+        await memory.delete_documents_by_ids([victims[n]])
+
+    async def search(n: int):
+        docs = await memory.search_similarity_threshold(
+            f"memory {n % 50}", 5, 0, filter="area == 'main'" if n % 2 else ""
+        )
+        for doc in docs:
+            # a result never mixes a document with another one's text
+            assert texts.get(doc.metadata["id"], doc.page_content) == doc.page_content
+        return docs
+
+    async def run():
+        tasks = [insert(n) for n in range(20)]
+        tasks += [delete(n) for n in range(5)]
+        tasks += [search(n) for n in range(200)]
+        return await asyncio.wait_for(asyncio.gather(*tasks), timeout=60)
+
+    results = asyncio.run(run())
+    inserted = {id for ids in results[:20] for id in ids}
+    alive = set(db.get_all_docs())
+    assert inserted <= alive
+    assert not alive & set(victims)
+    assert len(alive) == 50 + 100 - 5
+    assert all(results[25:])
+    assert_consistent(db, alive)
+    # the log holds the same state
+    assert_consistent(load_db(db_dir), alive)
+
+
+def test_inserts_during_compaction(db_dir):
+    db = new_db(db_dir)
+    expected = set(add_record(db, [f"memory {i}" for i in range(50)], area="main"))
+    memory = Memory(fake_agent(), db, "concurrency")  # type: ignore
+
+    async def insert(n: int):
+        await asyncio.sleep(0.001 * n)
+        docs = [Document(f"inserted {n} {i}", metadata={"area": "main"}) for i in range(5)]
+        return await memory.insert_documents(docs)
+
+    async def run():
+        tasks = [Memory.compact(db, force=True) for _ in range(3)]
+        tasks += [insert(n) for n in range(20)]
+        return await asyncio.wait_for(asyncio.gather(*tasks), timeout=60)
+
+    results = asyncio.run(run())
+    # inserts between serializing and rebasing stay in memory and in the log
+    expected |= {id for ids in results[3:] for id in ids}
+    assert_consistent(db, expected)
+    assert_consistent(load_db(db_dir), expected)
@@ -0,0 +1,88 @@
+import pytest
+
+from python.helpers import memory_filter
+from python.helpers.memory_filter import MetadataIndex, compile_filter
+
+# filters from the memory tool prompts and variations of them
+CONDITIONS = [
+    "area=='main' and timestamp<'2024-01-01 00:00:00'",
+    "timestamp.startswith('2022-01-01')",
+    "area == 'solutions' or area == 'fragments'",
+    "not area == 'main'",
+    "'2023-01-01' <= timestamp < '2024-01-01'",
+    "area in ['main', 'solutions']",
+    "knowledge_source.endswith('.md')",
+    "area.upper() == 'MAIN'",
+    "timestamp.find('-06-') >= 0",
+    "len(area) > 4",
+    "missing == 1 or area == 'main'",
+    "timestamp[:4] == '2022'",
+    "area.replace('main', 'x') == 'x'",
+    "timestamp.split(' ')[0] == '2022-01-01'",
+    "timestamp[-8:-6] + 'h' == '10h'",
+    "len(area) * 2 >= 10 and area.count('a') == 1",
+    "area in [knowledge_source, 'solutions']",
+    "str(area) == '5' or -len(area) < -8",
+    "timestamp is None",
+    "knowledge_source if area == 'main' else 'fragments' == area",
+    "area in (lambda: ['main'])()",
+    "area ==",
+]
+
+# conditions the compiler doesn't cover, evaluated with eval()
+FALLBACK = {"area in (lambda: ['main'])()"}
+
+METADATA = [
+    {"id": "a", "area": "main", "timestamp": "2022-01-01 10:00:00"},
+    {"id": "b", "area": "main", "timestamp": "2023-06-15 08:30:00"},
+    {"id": "c", "area": "fragments", "timestamp": "2022-01-01 23:59:59"},
+    {"id": "d", "area": "solutions", "timestamp": "2024-02-01 00:00:00"},
+    {"id": "e", "area": "main", "timestamp": "2021-12-31 00:00:00", "knowledge_source": "doc.md"},
+    {"id": "f", "area": 5, "timestamp": None},
+]
+
+
+def old_eval(condition: str, data: dict) -> bool:
+    # evaluation used before filters were compiled
+    try:
+        return bool(eval(condition, {}, data))
+    except Exception:
+        return False
+
+
+@pytest.mark.parametrize("condition", CONDITIONS)
+def test_compiled_filter_matches_eval(condition):
+    comparator = compile_filter(condition)
+    for data in METADATA:
+        assert comparator(data) == old_eval(condition, data), data["id"]
+
+
+@pytest.mark.parametrize("condition", CONDITIONS)
+def test_index_candidates_cover_matches(condition):
+    index = MetadataIndex()
+    for data in METADATA:
+        index.add(data["id"], data)
+    candidates = compile_filter(condition).candidates(index)
+    if candidates is not None:
+        assert {d["id"] for d in METADATA if old_eval(condition, d)} <= candidates
+
+
+def test_prefix_candidates():
+    index = MetadataIndex()
+    for data in METADATA:
+        index.add(data["id"], data)
+    assert compile_filter("timestamp.startswith('2022-01-01')").candidates(index) == {"a", "c"}
+
+
+def test_only_unsupported_filters_fall_back_to_eval(monkeypatch):
+    warnings = []
+    monkeypatch.setattr(memory_filter.PrintStyle, "warning", staticmethod(warnings.append))
+    compile_filter.cache_clear()
+    fallback = {
+        condition
+        for condition in CONDITIONS
+        if isinstance(compile_filter(condition).root, memory_filter._Eval)
+    }
+    assert fallback == FALLBACK
+    # reported once for each condition
+    assert len(warnings) == len(FALLBACK)
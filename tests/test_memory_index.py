@@ -0,0 +1,71 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from python.helpers import memory_index
+from python.helpers.memory import Memory
+from python.helpers.memory_index import IndexConfig
+
+from .conftest import add_record, delete_record, fake_agent, load_db, new_db
+
+
+def assert_found(db, ids: set[str]):
+    docs = db.get_all_docs()
+    assert set(docs) == ids
+    for id in ids:
+        vector = db.embedding_function.embed_query(docs[id].page_content)
+        assert db.similarity_search_with_score_by_vector(vector, k=1)[0][0].metadata["id"] == id
+
+
+@pytest.mark.parametrize(
+    "config, count, quantization",
+    [
+        (IndexConfig(promote_at=20), 30, "none"),
+        (IndexConfig(promote_at=20, quantization="sq8"), 1100, "sq8"),
+    ],
+)
+def test_promotion_keeps_documents(db_dir, config, count, quantization):
+    db = new_db(db_dir)
+    db.index_config = config
+    ids = set(add_record(db, [f"memory {i}" for i in range(count)]))
+    assert memory_index.needs_rebuild(db.index, config, count)
+
+    asyncio.run(Memory.rebuild_index(db, "test"))
+    assert memory_index.get_index_type(db.index) == "hnsw"
+    assert memory_index.get_quantization(db.index) == quantization
+    assert not memory_index.needs_rebuild(db.index, config, count)
+
+    # deletes leave tombstones in hnsw, inserts are appended
+    removed = sorted(ids)[:3]
+    delete_record(db, removed)
+    ids = ids - set(removed) | set(add_record(db, ["after promotion"]))
+    assert_found(db, ids)
+
+    db = load_db(db_dir)
+    assert memory_index.get_index_type(db.index) == "hnsw"
+    assert (db.full_vectors is not None) == (quantization != "none")
+    assert_found(db, ids)
+
+
+def test_subdir_overrides_index_settings(db_dir):
+    agent = fake_agent(
+        memory_index_type="auto",
+        memory_index_promote_at=50000,
+        memory_quantization="none",
+        memory_rerank_factor=4,
+    )
+    assert Memory._get_index_config(agent, db_dir).type == "auto"  # type: ignore
+
+    os.makedirs(db_dir)
+    path = os.path.join(db_dir, memory_index.CONFIG_FILE)
+    with open(path, "w") as f:
+        json.dump({"type": "ivf_pq", "promote_at": 1000}, f)
+    config = Memory._get_index_config(agent, db_dir)  # type: ignore
+    assert (config.type, config.promote_at, config.rerank_factor) == ("ivf_pq", 1000, 4)
+
+    # a broken file falls back to the settings
+    with open(path, "w") as f:
+        json.dump({"type": "annoy"}, f)
+    assert Memory._get_index_config(agent, db_dir).type == "auto"  # type: ignore
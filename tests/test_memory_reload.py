@@ -0,0 +1,52 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+from python.helpers import memory_reindex
+from python.helpers.memory import Memory
+
+from .conftest import add_record, assert_consistent, fake_agent, load_db, new_db
+
+
+def test_knowledge_preload_waits_for_reindex(db_dir, monkeypatch):
+    db = new_db(db_dir)
+    job = SimpleNamespace(finished=threading.Event(), state="running", keyword_only=True)
+    memory = Memory(fake_agent(knowledge_subdirs=["default"]), db, db_dir)  # type: ignore
+    preloaded = threading.Event()
+
+    async def preload_knowledge(self, log_item, kn_dirs, memory_subdir):
+        preloaded.set()
+
+    monkeypatch.setattr(Memory, "preload_knowledge", preload_knowledge)
+    monkeypatch.setitem(Memory.index, db_dir, db)
+
+    # returns right away, the import starts once the new index is swapped in
+    Memory._preload_after_reindex(memory, job, None)  # type: ignore
+    assert not preloaded.wait(0.3)
+    job.state = "done"
+    job.finished.set()
+    assert preloaded.wait(5)
+
+
+def test_unload_closes_the_database(db_dir, monkeypatch):
+    db = new_db(db_dir)
+    ids = set(add_record(db, [f"memory {i}" for i in range(5)]))
+    monkeypatch.setitem(Memory.index, db_dir, db)
+    cancelled = []
+    monkeypatch.setattr(memory_reindex, "cancel", cancelled.append)
+
+    # a compaction in progress finishes before the files are opened again
+    db.wal.compacting = True  # type: ignore
+    Memory.unload(db_dir)
+    assert db_dir not in Memory.index
+    assert cancelled == [db_dir]
+    closing = Memory.closing[db_dir]
+    time.sleep(0.3)
+    assert not closing.is_ready()
+    db.wal.compacting = False  # type: ignore
+    asyncio.run(closing.result(5))
+    Memory.closing.pop(db_dir)
+
+    assert not db.wal.unsynced  # type: ignore
+    assert_consistent(load_db(db_dir), ids)
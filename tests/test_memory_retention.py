@@ -0,0 +1,43 @@
+import asyncio
+
+from python.helpers import memory_retention
+from python.helpers.memory_retention import RetentionPolicy
+
+from .conftest import add_record, load_db, new_db
+
+
+def test_lowest_scores_are_evicted_to_the_cap(db_dir):
+    db = new_db(db_dir)
+    memorized = add_record(db, [f"memorized {i}" for i in range(6)], area="fragments")
+    main = add_record(db, ["main 1", "main 2"], area="main")
+    # recalled memories score higher
+    for _ in range(3):
+        db.record_access(memorized[:2])
+
+    removed = asyncio.run(
+        memory_retention.enforce(db, {"fragments": RetentionPolicy(max_entries=2)})
+    )
+
+    assert removed == {"fragments": 4}
+    docs = load_db(db_dir).get_all_docs()
+    assert set(main) <= set(docs)
+    assert set(memorized) & set(docs) == set(memorized[:2])
+
+
+def test_knowledge_chunks_are_not_evicted(db_dir):
+    db = new_db(db_dir)
+    memorized = add_record(db, [f"memorized {i}" for i in range(6)], area="fragments")
+    imported = add_record(db, ["imported 1", "imported 2"], area="fragments", source="a.md")
+    indexed = add_record(db, ["indexed 1"], area="fragments")
+
+    removed = asyncio.run(
+        memory_retention.enforce(
+            db, {"fragments": RetentionPolicy(max_entries=2)}, set(indexed)
+        )
+    )
+
+    assert removed == {"fragments": 4}
+    docs = load_db(db_dir).get_all_docs()
+    assert set(imported + indexed) <= set(docs)
+    assert len([id for id in memorized if id in docs]) == 2
+
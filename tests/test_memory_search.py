@@ -0,0 +1,19 @@
+import asyncio
+
+from python.helpers.memory import Memory
+
+from .conftest import add_record, fake_agent, new_db
+
+
+def test_hybrid_keyword_hits_respect_threshold(db_dir):
+    db = new_db(db_dir)
+    add_record(db, ["alpha beta", "gamma delta", "epsilon zeta"], area="main")
+    memory = Memory(fake_agent(memory_search_mode="hybrid"), db, "test")  # type: ignore
+
+    # unrelated vectors, the documents are found by their words
+    found = asyncio.run(memory.search_similarity_threshold("beta gamma", 10, 0))
+    assert {doc.page_content for doc in found} >= {"alpha beta", "gamma delta"}
+    # keyword matches alone don't pass a high threshold
+    assert asyncio.run(memory.search_similarity_threshold("beta gamma", 10, 0.99)) == []
+    exact = asyncio.run(memory.search_similarity_threshold("alpha beta", 10, 0.99))
+    assert [doc.page_content for doc in exact] == ["alpha beta"]
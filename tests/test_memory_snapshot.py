@@ -0,0 +1,192 @@
+import asyncio
+import os
+
+import faiss
+import pytest
+from langchain_community.docstore.in_memory import InMemoryDocstore
+
+from python.helpers import memory_docstore, memory_reindex
+from python.helpers.memory import Memory, MyFaiss
+from python.helpers.memory_docstore import LazyDocstore
+from python.helpers.memory_wal import MemoryWal
+
+from .conftest import (
+    DIM,
+    FakeEmbeddings,
+    add_record,
+    assert_consistent,
+    compact,
+    delete_record,
+    load_db,
+    new_db,
+)
+
+
+class Crash(Exception):
+    pass
+
+
+def populate(db_dir: str) -> tuple[object, set[str]]:
+    db = new_db(db_dir)
+    ids = add_record(db, [f"first {i}" for i in range(10)])
+    asyncio.run(compact(db))
+    ids += add_record(db, [f"second {i}" for i in range(5)])
+    delete_record(db, ids[:2])
+    return db, set(ids[2:])
+
+
+def test_wal_replay_after_crash(db_dir):
+    _, expected = populate(db_dir)
+    # process dies without compacting, the log holds all changes since the snapshot
+    assert_consistent(load_db(db_dir), expected)
+
+
+def test_torn_log_tail_is_ignored(db_dir):
+    db, expected = populate(db_dir)
+    path = db.wal._segment_path(db.wal.active)
+    with open(path, "ab") as f:
+        f.write(b"\x10\x00\x00\x00garbage")
+    assert_consistent(load_db(db_dir), expected)
+    # new records are appended after the valid part
+    db = load_db(db_dir)
+    expected |= set(add_record(db, ["after tail"]))
+    assert_consistent(load_db(db_dir), expected)
+
+
+@pytest.mark.parametrize("crash_at", range(len(memory_docstore.SNAPSHOT_FILES) + 2))
+def test_crash_during_compaction(db_dir, monkeypatch, crash_at):
+    db, expected = populate(db_dir)
+
+    # die half way through writing each snapshot file, before the manifest swap and before dropping the log
+    calls = {"n": 0}
+    real_open = open
+
+    class TornFile:
+        def __init__(self, f):
+            self.f = f
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            self.f.close()
+
+        def write(self, data):
+            self.f.write(data[: len(data) // 2])
+            self.f.flush()
+            raise Crash(self.f.name)
+
+    def crashing_open(path, mode="r", *args, **kwargs):
+        f = real_open(path, mode, *args, **kwargs)
+        if "w" in mode:
+            calls["n"] += 1
+            if calls["n"] - 1 == crash_at:
+                return TornFile(f)
+        return f
+
+    def crashing_manifest(*args):
+        raise Crash("manifest")
+
+    def crashing_drop(self, upto):
+        raise Crash("drop")
+
+    monkeypatch.setattr(memory_docstore, "open", crashing_open, raising=False)
+    if crash_at == len(memory_docstore.SNAPSHOT_FILES):
+        monkeypatch.setattr(memory_docstore, "write_manifest", crashing_manifest)
+    if crash_at == len(memory_docstore.SNAPSHOT_FILES) + 1:
+        monkeypatch.setattr(MemoryWal, "drop_sealed", crashing_drop)
+
+    asyncio.run(compact(db))
+    monkeypatch.undo()
+
+    # reload as after a restart and finish with a clean compaction
+    db = load_db(db_dir)
+    assert_consistent(db, expected)
+    asyncio.run(compact(db))
+    assert_consistent(load_db(db_dir), expected)
+    snapshots = [name for name in os.listdir(db_dir) if name.startswith("snapshot.")]
+    assert sorted(snapshots) == sorted(["snapshot.json", memory_docstore.read_manifest(db_dir)["dir"]])  # type: ignore
+
+
+def test_flat_snapshot_is_converted(db_dir):
+    db, expected = populate(db_dir)
+    asyncio.run(compact(db))
+    # move the files back to the layout without snapshot directories
+    snapshot = memory_docstore.snapshot_dir(db_dir)
+    for name in memory_docstore.SNAPSHOT_FILES:
+        os.replace(os.path.join(snapshot, name), os.path.join(db_dir, name))  # type: ignore
+    os.rmdir(snapshot)  # type: ignore
+    os.remove(os.path.join(db_dir, memory_docstore.MANIFEST_FILE))
+
+    db = load_db(db_dir)
+    assert_consistent(db, expected)
+    expected |= set(add_record(db, ["converted"]))
+    asyncio.run(compact(db))
+    assert not os.path.exists(os.path.join(db_dir, memory_docstore.INDEX_FILE))
+    assert_consistent(load_db(db_dir), expected)
+
+
+def test_reindex_swap_resumes(db_dir):
+    populate(db_dir)
+    staging_dir = os.path.join(db_dir, memory_reindex.STAGING_DIR)
+    staging = new_db(staging_dir)
+    expected = set(add_record(staging, ["staged 1", "staged 2"]))
+    asyncio.run(compact(staging))
+    expected |= set(add_record(staging, ["staged 3"]))
+    with open(os.path.join(staging_dir, memory_reindex.READY_FILE), "w") as f:
+        f.write("0")
+
+    # crash after the snapshot directory was moved, before the manifest swap
+    staged = memory_docstore.read_manifest(staging_dir)
+    os.replace(
+        os.path.join(staging_dir, staged["dir"]), os.path.join(db_dir, staged["dir"])  # type: ignore
+    )
+    assert memory_reindex.finish_swap(db_dir)
+    assert not os.path.exists(staging_dir)
+    assert_consistent(load_db(db_dir), expected)
+
+
+def test_wal_sync_after_rotation(db_dir):
+    db = new_db(db_dir)
+    add_record(db, ["before rotation"])
+    sealed = db.wal.rotate()  # type: ignore
+    add_record(db, ["after rotation"])
+    assert db.wal.unsynced == {sealed, sealed + 1}  # type: ignore
+    db.wal.drop_sealed(sealed)  # type: ignore
+    db.wal.sync()  # type: ignore
+    assert not db.wal.unsynced  # type: ignore
+    assert [r["texts"] for r in MemoryWal(db_dir).read()] == [["after rotation"]]
+
+
+def test_legacy_snapshot_is_converted(db_dir):
+    # snapshot in the FAISS.save_local format used before documents were mapped
+    db = MyFaiss(
+        embedding_function=FakeEmbeddings(),
+        index=faiss.IndexFlatIP(DIM),
+        docstore=InMemoryDocstore(),
+        index_to_docstore_id={},
+    )
+    os.makedirs(db_dir)
+    db.wal = MemoryWal(db_dir)
+    expected = set(add_record(db, ["legacy 1", "legacy 2"]))
+    db.save_local(db_dir)
+    db.wal.clear()
+
+    db = load_db(db_dir)
+    assert_consistent(db, expected)
+    expected |= set(add_record(db, ["converted"]))
+    asyncio.run(compact(db))
+    assert not os.path.exists(os.path.join(db_dir, memory_docstore.LEGACY_DOCSTORE_FILE))
+    assert isinstance(load_db(db_dir).docstore, LazyDocstore)
+    assert_consistent(load_db(db_dir), expected)
+
+
+def test_damaged_snapshot_is_not_loaded(db_dir):
+    db, _ = populate(db_dir)
+    parts, _ = Memory._serialize_db(db)
+    path = memory_docstore.write_snapshot(db_dir, parts)
+    assert memory_docstore.snapshot_dir(db_dir) == path
+    with open(os.path.join(path, memory_docstore.INDEX_FILE), "r+b") as f:
+        f.truncate(10)
+    with pytest.raises(Exception, match="damaged"):
+        memory_docstore.has_snapshot(db_dir)
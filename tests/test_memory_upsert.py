@@ -0,0 +1,31 @@
+import asyncio
+
+from python.helpers.memory import Memory
+from python.helpers.memory_wal import MemoryWal
+
+from .conftest import add_record, fake_agent, load_db, new_db
+
+
+def test_upsert_replaces_duplicates_in_one_record(db_dir):
+    db = new_db(db_dir)
+    old = add_record(db, ["water damage"], area="fragments")
+    other_area = add_record(db, ["water damage"], area="main")
+    memory = Memory(fake_agent(), db, "test")  # type: ignore
+    logged = len(MemoryWal(db_dir).read())
+
+    ids, removed = asyncio.run(
+        memory.upsert_batch(
+            ["water damage", "storm damage", "water damage", "fire damage"],
+            "fragments",
+            0.9,
+        )
+    )
+
+    # later duplicates in the batch win, the stored one in the same area is replaced
+    assert [doc.metadata["id"] for doc in removed] == old
+    docs = db.get_all_docs()
+    assert [docs[id].page_content for id in ids] == ["storm damage", "water damage", "fire damage"]
+    assert set(other_area) <= set(docs)
+    records = MemoryWal(db_dir).read()[logged:]
+    assert [record["op"] for record in records] == ["batch"]
+    assert set(load_db(db_dir).get_all_docs()) == set(docs)
@@ -0,0 +1,131 @@
+import json
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from agent import Agent, AgentContext
+from python.helpers import localization, persist_chat, settings, tokens
+
+
+@pytest.fixture
+def chats_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(persist_chat, "CHATS_FOLDER", str(tmp_path / "chats"))
+    monkeypatch.setattr(persist_chat, "CHAT_INDEX_FILE", str(tmp_path / "chat_index.json"))
+    monkeypatch.setattr(persist_chat, "_index", {})
+    monkeypatch.setattr(persist_chat, "_index_read", False)
+    monkeypatch.setattr(persist_chat, "_journals", {})
+    return tmp_path / "chats"
+
+
+def test_latest_chat_by_last_message(chats_dir):
+    assert persist_chat.latest_tmp_chat() is None
+    for id, last in [("a", "2026-01-02T10:00:00"), ("b", "2026-03-01T09:00:00"), ("c", "2025-12-31T23:00:00")]:
+        persist_chat._update_index(
+            persist_chat._index_entry({"id": id, "last_message": last}, 0)
+        )
+    assert persist_chat.latest_tmp_chat() == "b"
+
+
+def saved_chat(ctxid: str) -> dict:
+    data = persist_chat._read_chat(ctxid)
+    data.pop("journal", None)
+    return normalized(data)
+
+
+def normalized(data: dict) -> dict:
+    for agent in data["agents"]:
+        agent["history"] = json.loads(agent["history"])
+    return data
+
+
+def full_save(context: AgentContext) -> dict:
+    # what a complete chat.json save of the context contains
+    return normalized(
+        json.loads(
+            persist_chat._safe_json_serialize(
+                persist_chat._serialize_context(context), ensure_ascii=False
+            )
+        )
+    )
+
+
+@pytest.mark.parametrize("compact_size", [0, 2000, 1024 * 1024])
+def test_journal_replay_matches_full_save(chats_dir, monkeypatch, compact_size):
+    monkeypatch.setattr(persist_chat, "JOURNAL_COMPACT_SIZE", compact_size)
+    # word counts, the tokenizer would be downloaded on first use
+    monkeypatch.setattr(
+        tokens, "get_encoding", lambda *args: SimpleNamespace(encode=str.split)
+    )
+    monkeypatch.setattr(settings, "get_settings", lambda: {
+        "chat_model_ctx_length": 100000, "chat_model_ctx_history": 0.7
+    })
+    context = AgentContext(config=SimpleNamespace(summary_cache_size_mb=0), name="journal")  # type: ignore
+    try:
+        for i in range(40):
+            agent = context.streaming_agent or context.agent0
+            agent.history.add_message(True, {"thoughts": [f"step {i}"], "tool_name": "code"})
+            item = context.log.log(type="agent", heading=f"step {i}", content="")
+            for part in range(3):
+                item.stream(content=f" part {part}")
+            agent.history.add_message(False, {"tool_result": f"result {i}"})
+            agent.data["iteration"] = i
+            context.last_message = datetime.now(timezone.utc)
+            if i % 10 == 9:
+                agent.history.new_topic()
+            if i == 15:
+                sub = Agent(1, context.config, context)
+                context.agent0.set_data(Agent.DATA_NAME_SUBORDINATE, sub)
+                sub.set_data(Agent.DATA_NAME_SUPERIOR, context.agent0)
+                context.streaming_agent = sub
+            if i == 30:
+                context.agent0.data.pop(Agent.DATA_NAME_SUBORDINATE)
+                context.streaming_agent = None
+            if i == 35:
+                context.log.reset()
+            persist_chat.save_tmp_chat(context)
+            assert saved_chat(context.id) == full_save(context), i
+        if compact_size > 2000:
+            # saves after the first one were appended to the journal
+            assert persist_chat._journals[context.id].journal_size > 2000
+    finally:
+        AgentContext.remove(context.id)
+
+
+def restart(monkeypatch):
+    # forget the index held in memory, as after a restart
+    monkeypatch.setattr(persist_chat, "_index", {})
+    monkeypatch.setattr(persist_chat, "_index_read", False)
+    monkeypatch.setattr(persist_chat, "_journals", {})
+
+
+def test_chats_are_indexed_and_loaded_when_opened(chats_dir, monkeypatch):
+    monkeypatch.setattr(
+        tokens, "get_encoding", lambda *args: SimpleNamespace(encode=str.split)
+    )
+    # the user timezone would be saved to .env
+    monkeypatch.setattr(localization, "save_dotenv_value", lambda *args: None)
+    config = SimpleNamespace(summary_cache_size_mb=0)
+    monkeypatch.setattr(persist_chat, "initialize", lambda: config)
+    context = AgentContext(config=config, name="indexed")  # type: ignore
+    try:
+        context.agent0.history.add_message(False, {"user_message": "hello"})
+        persist_chat.save_tmp_chat(context)
+        expected = full_save(context)
+    finally:
+        AgentContext.remove(context.id)
+
+    restart(monkeypatch)
+    assert persist_chat.load_tmp_chats() == [context.id]
+    assert [chat["name"] for chat in persist_chat.list_tmp_chats()] == ["indexed"]
+    loaded = persist_chat.load_tmp_chat(context.id)
+    try:
+        assert loaded and full_save(loaded) == expected
+        assert persist_chat.list_tmp_chats() == []
+    finally:
+        AgentContext.remove(context.id)
+
+    # entries of deleted chat folders are dropped on the next start
+    persist_chat.files.delete_dir(str(chats_dir / context.id))
+    restart(monkeypatch)
+    assert persist_chat.load_tmp_chats() == []
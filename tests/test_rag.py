@@ -0,0 +1,52 @@
+import io
+import random
+
+import pytest
+
+from python.helpers import rag
+
+
+def old_extract_text(content: bytes, chunk_size: int = 128) -> list[str]:
+    # implementation before iter_text, without its handling of empty decodes
+    result = []
+    pos = 0
+    while pos < len(content):
+        chunk_end = min(pos + chunk_size, len(content))
+        if chunk_end < len(content):
+            for i in range(chunk_end, min(chunk_end + 100, len(content))):
+                if content[i : i + 1] in [b" ", b"\n", b"\r"]:
+                    chunk_end = i + 1
+                    break
+        chunk = content[pos:chunk_end]
+        text = chunk.decode("utf-8", errors="ignore")
+        control_chars = sum(1 for c in text if ord(c) < 32 and c not in "\n\r\t")
+        if control_chars / len(text) > 0.3:
+            if not result or result[-1] != "[BINARY]":
+                result.append("[BINARY]")
+        elif text.strip():
+            result.append(text.strip())
+        pos = chunk_end
+    return result
+
+
+def sample(kind: str) -> bytes:
+    rng = random.Random(kind)
+    words = ["Versicherung", "policy", "Schaden", "clause", "prämie", "été", "\n"]
+    text = " ".join(rng.choice(words) for _ in range(3000)).encode()
+    binary = bytes(rng.randrange(1, 32) for _ in range(20000))
+    return {"text": text, "binary": binary, "mixed": text[:9000] + binary + text}[kind]
+
+
+@pytest.mark.parametrize("kind", ["text", "binary", "mixed"])
+def test_iter_text_matches_old_extract_text(kind, monkeypatch):
+    content = sample(kind)
+    expected = old_extract_text(content)
+    assert rag.extract_text(content) == expected
+    assert list(rag.iter_text(memoryview(content))) == expected
+    # file blocks end in the middle of chunks and words
+    monkeypatch.setattr(rag, "READ_SIZE", 300)
+    assert list(rag.iter_text(io.BytesIO(content))) == expected
+
+
+def test_chunk_without_text_is_binary():
+    assert rag.extract_text(b"\xff" * 200) == [rag.BINARY_MARKER]